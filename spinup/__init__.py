@@ -13,6 +13,7 @@ from spinup.algos.tf1.vpg.vpg import vpg as vpg_tf1
 
 from spinup.algos.pytorch.ddpg.ddpg import ddpg as ddpg_pytorch
 from spinup.algos.pytorch.ppo.ppo import ppo as ppo_pytorch
+from spinup.algos.pytorch.ppo.ppo_multiseed import ppo_multiseed as ppo_multiseed_pytorch
 from spinup.algos.pytorch.sac.sac import sac as sac_pytorch
 from spinup.algos.pytorch.td3.td3 import td3 as td3_pytorch
 from spinup.algos.pytorch.trpo.trpo import trpo as trpo_pytorch
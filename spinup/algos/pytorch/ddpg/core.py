@@ -20,6 +20,40 @@ def mlp(sizes, activation, output_activation=nn.Identity):
 def count_vars(module):
     return sum([np.prod(p.shape) for p in module.parameters()])
 
+
+# Use inference mode for the single-observation fast paths where available
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+class SingleObsMLP:
+    """
+    Evaluates an ``mlp`` on a single (1-D) observation, writing the output of
+    every layer into a preallocated tensor. Computes exactly the same ops as
+    calling the module, so results are identical.
+
+    The returned tensor is overwritten by the next call.
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.bufs = [torch.empty(1, m.out_features) if isinstance(m, nn.Linear) else None 
+                     for m in net]
+
+    def __call__(self, x):
+        # Work on (1, n) rows, as nn.Linear does internally for 1-D inputs
+        h = x.view(1, -1)
+        for m, buf in zip(self.net, self.bufs):
+            if isinstance(m, nn.Linear):
+                h = torch.mm(h, m.weight.t(), out=buf)
+                h.add_(m.bias)
+            elif isinstance(m, nn.ReLU):
+                h = torch.relu_(h)
+            elif isinstance(m, nn.Tanh):
+                h = torch.tanh_(h)
+            elif not isinstance(m, nn.Identity):
+                h = m(h)
+        return h[0]
+
 class MLPActor(nn.Module):
 
     def __init__(self, obs_dim, act_dim, hidden_sizes, activation, act_limit):
@@ -59,3 +93,31 @@ class MLPActorCritic(nn.Module):
     def act(self, obs):
         with torch.no_grad():
             return self.pi(obs).numpy()
+
+    def __getstate__(self):
+        # The fast-path cache pairs a tensor with a NumPy view of its memory,
+        # which pickling (torch.save) and deepcopy would split into two
+        # separate buffers; leave it out so that it is rebuilt on first use.
+        getstate = getattr(super(), '__getstate__', None)
+        state = dict(getstate() if getstate else self.__dict__)
+        state.pop('_single', None)
+        return state
+
+    def __setstate__(self, state):
+        # (Models saved before the cache was excluded still carry one.)
+        state.pop('_single', None)
+        super().__setstate__(state)
+
+    def act_single(self, o):
+        """
+        Fast path for ``act`` on one observation, given as a NumPy array.
+        Reuses preallocated tensors and returns the same action as ``act``.
+        """
+        if getattr(self, '_single', None) is None:
+            self._single = dict(obs=torch.empty(self.pi.pi[0].in_features),
+                                pi_net=SingleObsMLP(self.pi.pi))
+            self._single['obs_np'] = self._single['obs'].numpy()
+        s = self._single
+        with inference_mode():
+            s['obs_np'][:] = o
+            return (self.pi.act_limit * s['pi_net'](s['obs'])).numpy()
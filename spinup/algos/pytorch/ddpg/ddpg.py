@@ -6,6 +6,10 @@ import gym
 import time
 import spinup.algos.pytorch.ddpg.core as core
 from spinup.utils.logx import EpochLogger
+from spinup.utils.dyna_pytorch import DynaModel
+from spinup.utils.compile_pytorch import compile_fn, compile_optimizer
+from spinup.utils.flat_pytorch import FlatParams, polyak_update
+from spinup.utils.amp_pytorch import autocast, bf16_probe, check_bf16
 
 
 class ReplayBuffer:
@@ -32,12 +36,13 @@ class ReplayBuffer:
 
     def sample_batch(self, batch_size=32):
         idxs = np.random.randint(0, self.size, size=batch_size)
-        batch = dict(obs=self.obs_buf[idxs],
-                     obs2=self.obs2_buf[idxs],
-                     act=self.act_buf[idxs],
-                     rew=self.rew_buf[idxs],
-                     done=self.done_buf[idxs])
-        return {k: torch.as_tensor(v, dtype=torch.float32) for k,v in batch.items()}
+        # Gather each field once, into arrays that the tensors then wrap
+        batch = dict(obs=self.obs_buf.take(idxs, axis=0),
+                     obs2=self.obs2_buf.take(idxs, axis=0),
+                     act=self.act_buf.take(idxs, axis=0),
+                     rew=self.rew_buf.take(idxs),
+                     done=self.done_buf.take(idxs))
+        return {k: torch.from_numpy(v) for k,v in batch.items()}
 
 
 
@@ -45,7 +50,8 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
          steps_per_epoch=4000, epochs=100, replay_size=int(1e6), gamma=0.99, 
          polyak=0.995, pi_lr=1e-3, q_lr=1e-3, batch_size=100, start_steps=10000, 
          update_after=1000, update_every=50, act_noise=0.1, num_test_episodes=10, 
-         max_ep_len=1000, logger_kwargs=dict(), save_freq=1):
+         max_ep_len=1000, logger_kwargs=dict(), save_freq=1, real_ratio=1.0,
+         dyna_kwargs=dict(), flat_params=False, compile_update=False, bf16=False):
     """
     Deep Deterministic Policy Gradient (DDPG)
 
@@ -128,6 +134,33 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         save_freq (int): How often (in terms of gap between epochs) to save
             the current policy and value function.
 
+        real_ratio (float): Fraction of each training batch drawn from real
+            env interactions. The rest is drawn from short imagined rollouts
+            of a learned ensemble dynamics model (Dyna-style). At 1.0 (the
+            default) no model is built and training uses real data only.
+            (The TF1 algorithms have no such option.)
+
+        dyna_kwargs (dict): Any kwargs appropriate for the DynaModel object
+            in ``spinup/utils/dyna_pytorch.py`` (model size, refit and
+            rollout schedule, termination function).
+
+        flat_params (bool): Store the parameters (and gradients) of the
+            actor-critic and of its target in one contiguous buffer each,
+            so that the target update is a single vectorized op instead of
+            a loop over parameter tensors.
+
+        compile_update (bool): Compile the loss functions and optimizer
+            steps with ``torch.compile`` (see
+            ``spinup/utils/compile_pytorch.py``). The first updates are slow
+            while compiling. Runs eagerly if compilation fails.
+
+        bf16 (bool): Compute the losses (and hence their gradients) under
+            bfloat16 autocast on CPU (see ``spinup/utils/amp_pytorch.py``).
+            Parameters, optimizer state and target networks stay in fp32.
+            Each epoch, the bf16 and fp32 losses are also compared on a
+            fresh batch, and their relative deviation and the bf16 speedup
+            are logged.
+
     """
 
     logger = EpochLogger(**logger_kwargs)
@@ -146,6 +179,9 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     # Create actor-critic module and target networks
     ac = actor_critic(env.observation_space, env.action_space, **ac_kwargs)
     ac_targ = deepcopy(ac)
+    if flat_params:
+        FlatParams(ac)
+        FlatParams(ac_targ)
 
     # Freeze target networks with respect to optimizers (only update via polyak averaging)
     for p in ac_targ.parameters():
@@ -154,6 +190,9 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     # Experience buffer
     replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
 
+    # Learned dynamics model for Dyna-style synthetic data (optional)
+    dyna = DynaModel(obs_dim[0], act_dim, **dyna_kwargs) if real_ratio < 1 else None
+
     # Count variables (protip: try to get a feel for how different size networks behave!)
     var_counts = tuple(core.count_vars(module) for module in [ac.pi, ac.q])
     logger.log('\nNumber of parameters: \t pi: %d, \t q: %d\n'%var_counts)
@@ -173,7 +212,7 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         loss_q = ((q - backup)**2).mean()
 
         # Useful info for logging
-        loss_info = dict(QVals=q.detach().numpy())
+        loss_info = dict(QVals=q.detach().float().numpy())
 
         return loss_q, loss_info
 
@@ -187,13 +226,24 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     pi_optimizer = Adam(ac.pi.parameters(), lr=pi_lr)
     q_optimizer = Adam(ac.q.parameters(), lr=q_lr)
 
+    # Optionally compile the losses and optimizer steps
+    if compile_update:
+        compute_loss_pi = compile_fn(compute_loss_pi)
+        compute_loss_q = compile_fn(compute_loss_q)
+        compile_optimizer(pi_optimizer)
+        compile_optimizer(q_optimizer)
+
+    # Optionally compute the losses in bf16 mixed precision
+    bf16 = check_bf16(bf16)
+
     # Set up model saving
     logger.setup_pytorch_saver(ac)
 
     def update(data):
         # First run one gradient descent step for Q.
         q_optimizer.zero_grad()
-        loss_q, loss_info = compute_loss_q(data)
+        with autocast(bf16):
+            loss_q, loss_info = compute_loss_q(data)
         loss_q.backward()
         q_optimizer.step()
 
@@ -204,7 +254,8 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
 
         # Next run one gradient descent step for pi.
         pi_optimizer.zero_grad()
-        loss_pi = compute_loss_pi(data)
+        with autocast(bf16):
+            loss_pi = compute_loss_pi(data)
         loss_pi.backward()
         pi_optimizer.step()
 
@@ -216,15 +267,26 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         logger.store(LossQ=loss_q.item(), LossPi=loss_pi.item(), **loss_info)
 
         # Finally, update target networks by polyak averaging.
-        with torch.no_grad():
-            for p, p_targ in zip(ac.parameters(), ac_targ.parameters()):
-                # NB: We use an in-place operations "mul_", "add_" to update target
-                # params, as opposed to "mul" and "add", which would make new tensors.
-                p_targ.data.mul_(polyak)
-                p_targ.data.add_((1 - polyak) * p.data)
+        if flat_params:
+            polyak_update(polyak, ac.flat_params, ac_targ.flat_params)
+        else:
+            with torch.no_grad():
+                for p, p_targ in zip(ac.parameters(), ac_targ.parameters()):
+                    # NB: We use an in-place operations "mul_", "add_" to update target
+                    # params, as opposed to "mul" and "add", which would make new tensors.
+                    p_targ.data.mul_(polyak)
+                    p_targ.data.add_((1 - polyak) * p.data)
+
+    def rollout_policy(o):
+        a = ac.pi(o)
+        a += act_noise * torch.randn_like(a)
+        return torch.clamp(a, -act_limit, act_limit)
 
     def get_action(o, noise_scale):
-        a = ac.act(torch.as_tensor(o, dtype=torch.float32))
+        if hasattr(ac, 'act_single'):
+            a = ac.act_single(o)
+        else:
+            a = ac.act(torch.as_tensor(o, dtype=torch.float32))
         a += noise_scale * np.random.randn(act_dim)
         return np.clip(a, -act_limit, act_limit)
 
@@ -276,10 +338,19 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
             logger.store(EpRet=ep_ret, EpLen=ep_len)
             o, ep_ret, ep_len = env.reset(), 0, 0
 
+        # Model handling: refit the dynamics model to the real data, then
+        # refresh the imagined transitions using the current policy
+        if dyna is not None and t >= update_after and t % dyna.train_every == 0:
+            logger.store(LossModel=dyna.train(replay_buffer))
+            dyna.generate(replay_buffer, rollout_policy)
+
         # Update handling
         if t >= update_after and t % update_every == 0:
             for _ in range(update_every):
-                batch = replay_buffer.sample_batch(batch_size)
+                if dyna is None:
+                    batch = replay_buffer.sample_batch(batch_size)
+                else:
+                    batch = dyna.sample_batch(replay_buffer, batch_size, real_ratio)
                 update(data=batch)
 
         # End of epoch handling
@@ -293,6 +364,14 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
             # Test the performance of the deterministic version of the agent.
             test_agent()
 
+            # Compare the bf16 and fp32 losses on a fresh batch
+            if bf16:
+                batch = replay_buffer.sample_batch(batch_size)
+                dev_q, speedup_q = bf16_probe(compute_loss_q, batch, ac.parameters())
+                dev_pi, speedup_pi = bf16_probe(compute_loss_pi, batch, ac.parameters())
+                logger.store(Bf16DevQ=dev_q, Bf16SpeedupQ=speedup_q,
+                             Bf16DevPi=dev_pi, Bf16SpeedupPi=speedup_pi)
+
             # Log info about epoch
             logger.log_tabular('Epoch', epoch)
             logger.log_tabular('EpRet', with_min_and_max=True)
@@ -303,6 +382,13 @@ def ddpg(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
             logger.log_tabular('QVals', with_min_and_max=True)
             logger.log_tabular('LossPi', average_only=True)
             logger.log_tabular('LossQ', average_only=True)
+            if bf16:
+                logger.log_tabular('Bf16DevQ', average_only=True)
+                logger.log_tabular('Bf16DevPi', average_only=True)
+                logger.log_tabular('Bf16SpeedupQ', average_only=True)
+                logger.log_tabular('Bf16SpeedupPi', average_only=True)
+            if dyna is not None:
+                logger.log_tabular('LossModel', average_only=True)
             logger.log_tabular('Time', time.time()-start_time)
             logger.dump_tabular()
 
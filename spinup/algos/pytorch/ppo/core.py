@@ -1,9 +1,11 @@
+import math
 import numpy as np
 import scipy.signal
 from gym.spaces import Box, Discrete
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.distributions.normal import Normal
 from torch.distributions.categorical import Categorical
 
@@ -26,6 +28,40 @@ def count_vars(module):
     return sum([np.prod(p.shape) for p in module.parameters()])
 
 
+# Use inference mode for the single-observation fast paths where available
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+class SingleObsMLP:
+    """
+    Evaluates an ``mlp`` on a single (1-D) observation, writing the output of
+    every layer into a preallocated tensor. Computes exactly the same ops as
+    calling the module, so results are identical.
+
+    The returned tensor is overwritten by the next call.
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.bufs = [torch.empty(1, m.out_features) if isinstance(m, nn.Linear) else None 
+                     for m in net]
+
+    def __call__(self, x):
+        # Work on (1, n) rows, as nn.Linear does internally for 1-D inputs
+        h = x.view(1, -1)
+        for m, buf in zip(self.net, self.bufs):
+            if isinstance(m, nn.Linear):
+                h = torch.mm(h, m.weight.t(), out=buf)
+                h.add_(m.bias)
+            elif isinstance(m, nn.ReLU):
+                h = torch.relu_(h)
+            elif isinstance(m, nn.Tanh):
+                h = torch.tanh_(h)
+            elif not isinstance(m, nn.Identity):
+                h = m(h)
+        return h[0]
+
+
 def discount_cumsum(x, discount):
     """
     magic from rllab for computing discounted cumulative sums of vectors.
@@ -115,6 +151,7 @@ class MLPActorCritic(nn.Module):
         obs_dim = observation_space.shape[0]
 
         # policy builder depends on action space
+        self.gaussian = isinstance(action_space, Box)
         if isinstance(action_space, Box):
             self.pi = MLPGaussianActor(obs_dim, action_space.shape[0], hidden_sizes, activation)
         elif isinstance(action_space, Discrete):
@@ -132,4 +169,55 @@ class MLPActorCritic(nn.Module):
         return a.numpy(), v.numpy(), logp_a.numpy()
 
     def act(self, obs):
-        return self.step(obs)[0]
\ No newline at end of file
+        return self.step(obs)[0]
+
+    def __getstate__(self):
+        # The fast-path cache pairs a tensor with a NumPy view of its memory,
+        # which pickling (torch.save) and deepcopy would split into two
+        # separate buffers; leave it out so that it is rebuilt on first use.
+        getstate = getattr(super(), '__getstate__', None)
+        state = dict(getstate() if getstate else self.__dict__)
+        state.pop('_single', None)
+        return state
+
+    def __setstate__(self, state):
+        # (Models saved before the cache was excluded still carry one.)
+        state.pop('_single', None)
+        super().__setstate__(state)
+
+    def step_single(self, o):
+        """
+        Fast path for ``step`` on one observation, given as a NumPy array.
+
+        Builds no distribution objects and reuses preallocated tensors, but
+        draws from the random number generator exactly as ``step`` does, so
+        it returns the same action, value and log prob.
+        """
+        if getattr(self, '_single', None) is None:
+            self._single = dict(obs=torch.empty(self.v.v_net[0].in_features),
+                                pi_net=SingleObsMLP(self.pi.mu_net if self.gaussian 
+                                                    else self.pi.logits_net),
+                                v_net=SingleObsMLP(self.v.v_net))
+            self._single['obs_np'] = self._single['obs'].numpy()
+        s = self._single
+        with inference_mode():
+            s['obs_np'][:] = o
+            obs = s['obs']
+            if self.gaussian:
+                # Same ops as Normal(mu, std).sample() and .log_prob(a)
+                mu = s['pi_net'](obs)
+                std = torch.exp(self.pi.log_std)
+                a = torch.normal(mu, std)
+                logp_a = (-((a - mu) ** 2) / (2 * std**2) - std.log() 
+                          - math.log(math.sqrt(2 * math.pi))).sum(axis=-1)
+            else:
+                # Same ops as Categorical(logits=logits).sample() and .log_prob(a)
+                logits = s['pi_net'](obs)
+                logits = logits - logits.logsumexp(dim=-1, keepdim=True)
+                a = torch.multinomial(F.softmax(logits, dim=-1).reshape(1, -1), 1, True).reshape(())
+                logp_a = logits[a]
+            v = torch.squeeze(s['v_net'](obs), -1)
+            return a.numpy(), v.numpy().copy(), logp_a.numpy()
+
+    def act_single(self, o):
+        return self.step_single(o)[0]
\ No newline at end of file
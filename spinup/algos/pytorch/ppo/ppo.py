@@ -4,7 +4,10 @@ from torch.optim import Adam
 import gym
 import time
 import spinup.algos.pytorch.ppo.core as core
+from spinup.utils.advantages import gae_and_returns
 from spinup.utils.logx import EpochLogger
+from spinup.utils.compile_pytorch import compile_fn, compile_optimizer
+from spinup.utils.flat_pytorch import FlatParams
 from spinup.utils.mpi_pytorch import setup_pytorch_for_mpi, sync_params, mpi_avg_grads
 from spinup.utils.mpi_tools import mpi_fork, mpi_avg, proc_id, mpi_statistics_scalar, num_procs
 
@@ -24,8 +27,13 @@ class PPOBuffer:
         self.ret_buf = np.zeros(size, dtype=np.float32)
         self.val_buf = np.zeros(size, dtype=np.float32)
         self.logp_buf = np.zeros(size, dtype=np.float32)
+        # Tensors sharing memory with the arrays, handed to the update as is
+        self.data = {k: torch.from_numpy(v) for k,v in dict(
+            obs=self.obs_buf, act=self.act_buf, ret=self.ret_buf,
+            adv=self.adv_buf, logp=self.logp_buf).items()}
         self.gamma, self.lam = gamma, lam
         self.ptr, self.path_start_idx, self.max_size = 0, 0, size
+        self.path_ends, self.last_vals = [], []
 
     def store(self, obs, act, rew, val, logp):
         """
@@ -42,11 +50,12 @@ class PPOBuffer:
     def finish_path(self, last_val=0):
         """
         Call this at the end of a trajectory, or when one gets cut off
-        by an epoch ending. This looks back in the buffer to where the
-        trajectory started, and uses rewards and value estimates from
-        the whole trajectory to compute advantage estimates with GAE-Lambda,
-        as well as compute the rewards-to-go for each state, to use as
-        the targets for the value function.
+        by an epoch ending. This marks where the trajectory ends, so that
+        ``get`` can use rewards and value estimates from the whole
+        trajectory to compute advantage estimates with GAE-Lambda, as well
+        as compute the rewards-to-go for each state, to use as the targets
+        for the value function. (All trajectories of the epoch are processed
+        together; see ``spinup/utils/advantages.py``.)
 
         The "last_val" argument should be 0 if the trajectory ended
         because the agent reached a terminal state (died), and otherwise
@@ -55,17 +64,8 @@ class PPOBuffer:
         for timesteps beyond the arbitrary episode horizon (or epoch cutoff).
         """
 
-        path_slice = slice(self.path_start_idx, self.ptr)
-        rews = np.append(self.rew_buf[path_slice], last_val)
-        vals = np.append(self.val_buf[path_slice], last_val)
-        
-        # the next two lines implement GAE-Lambda advantage calculation
-        deltas = rews[:-1] + self.gamma * vals[1:] - vals[:-1]
-        self.adv_buf[path_slice] = core.discount_cumsum(deltas, self.gamma * self.lam)
-        
-        # the next line computes rewards-to-go, to be targets for the value function
-        self.ret_buf[path_slice] = core.discount_cumsum(rews, self.gamma)[:-1]
-        
+        self.path_ends.append(self.ptr)
+        self.last_vals.append(last_val)
         self.path_start_idx = self.ptr
 
     def get(self):
@@ -73,22 +73,29 @@ class PPOBuffer:
         Call this at the end of an epoch to get all of the data from
         the buffer, with advantages appropriately normalized (shifted to have
         mean zero and std one). Also, resets some pointers in the buffer.
+
+        The returned tensors share memory with the buffer (nothing is
+        copied), so they hold this epoch's data until the next ``store``.
         """
         assert self.ptr == self.max_size    # buffer has to be full before you can get
         self.ptr, self.path_start_idx = 0, 0
-        # the next two lines implement the advantage normalization trick
+        # GAE-Lambda advantages and rewards-to-go, for all trajectories at once
+        self.adv_buf[:], self.ret_buf[:] = gae_and_returns(
+            self.rew_buf, self.val_buf, self.path_ends, self.last_vals, self.gamma, self.lam)
+        self.path_ends, self.last_vals = [], []
+        # the next three lines implement the advantage normalization trick (in place)
         adv_mean, adv_std = mpi_statistics_scalar(self.adv_buf)
-        self.adv_buf = (self.adv_buf - adv_mean) / adv_std
-        data = dict(obs=self.obs_buf, act=self.act_buf, ret=self.ret_buf,
-                    adv=self.adv_buf, logp=self.logp_buf)
-        return {k: torch.as_tensor(v, dtype=torch.float32) for k,v in data.items()}
+        self.adv_buf -= adv_mean
+        self.adv_buf /= adv_std
+        return dict(self.data)
 
 
 
 def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0, 
         steps_per_epoch=4000, epochs=50, gamma=0.99, clip_ratio=0.2, pi_lr=3e-4,
         vf_lr=1e-3, train_pi_iters=80, train_v_iters=80, lam=0.97, max_ep_len=1000,
-        target_kl=0.01, logger_kwargs=dict(), save_freq=10):
+        target_kl=0.01, logger_kwargs=dict(), save_freq=10,
+        flat_params=False, compile_update=False, minibatch_size=None):
     """
     Proximal Policy Optimization (by clipping), 
 
@@ -190,6 +197,22 @@ def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         save_freq (int): How often (in terms of gap between epochs) to save
             the current policy and value function.
 
+        flat_params (bool): Store the parameters and gradients of the
+            actor-critic in one contiguous buffer, so that syncing parameters
+            and averaging gradients across MPI processes each take a single
+            MPI call instead of one per parameter tensor.
+
+        compile_update (bool): Compile the loss functions and optimizer
+            steps with ``torch.compile`` (see
+            ``spinup/utils/compile_pytorch.py``). The first updates are slow
+            while compiling. Runs eagerly if compilation fails.
+
+        minibatch_size (int): If set, the update makes passes over the
+            epoch's data in shuffled minibatches of this size (per MPI
+            process), and ``train_pi_iters`` and ``train_v_iters`` count
+            passes instead of gradient steps. Early stopping then checks
+            the mean KL over each pass of policy updates.
+
     """
 
     # Special function to avoid certain slowdowns from PyTorch + MPI combo.
@@ -211,6 +234,8 @@ def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
 
     # Create actor-critic module
     ac = actor_critic(env.observation_space, env.action_space, **ac_kwargs)
+    if flat_params:
+        FlatParams(ac)
 
     # Sync params across processes
     sync_params(ac)
@@ -233,11 +258,12 @@ def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         clip_adv = torch.clamp(ratio, 1-clip_ratio, 1+clip_ratio) * adv
         loss_pi = -(torch.min(ratio * adv, clip_adv)).mean()
 
-        # Useful extra info
-        approx_kl = (logp_old - logp).mean().item()
-        ent = pi.entropy().mean().item()
+        # Useful extra info (as tensors, so that a compiled loss has no
+        # graph breaks; update() calls .item())
+        approx_kl = (logp_old - logp).mean().detach()
+        ent = pi.entropy().mean().detach()
         clipped = ratio.gt(1+clip_ratio) | ratio.lt(1-clip_ratio)
-        clipfrac = torch.as_tensor(clipped, dtype=torch.float32).mean().item()
+        clipfrac = torch.as_tensor(clipped, dtype=torch.float32).mean()
         pi_info = dict(kl=approx_kl, ent=ent, cf=clipfrac)
 
         return loss_pi, pi_info
@@ -251,9 +277,28 @@ def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     pi_optimizer = Adam(ac.pi.parameters(), lr=pi_lr)
     vf_optimizer = Adam(ac.v.parameters(), lr=vf_lr)
 
+    # Optionally compile the losses and optimizer steps
+    if compile_update:
+        compute_loss_pi = compile_fn(compute_loss_pi)
+        compute_loss_v = compile_fn(compute_loss_v)
+        compile_optimizer(pi_optimizer)
+        compile_optimizer(vf_optimizer)
+
     # Set up model saving
     logger.setup_pytorch_saver(ac)
 
+    # Shuffled minibatches that cover the data once (or all the data at once)
+    def minibatches(data):
+        n = len(data['obs'])
+        if minibatch_size is None or minibatch_size >= n:
+            yield data
+            return
+        idxs = torch.randperm(n)
+        # Drop the remainder, so that all minibatches have the same size
+        for start in range(0, n - minibatch_size + 1, minibatch_size):
+            mb = idxs[start:start+minibatch_size]
+            yield {k: v[mb] for k, v in data.items()}
+
     def update():
         data = buf.get()
 
@@ -262,33 +307,58 @@ def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         v_l_old = compute_loss_v(data).item()
 
         # Train policy with multiple steps of gradient descent
-        for i in range(train_pi_iters):
-            pi_optimizer.zero_grad()
-            loss_pi, pi_info = compute_loss_pi(data)
-            kl = mpi_avg(pi_info['kl'])
-            if kl > 1.5 * target_kl:
-                logger.log('Early stopping at step %d due to reaching max kl.'%i)
-                break
-            loss_pi.backward()
-            mpi_avg_grads(ac.pi)    # average grads across MPI processes
-            pi_optimizer.step()
+        if minibatch_size is None:
+            for i in range(train_pi_iters):
+                pi_optimizer.zero_grad()
+                loss_pi, pi_info = compute_loss_pi(data)
+                kl = mpi_avg(pi_info['kl'].item())
+                if kl > 1.5 * target_kl:
+                    logger.log('Early stopping at step %d due to reaching max kl.'%i)
+                    break
+                loss_pi.backward()
+                mpi_avg_grads(ac.pi)    # average grads across MPI processes
+                pi_optimizer.step()
+        else:
+            for i in range(train_pi_iters):
+                kls = []
+                for mb in minibatches(data):
+                    pi_optimizer.zero_grad()
+                    loss_pi, pi_info = compute_loss_pi(mb)
+                    kls.append(pi_info['kl'])
+                    loss_pi.backward()
+                    mpi_avg_grads(ac.pi)    # average grads across MPI processes
+                    pi_optimizer.step()
+                kl = mpi_avg(torch.stack(kls).mean().item())
+                if kl > 1.5 * target_kl:
+                    logger.log('Early stopping at pass %d due to reaching max kl.'%i)
+                    break
 
         logger.store(StopIter=i)
 
         # Value function learning
         for i in range(train_v_iters):
-            vf_optimizer.zero_grad()
-            loss_v = compute_loss_v(data)
-            loss_v.backward()
-            mpi_avg_grads(ac.v)    # average grads across MPI processes
-            vf_optimizer.step()
-
-        # Log changes from update
-        kl, ent, cf = pi_info['kl'], pi_info_old['ent'], pi_info['cf']
+            for mb in minibatches(data):
+                vf_optimizer.zero_grad()
+                loss_v = compute_loss_v(mb)
+                loss_v.backward()
+                mpi_avg_grads(ac.v)    # average grads across MPI processes
+                vf_optimizer.step()
+
+        # Log changes from update (on the full batch, after all the steps)
+        with torch.no_grad():
+            pi_l_new, pi_info = compute_loss_pi(data)
+            v_l_new = compute_loss_v(data)
+        kl, ent, cf = pi_info['kl'].item(), pi_info_old['ent'].item(), pi_info['cf'].item()
         logger.store(LossPi=pi_l_old, LossV=v_l_old,
                      KL=kl, Entropy=ent, ClipFrac=cf,
-                     DeltaLossPi=(loss_pi.item() - pi_l_old),
-                     DeltaLossV=(loss_v.item() - v_l_old))
+                     DeltaLossPi=(pi_l_new.item() - pi_l_old),
+                     DeltaLossV=(v_l_new.item() - v_l_old))
+
+    # Use the actor-critic's single-observation fast path if it has one
+    if hasattr(ac, 'step_single'):
+        step = ac.step_single
+    else:
+        step = lambda o: ac.step(torch.as_tensor(o, dtype=torch.float32))
 
     # Prepare for interaction with environment
     start_time = time.time()
@@ -297,7 +367,7 @@ def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     # Main loop: collect experience in env and update/log each epoch
     for epoch in range(epochs):
         for t in range(local_steps_per_epoch):
-            a, v, logp = ac.step(torch.as_tensor(o, dtype=torch.float32))
+            a, v, logp = step(o)
 
             next_o, r, d, _ = env.step(a)
             ep_ret += r
@@ -319,7 +389,7 @@ def ppo(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
                     print('Warning: trajectory cut off by epoch at %d steps.'%ep_len, flush=True)
                 # if trajectory didn't reach terminal state, bootstrap value target
                 if timeout or epoch_ended:
-                    _, v, _ = ac.step(torch.as_tensor(o, dtype=torch.float32))
+                    _, v, _ = step(o)
                 else:
                     v = 0
                 buf.finish_path(v)
@@ -0,0 +1,384 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.distributions.normal import Normal
+from torch.distributions.categorical import Categorical
+import gym
+import time
+import spinup.algos.pytorch.ppo.core as core
+from spinup.algos.pytorch.ppo.ppo import PPOBuffer
+from spinup.utils.logx import EpochLogger
+from spinup.utils.run_utils import setup_logger_kwargs
+
+
+class StackedMLP(nn.Module):
+    """
+    The ``mlp`` networks of K agents (with identical architectures) as one
+    module. The weights of each layer are stacked along a leading agent
+    dimension, so all K networks are evaluated with one batched matmul
+    (``baddbmm``) per layer. Inputs have shape (K, batch, in_dim).
+    """
+
+    def __init__(self, nets):
+        super().__init__()
+        layers = list(zip(*[[m for m in net if isinstance(m, nn.Linear)] for net in nets]))
+        self.weights = nn.ParameterList([nn.Parameter(torch.stack([m.weight.data.t() for m in layer]))
+                                         for layer in layers])
+        self.biases = nn.ParameterList([nn.Parameter(torch.stack([m.bias.data[None] for m in layer]))
+                                        for layer in layers])
+        # mlp alternates linear layers and activations
+        self.activations = nn.ModuleList([m for m in nets[0] if not isinstance(m, nn.Linear)])
+
+    def forward(self, x):
+        for w, b, act in zip(self.weights, self.biases, self.activations):
+            x = act(torch.baddbmm(b, x, w))
+        return x
+
+    def unstack(self, nets):
+        """Copy the weights of each agent back into its own ``mlp``."""
+        layers = zip(*[[m for m in net if isinstance(m, nn.Linear)] for net in nets])
+        with torch.no_grad():
+            for w, b, layer in zip(self.weights, self.biases, layers):
+                for k, m in enumerate(layer):
+                    m.weight.copy_(w[k].t())
+                    m.bias.copy_(b[k, 0])
+
+
+class StackedMLPActorCritic(nn.Module):
+    """
+    K ``core.MLPActorCritic`` agents, evaluated together. Observations and
+    actions carry a leading agent dimension: (K, batch, ...).
+    """
+
+    def __init__(self, agents):
+        super().__init__()
+        self.gaussian = agents[0].gaussian
+        self.pi_net = StackedMLP([ac.pi.mu_net if self.gaussian else ac.pi.logits_net
+                                  for ac in agents])
+        if self.gaussian:
+            self.log_std = nn.Parameter(torch.stack([ac.pi.log_std.data[None] for ac in agents]))
+        self.v_net = StackedMLP([ac.v.v_net for ac in agents])
+
+    def pi_parameters(self):
+        params = list(self.pi_net.parameters())
+        return params + [self.log_std] if self.gaussian else params
+
+    def _log_prob(self, pi, act):
+        return pi.log_prob(act).sum(axis=-1) if self.gaussian else pi.log_prob(act)
+
+    def pi(self, obs, act=None):
+        out = self.pi_net(obs)
+        pi = Normal(out, torch.exp(self.log_std)) if self.gaussian else Categorical(logits=out)
+        logp_a = None
+        if act is not None:
+            logp_a = self._log_prob(pi, act)
+        return pi, logp_a
+
+    def v(self, obs):
+        return torch.squeeze(self.v_net(obs), -1)
+
+    def step(self, obs):
+        """One step of every agent: ``obs`` has shape (K, obs_dim)."""
+        with torch.no_grad():
+            obs = torch.as_tensor(obs, dtype=torch.float32)[:, None]
+            pi, _ = self.pi(obs)
+            a = pi.sample()
+            logp_a = self._log_prob(pi, a)
+            v = self.v(obs)
+        return a[:, 0].numpy(), v[:, 0].numpy(), logp_a[:, 0].numpy()
+
+    def value(self, obs):
+        """Value estimates of every agent: ``obs`` has shape (K, obs_dim)."""
+        with torch.no_grad():
+            return self.v(torch.as_tensor(obs, dtype=torch.float32)[:, None])[:, 0].numpy()
+
+    def unstack(self, agents):
+        """Copy the parameters of each agent back into its own module."""
+        self.pi_net.unstack([ac.pi.mu_net if self.gaussian else ac.pi.logits_net
+                             for ac in agents])
+        self.v_net.unstack([ac.v.v_net for ac in agents])
+        if self.gaussian:
+            with torch.no_grad():
+                for k, ac in enumerate(agents):
+                    ac.pi.log_std.copy_(self.log_std[k, 0])
+
+
+class StackedAdam:
+    """
+    Adam for parameters stacked along a leading agent dimension, keeping a
+    separate step count per agent. ``step(mask)`` only updates the agents
+    selected by ``mask``, so each agent follows exactly the updates a
+    ``torch.optim.Adam`` of its own would make, even when agents stop
+    early at different iterations.
+    """
+
+    def __init__(self, params, lr, betas=(0.9, 0.999), eps=1e-8):
+        self.params = list(params)
+        self.lr, self.betas, self.eps = lr, betas, eps
+        num_agents = len(self.params[0])
+        self.t = torch.zeros(num_agents)
+        self.exp_avg = [torch.zeros_like(p) for p in self.params]
+        self.exp_avg_sq = [torch.zeros_like(p) for p in self.params]
+
+    def zero_grad(self):
+        for p in self.params:
+            p.grad = None
+
+    @torch.no_grad()
+    def step(self, mask):
+        beta1, beta2 = self.betas
+        self.t += mask.float()
+        bias_correction1 = 1 - beta1 ** self.t
+        bias_correction2 = 1 - beta2 ** self.t
+        for p, m, v in zip(self.params, self.exp_avg, self.exp_avg_sq):
+            shape = (-1,) + (1,) * (p.dim() - 1)
+            k = mask.view(shape)
+            g = p.grad
+            m.copy_(torch.where(k, beta1 * m + (1 - beta1) * g, m))
+            v.copy_(torch.where(k, beta2 * v + (1 - beta2) * g * g, v))
+            denom = v.sqrt() / bias_correction2.clamp(min=1e-12).sqrt().view(shape) + self.eps
+            step = self.lr / bias_correction1.clamp(min=1e-12).view(shape) * m / denom
+            p.sub_(torch.where(k, step, torch.zeros_like(step)))
+
+
+
+def ppo_multiseed(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(),
+        seeds=(0, 10, 20), steps_per_epoch=4000, epochs=50, gamma=0.99,
+        clip_ratio=0.2, pi_lr=3e-4, vf_lr=1e-3, train_pi_iters=80, train_v_iters=80,
+        lam=0.97, max_ep_len=1000, target_kl=0.01, exp_name='ppo_multiseed',
+        data_dir=None, datestamp=False, save_freq=10):
+    """
+    Proximal Policy Optimization (by clipping), for several seeds at once.
+
+    Trains one independent PPO agent per seed in a single process. The
+    networks of all agents are stacked into one module, so acting and every
+    gradient step run as batched ops for all agents together, and each
+    agent steps its own copy of the environment. This is much faster than
+    running the seeds in separate processes when the networks are small.
+
+    Agent ``k`` is initialized exactly as ``ppo`` with ``seed=seeds[k]``
+    would, and follows the same update rule (including early stopping on
+    KL). Each agent logs to, and saves a normal ``core.MLPActorCritic``
+    to, its own output directory, laid out as for an ``ExperimentGrid``
+    over seeds: ``data_dir/exp_name/exp_name_s[seed]``.
+
+    Args:
+        env_fn : A function which creates a copy of the environment.
+            The environment must satisfy the OpenAI Gym API.
+
+        actor_critic: The constructor method for the PyTorch Module of one
+            agent. Must build a ``core.MLPActorCritic`` (or a module with
+            the same ``pi`` and ``v`` submodules).
+
+        ac_kwargs (dict): Any kwargs appropriate for the ActorCritic object
+            you provided to PPO.
+
+        seeds (tuple): Seeds of the agents to train, one agent per seed.
+
+        exp_name (str): Name of the experiment, used for the output
+            directories.
+
+        data_dir (str): Where to put the output directories. Defaults to
+            ``DEFAULT_DATA_DIR`` in ``spinup/user_config.py``.
+
+        datestamp (bool): Whether to include a date and timestamp in the
+            names of the output directories.
+
+        The other args are as for ``ppo``, and apply to every agent.
+
+    """
+
+    config = dict(locals())
+    num_agents = len(seeds)
+
+    # One logger per agent, each with its own output directory
+    loggers = []
+    for seed in seeds:
+        logger = EpochLogger(**setup_logger_kwargs(exp_name, seed, data_dir, datestamp))
+        logger.save_config(dict(config, seed=seed))
+        loggers.append(logger)
+
+    # Create each agent's actor-critic module, initialized as in ppo
+    envs = [env_fn() for _ in seeds]
+    agents = []
+    for seed, env in zip(seeds, envs):
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        agents.append(actor_critic(env.observation_space, env.action_space, **ac_kwargs))
+    obs_dim = envs[0].observation_space.shape
+    act_dim = envs[0].action_space.shape
+
+    # All agents in one module with stacked parameters
+    ac = StackedMLPActorCritic(agents)
+
+    # Count variables
+    var_counts = tuple(core.count_vars(module) for module in [agents[0].pi, agents[0].v])
+    for logger in loggers:
+        logger.log('\nNumber of parameters: \t pi: %d, \t v: %d\n'%var_counts)
+
+    # Set up experience buffers
+    bufs = [PPOBuffer(obs_dim, act_dim, steps_per_epoch, gamma, lam) for _ in seeds]
+
+    # Set up function for computing PPO policy loss, per agent
+    def compute_loss_pi(data):
+        obs, act, adv, logp_old = data['obs'], data['act'], data['adv'], data['logp']
+
+        # Policy loss
+        pi, logp = ac.pi(obs, act)
+        ratio = torch.exp(logp - logp_old)
+        clip_adv = torch.clamp(ratio, 1-clip_ratio, 1+clip_ratio) * adv
+        loss_pi = -(torch.min(ratio * adv, clip_adv)).mean(dim=1)
+
+        # Useful extra info
+        approx_kl = (logp_old - logp).mean(dim=1).detach()
+        ent = pi.entropy().reshape(num_agents, -1).mean(dim=1).detach()
+        clipped = ratio.gt(1+clip_ratio) | ratio.lt(1-clip_ratio)
+        clipfrac = torch.as_tensor(clipped, dtype=torch.float32).mean(dim=1)
+        pi_info = dict(kl=approx_kl, ent=ent, cf=clipfrac)
+
+        return loss_pi, pi_info
+
+    # Set up function for computing value loss, per agent
+    def compute_loss_v(data):
+        obs, ret = data['obs'], data['ret']
+        return ((ac.v(obs) - ret)**2).mean(dim=1)
+
+    # Set up optimizers for policy and value function
+    pi_optimizer = StackedAdam(ac.pi_parameters(), lr=pi_lr)
+    vf_optimizer = StackedAdam(ac.v_net.parameters(), lr=vf_lr)
+
+    # Set up model saving
+    for logger, agent in zip(loggers, agents):
+        logger.setup_pytorch_saver(agent)
+
+    def update():
+        data = [buf.get() for buf in bufs]
+        data = {k: torch.stack([d[k] for d in data]) for k in data[0]}
+
+        with torch.no_grad():
+            pi_l_old, pi_info_old = compute_loss_pi(data)
+            v_l_old = compute_loss_v(data)
+
+        # Train policies with multiple steps of gradient descent; agents
+        # stop individually once their KL gets too large
+        active = torch.ones(num_agents, dtype=torch.bool)
+        stop_iter = torch.full((num_agents,), train_pi_iters-1)
+        loss_pi_last, kl_last, cf_last = pi_l_old.clone(), pi_info_old['kl'], pi_info_old['cf']
+        for i in range(train_pi_iters):
+            pi_optimizer.zero_grad()
+            loss_pi, pi_info = compute_loss_pi(data)
+            loss_pi_last = torch.where(active, loss_pi.detach(), loss_pi_last)
+            kl_last = torch.where(active, pi_info['kl'], kl_last)
+            cf_last = torch.where(active, pi_info['cf'], cf_last)
+            stopped = active & (pi_info['kl'] > 1.5 * target_kl)
+            for k in torch.nonzero(stopped).flatten().tolist():
+                loggers[k].log('Early stopping at step %d due to reaching max kl.'%i)
+                stop_iter[k] = i
+            active = active & ~stopped
+            if not active.any():
+                break
+            loss_pi.sum().backward()
+            pi_optimizer.step(active)
+
+        # Value function learning
+        for i in range(train_v_iters):
+            vf_optimizer.zero_grad()
+            loss_v = compute_loss_v(data)
+            loss_v.sum().backward()
+            vf_optimizer.step(torch.ones(num_agents, dtype=torch.bool))
+
+        # Log changes from update
+        for k, logger in enumerate(loggers):
+            logger.store(StopIter=stop_iter[k].item())
+            logger.store(LossPi=pi_l_old[k].item(), LossV=v_l_old[k].item(),
+                         KL=kl_last[k].item(), Entropy=pi_info_old['ent'][k].item(),
+                         ClipFrac=cf_last[k].item(),
+                         DeltaLossPi=(loss_pi_last[k] - pi_l_old[k]).item(),
+                         DeltaLossV=(loss_v[k] - v_l_old[k]).item())
+
+    # Prepare for interaction with environment
+    start_time = time.time()
+    o = np.array([env.reset() for env in envs], dtype=np.float32)
+    ep_ret, ep_len = np.zeros(num_agents), np.zeros(num_agents, dtype=int)
+
+    # Main loop: collect experience in envs and update/log each epoch
+    for epoch in range(epochs):
+        for t in range(steps_per_epoch):
+            a, v, logp = ac.step(o)
+
+            d = np.zeros(num_agents, dtype=bool)
+            for k, env in enumerate(envs):
+                next_o, r, d[k], _ = env.step(a[k])
+                ep_ret[k] += r
+                ep_len[k] += 1
+
+                # save and log
+                bufs[k].store(o[k], a[k], r, v[k], logp[k])
+                loggers[k].store(VVals=v[k])
+
+                # Update obs (critical!)
+                o[k] = next_o
+
+            timeout = ep_len == max_ep_len
+            terminal = d | timeout
+            epoch_ended = t==steps_per_epoch-1
+
+            if terminal.any() or epoch_ended:
+                # if trajectory didn't reach terminal state, bootstrap value target
+                last_v = ac.value(o) if (timeout.any() or epoch_ended) else None
+                for k, env in enumerate(envs):
+                    if not(terminal[k] or epoch_ended):
+                        continue
+                    if epoch_ended and not(terminal[k]):
+                        print('Warning: trajectory of seed %d cut off by epoch at %d steps.'%(
+                              seeds[k], ep_len[k]), flush=True)
+                    bufs[k].finish_path(last_v[k] if (timeout[k] or epoch_ended) else 0)
+                    if terminal[k]:
+                        # only save EpRet / EpLen if trajectory finished
+                        loggers[k].store(EpRet=ep_ret[k], EpLen=ep_len[k])
+                    o[k], ep_ret[k], ep_len[k] = env.reset(), 0, 0
+
+        # Save models
+        if (epoch % save_freq == 0) or (epoch == epochs-1):
+            ac.unstack(agents)
+            for logger, env in zip(loggers, envs):
+                logger.save_state({'env': env}, None)
+
+        # Perform PPO update for all agents!
+        update()
+
+        # Log info about epoch
+        for logger in loggers:
+            logger.log_tabular('Epoch', epoch)
+            logger.log_tabular('EpRet', with_min_and_max=True)
+            logger.log_tabular('EpLen', average_only=True)
+            logger.log_tabular('VVals', with_min_and_max=True)
+            logger.log_tabular('TotalEnvInteracts', (epoch+1)*steps_per_epoch)
+            logger.log_tabular('LossPi', average_only=True)
+            logger.log_tabular('LossV', average_only=True)
+            logger.log_tabular('DeltaLossPi', average_only=True)
+            logger.log_tabular('DeltaLossV', average_only=True)
+            logger.log_tabular('Entropy', average_only=True)
+            logger.log_tabular('KL', average_only=True)
+            logger.log_tabular('ClipFrac', average_only=True)
+            logger.log_tabular('StopIter', average_only=True)
+            logger.log_tabular('Time', time.time()-start_time)
+            logger.dump_tabular()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default='HalfCheetah-v2')
+    parser.add_argument('--hid', type=int, default=64)
+    parser.add_argument('--l', type=int, default=2)
+    parser.add_argument('--gamma', type=float, default=0.99)
+    parser.add_argument('--seeds', '-s', type=int, nargs='+', default=[0, 10, 20])
+    parser.add_argument('--steps', type=int, default=4000)
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--exp_name', type=str, default='ppo_multiseed')
+    args = parser.parse_args()
+
+    ppo_multiseed(lambda : gym.make(args.env), actor_critic=core.MLPActorCritic,
+                  ac_kwargs=dict(hidden_sizes=[args.hid]*args.l), gamma=args.gamma,
+                  seeds=args.seeds, steps_per_epoch=args.steps, epochs=args.epochs,
+                  exp_name=args.exp_name)
@@ -23,6 +23,40 @@ def count_vars(module):
     return sum([np.prod(p.shape) for p in module.parameters()])
 
 
+# Use inference mode for the single-observation fast paths where available
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+
+class SingleObsMLP:
+    """
+    Evaluates an ``mlp`` on a single (1-D) observation, writing the output of
+    every layer into a preallocated tensor. Computes exactly the same ops as
+    calling the module, so results are identical.
+
+    The returned tensor is overwritten by the next call.
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.bufs = [torch.empty(1, m.out_features) if isinstance(m, nn.Linear) else None 
+                     for m in net]
+
+    def __call__(self, x):
+        # Work on (1, n) rows, as nn.Linear does internally for 1-D inputs
+        h = x.view(1, -1)
+        for m, buf in zip(self.net, self.bufs):
+            if isinstance(m, nn.Linear):
+                h = torch.mm(h, m.weight.t(), out=buf)
+                h.add_(m.bias)
+            elif isinstance(m, nn.ReLU):
+                h = torch.relu_(h)
+            elif isinstance(m, nn.Tanh):
+                h = torch.tanh_(h)
+            elif not isinstance(m, nn.Identity):
+                h = m(h)
+        return h[0]
+
+
 LOG_STD_MAX = 2
 LOG_STD_MIN = -20
 
@@ -77,10 +111,37 @@ class MLPQFunction(nn.Module):
         q = self.q(torch.cat([obs, act], dim=-1))
         return torch.squeeze(q, -1) # Critical to ensure q has right shape.
 
+class MLPEnsembleQFunction(nn.Module):
+    """
+    ``num_q`` Q-functions with the same architecture, whose weights are
+    stacked along a leading ensemble dimension so that all of them are
+    evaluated with one batched matmul (``baddbmm``) per layer.
+    """
+
+    def __init__(self, obs_dim, act_dim, hidden_sizes, activation, num_q=2):
+        super().__init__()
+        sizes = [obs_dim + act_dim] + list(hidden_sizes) + [1]
+        self.weights, self.biases = nn.ParameterList(), nn.ParameterList()
+        for j in range(len(sizes)-1):
+            # Same initialization as nn.Linear
+            bound = 1 / np.sqrt(sizes[j])
+            self.weights.append(nn.Parameter(torch.empty(num_q, sizes[j], sizes[j+1]).uniform_(-bound, bound)))
+            self.biases.append(nn.Parameter(torch.empty(num_q, 1, sizes[j+1]).uniform_(-bound, bound)))
+        self.activation = activation()
+
+    def forward(self, obs, act):
+        x = torch.cat([obs, act], dim=-1)
+        x = x.expand(len(self.weights[0]), *x.shape)
+        for j, (w, b) in enumerate(zip(self.weights, self.biases)):
+            x = torch.baddbmm(b, x, w)
+            if j < len(self.weights)-1:
+                x = self.activation(x)
+        return torch.squeeze(x, -1) # Shape (num_q, batch).
+
 class MLPActorCritic(nn.Module):
 
     def __init__(self, observation_space, action_space, hidden_sizes=(256,256),
-                 activation=nn.ReLU):
+                 activation=nn.ReLU, num_q=None):
         super().__init__()
 
         obs_dim = observation_space.shape[0]
@@ -89,10 +150,57 @@ class MLPActorCritic(nn.Module):
 
         # build policy and value functions
         self.pi = SquashedGaussianMLPActor(obs_dim, act_dim, hidden_sizes, activation, act_limit)
-        self.q1 = MLPQFunction(obs_dim, act_dim, hidden_sizes, activation)
-        self.q2 = MLPQFunction(obs_dim, act_dim, hidden_sizes, activation)
+        if num_q is None:
+            self.q1 = MLPQFunction(obs_dim, act_dim, hidden_sizes, activation)
+            self.q2 = MLPQFunction(obs_dim, act_dim, hidden_sizes, activation)
+        else:
+            # All critics in one batched module
+            self.q = MLPEnsembleQFunction(obs_dim, act_dim, hidden_sizes, activation, num_q)
 
     def act(self, obs, deterministic=False):
         with torch.no_grad():
             a, _ = self.pi(obs, deterministic, False)
             return a.numpy()
+
+    def __getstate__(self):
+        # The fast-path cache pairs a tensor with a NumPy view of its memory,
+        # which pickling (torch.save) and deepcopy would split into two
+        # separate buffers; leave it out so that it is rebuilt on first use.
+        getstate = getattr(super(), '__getstate__', None)
+        state = dict(getstate() if getstate else self.__dict__)
+        state.pop('_single', None)
+        return state
+
+    def __setstate__(self, state):
+        # (Models saved before the cache was excluded still carry one.)
+        state.pop('_single', None)
+        super().__setstate__(state)
+
+    def act_single(self, o, deterministic=False):
+        """
+        Fast path for ``act`` on one observation, given as a NumPy array.
+
+        Builds no distribution objects and reuses preallocated tensors, but
+        draws from the random number generator exactly as ``act`` does, so
+        it returns the same action.
+        """
+        if getattr(self, '_single', None) is None:
+            self._single = dict(obs=torch.empty(self.pi.net[0].in_features),
+                                eps=torch.empty(self.pi.mu_layer.out_features),
+                                net=SingleObsMLP(self.pi.net),
+                                mu_layer=SingleObsMLP([self.pi.mu_layer]),
+                                log_std_layer=SingleObsMLP([self.pi.log_std_layer]))
+            self._single['obs_np'] = self._single['obs'].numpy()
+        s = self._single
+        with inference_mode():
+            s['obs_np'][:] = o
+            net_out = s['net'](s['obs'])
+            pi_action = s['mu_layer'](net_out)
+            if not deterministic:
+                # Same ops as Normal(mu, std).rsample()
+                log_std = torch.clamp(s['log_std_layer'](net_out), LOG_STD_MIN, LOG_STD_MAX)
+                std = torch.exp(log_std)
+                pi_action = pi_action + s['eps'].normal_() * std
+            pi_action = torch.tanh(pi_action)
+            pi_action = self.pi.act_limit * pi_action
+            return pi_action.numpy()
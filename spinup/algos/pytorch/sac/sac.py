@@ -7,6 +7,10 @@ import gym
 import time
 import spinup.algos.pytorch.sac.core as core
 from spinup.utils.logx import EpochLogger
+from spinup.utils.dyna_pytorch import DynaModel
+from spinup.utils.compile_pytorch import compile_fn, compile_optimizer
+from spinup.utils.flat_pytorch import FlatParams, polyak_update
+from spinup.utils.amp_pytorch import autocast, bf16_probe, check_bf16
 
 
 class ReplayBuffer:
@@ -33,12 +37,13 @@ class ReplayBuffer:
 
     def sample_batch(self, batch_size=32):
         idxs = np.random.randint(0, self.size, size=batch_size)
-        batch = dict(obs=self.obs_buf[idxs],
-                     obs2=self.obs2_buf[idxs],
-                     act=self.act_buf[idxs],
-                     rew=self.rew_buf[idxs],
-                     done=self.done_buf[idxs])
-        return {k: torch.as_tensor(v, dtype=torch.float32) for k,v in batch.items()}
+        # Gather each field once, into arrays that the tensors then wrap
+        batch = dict(obs=self.obs_buf.take(idxs, axis=0),
+                     obs2=self.obs2_buf.take(idxs, axis=0),
+                     act=self.act_buf.take(idxs, axis=0),
+                     rew=self.rew_buf.take(idxs),
+                     done=self.done_buf.take(idxs))
+        return {k: torch.from_numpy(v) for k,v in batch.items()}
 
 
 
@@ -46,7 +51,8 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         steps_per_epoch=4000, epochs=100, replay_size=int(1e6), gamma=0.99, 
         polyak=0.995, lr=1e-3, alpha=0.2, batch_size=100, start_steps=10000, 
         update_after=1000, update_every=50, num_test_episodes=10, max_ep_len=1000, 
-        logger_kwargs=dict(), save_freq=1):
+        logger_kwargs=dict(), save_freq=1, real_ratio=1.0,
+        dyna_kwargs=dict(), flat_params=False, compile_update=False, bf16=False):
     """
     Soft Actor-Critic (SAC)
 
@@ -77,6 +83,12 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
                                            | flatten this!)
             ===========  ================  ======================================
 
+            Instead of ``q1`` and ``q2``, the module may have a single ``q``
+            module (see ``num_q`` in ``core.MLPActorCritic``) returning the
+            estimates of all its critics at once, shape (num_q, batch). The
+            minimum over all critics is used wherever SAC uses the smaller
+            of the two Q-values.
+
             Calling ``pi`` should return:
 
             ===========  ================  ======================================
@@ -142,6 +154,33 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         save_freq (int): How often (in terms of gap between epochs) to save
             the current policy and value function.
 
+        real_ratio (float): Fraction of each training batch drawn from real
+            env interactions. The rest is drawn from short imagined rollouts
+            of a learned ensemble dynamics model (Dyna-style). At 1.0 (the
+            default) no model is built and training uses real data only.
+            (The TF1 algorithms have no such option.)
+
+        dyna_kwargs (dict): Any kwargs appropriate for the DynaModel object
+            in ``spinup/utils/dyna_pytorch.py`` (model size, refit and
+            rollout schedule, termination function).
+
+        flat_params (bool): Store the parameters (and gradients) of the
+            actor-critic and of its target in one contiguous buffer each,
+            so that the target update is a single vectorized op instead of
+            a loop over parameter tensors.
+
+        compile_update (bool): Compile the loss functions and optimizer
+            steps with ``torch.compile`` (see
+            ``spinup/utils/compile_pytorch.py``). The first updates are slow
+            while compiling. Runs eagerly if compilation fails.
+
+        bf16 (bool): Compute the losses (and hence their gradients) under
+            bfloat16 autocast on CPU (see ``spinup/utils/amp_pytorch.py``).
+            Parameters, optimizer state and target networks stay in fp32.
+            Each epoch, the bf16 and fp32 losses are also compared on a
+            fresh batch, and their relative deviation and the bf16 speedup
+            are logged.
+
     """
 
     logger = EpochLogger(**logger_kwargs)
@@ -160,27 +199,50 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     # Create actor-critic module and target networks
     ac = actor_critic(env.observation_space, env.action_space, **ac_kwargs)
     ac_targ = deepcopy(ac)
+    if flat_params:
+        FlatParams(ac)
+        FlatParams(ac_targ)
 
     # Freeze target networks with respect to optimizers (only update via polyak averaging)
     for p in ac_targ.parameters():
         p.requires_grad = False
         
+    # Critics are either separate q1 and q2 modules, or one batched ensemble q
+    ensemble_q = hasattr(ac, 'q')
+
     # List of parameters for both Q-networks (save this for convenience)
-    q_params = itertools.chain(ac.q1.parameters(), ac.q2.parameters())
+    q_params = ac.q.parameters() if ensemble_q else \
+        itertools.chain(ac.q1.parameters(), ac.q2.parameters())
+
+    # Q-values of all critics, shape (num_q, batch)
+    def q_values(ac, o, a):
+        if ensemble_q:
+            return ac.q(o, a)
+        return torch.stack([ac.q1(o, a), ac.q2(o, a)])
+
+    # Number of critics (an ensemble may have just one)
+    with torch.no_grad():
+        num_q = len(q_values(ac, torch.zeros((1,) + obs_dim), torch.zeros(1, act_dim)))
 
     # Experience buffer
     replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
 
+    # Learned dynamics model for Dyna-style synthetic data (optional)
+    dyna = DynaModel(obs_dim[0], act_dim, **dyna_kwargs) if real_ratio < 1 else None
+
     # Count variables (protip: try to get a feel for how different size networks behave!)
-    var_counts = tuple(core.count_vars(module) for module in [ac.pi, ac.q1, ac.q2])
-    logger.log('\nNumber of parameters: \t pi: %d, \t q1: %d, \t q2: %d\n'%var_counts)
+    if ensemble_q:
+        var_counts = tuple(core.count_vars(module) for module in [ac.pi, ac.q])
+        logger.log('\nNumber of parameters: \t pi: %d, \t q: %d\n'%var_counts)
+    else:
+        var_counts = tuple(core.count_vars(module) for module in [ac.pi, ac.q1, ac.q2])
+        logger.log('\nNumber of parameters: \t pi: %d, \t q1: %d, \t q2: %d\n'%var_counts)
 
     # Set up function for computing SAC Q-losses
     def compute_loss_q(data):
         o, a, r, o2, d = data['obs'], data['act'], data['rew'], data['obs2'], data['done']
 
-        q1 = ac.q1(o,a)
-        q2 = ac.q2(o,a)
+        q = q_values(ac, o, a)
 
         # Bellman backup for Q functions
         with torch.no_grad():
@@ -188,19 +250,16 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
             a2, logp_a2 = ac.pi(o2)
 
             # Target Q-values
-            q1_pi_targ = ac_targ.q1(o2, a2)
-            q2_pi_targ = ac_targ.q2(o2, a2)
-            q_pi_targ = torch.min(q1_pi_targ, q2_pi_targ)
+            q_pi_targ = torch.min(q_values(ac_targ, o2, a2), dim=0)[0]
             backup = r + gamma * (1 - d) * (q_pi_targ - alpha * logp_a2)
 
         # MSE loss against Bellman backup
-        loss_q1 = ((q1 - backup)**2).mean()
-        loss_q2 = ((q2 - backup)**2).mean()
-        loss_q = loss_q1 + loss_q2
+        loss_q = ((q - backup)**2).mean(dim=1).sum()
 
         # Useful info for logging
-        q_info = dict(Q1Vals=q1.detach().numpy(),
-                      Q2Vals=q2.detach().numpy())
+        q_info = dict(Q1Vals=q[0].detach().float().numpy())
+        if num_q > 1:
+            q_info['Q2Vals'] = q[1].detach().float().numpy()
 
         return loss_q, q_info
 
@@ -208,15 +267,13 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     def compute_loss_pi(data):
         o = data['obs']
         pi, logp_pi = ac.pi(o)
-        q1_pi = ac.q1(o, pi)
-        q2_pi = ac.q2(o, pi)
-        q_pi = torch.min(q1_pi, q2_pi)
+        q_pi = torch.min(q_values(ac, o, pi), dim=0)[0]
 
         # Entropy-regularized policy loss
         loss_pi = (alpha * logp_pi - q_pi).mean()
 
         # Useful info for logging
-        pi_info = dict(LogPi=logp_pi.detach().numpy())
+        pi_info = dict(LogPi=logp_pi.detach().float().numpy())
 
         return loss_pi, pi_info
 
@@ -224,13 +281,24 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
     pi_optimizer = Adam(ac.pi.parameters(), lr=lr)
     q_optimizer = Adam(q_params, lr=lr)
 
+    # Optionally compile the losses and optimizer steps
+    if compile_update:
+        compute_loss_pi = compile_fn(compute_loss_pi)
+        compute_loss_q = compile_fn(compute_loss_q)
+        compile_optimizer(pi_optimizer)
+        compile_optimizer(q_optimizer)
+
+    # Optionally compute the losses in bf16 mixed precision
+    bf16 = check_bf16(bf16)
+
     # Set up model saving
     logger.setup_pytorch_saver(ac)
 
     def update(data):
         # First run one gradient descent step for Q1 and Q2
         q_optimizer.zero_grad()
-        loss_q, q_info = compute_loss_q(data)
+        with autocast(bf16):
+            loss_q, q_info = compute_loss_q(data)
         loss_q.backward()
         q_optimizer.step()
 
@@ -244,7 +312,8 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
 
         # Next run one gradient descent step for pi.
         pi_optimizer.zero_grad()
-        loss_pi, pi_info = compute_loss_pi(data)
+        with autocast(bf16):
+            loss_pi, pi_info = compute_loss_pi(data)
         loss_pi.backward()
         pi_optimizer.step()
 
@@ -256,14 +325,22 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
         logger.store(LossPi=loss_pi.item(), **pi_info)
 
         # Finally, update target networks by polyak averaging.
-        with torch.no_grad():
-            for p, p_targ in zip(ac.parameters(), ac_targ.parameters()):
-                # NB: We use an in-place operations "mul_", "add_" to update target
-                # params, as opposed to "mul" and "add", which would make new tensors.
-                p_targ.data.mul_(polyak)
-                p_targ.data.add_((1 - polyak) * p.data)
+        if flat_params:
+            polyak_update(polyak, ac.flat_params, ac_targ.flat_params)
+        else:
+            with torch.no_grad():
+                for p, p_targ in zip(ac.parameters(), ac_targ.parameters()):
+                    # NB: We use an in-place operations "mul_", "add_" to update target
+                    # params, as opposed to "mul" and "add", which would make new tensors.
+                    p_targ.data.mul_(polyak)
+                    p_targ.data.add_((1 - polyak) * p.data)
+
+    def rollout_policy(o):
+        return ac.pi(o, with_logprob=False)[0]
 
     def get_action(o, deterministic=False):
+        if hasattr(ac, 'act_single'):
+            return ac.act_single(o, deterministic)
         return ac.act(torch.as_tensor(o, dtype=torch.float32), 
                       deterministic)
 
@@ -315,10 +392,19 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
             logger.store(EpRet=ep_ret, EpLen=ep_len)
             o, ep_ret, ep_len = env.reset(), 0, 0
 
+        # Model handling: refit the dynamics model to the real data, then
+        # refresh the imagined transitions using the current policy
+        if dyna is not None and t >= update_after and t % dyna.train_every == 0:
+            logger.store(LossModel=dyna.train(replay_buffer))
+            dyna.generate(replay_buffer, rollout_policy)
+
         # Update handling
         if t >= update_after and t % update_every == 0:
             for j in range(update_every):
-                batch = replay_buffer.sample_batch(batch_size)
+                if dyna is None:
+                    batch = replay_buffer.sample_batch(batch_size)
+                else:
+                    batch = dyna.sample_batch(replay_buffer, batch_size, real_ratio)
                 update(data=batch)
 
         # End of epoch handling
@@ -332,6 +418,14 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
             # Test the performance of the deterministic version of the agent.
             test_agent()
 
+            # Compare the bf16 and fp32 losses on a fresh batch
+            if bf16:
+                batch = replay_buffer.sample_batch(batch_size)
+                dev_q, speedup_q = bf16_probe(compute_loss_q, batch, ac.parameters())
+                dev_pi, speedup_pi = bf16_probe(compute_loss_pi, batch, ac.parameters())
+                logger.store(Bf16DevQ=dev_q, Bf16SpeedupQ=speedup_q,
+                             Bf16DevPi=dev_pi, Bf16SpeedupPi=speedup_pi)
+
             # Log info about epoch
             logger.log_tabular('Epoch', epoch)
             logger.log_tabular('EpRet', with_min_and_max=True)
@@ -340,10 +434,18 @@ def sac(env_fn, actor_critic=core.MLPActorCritic, ac_kwargs=dict(), seed=0,
             logger.log_tabular('TestEpLen', average_only=True)
             logger.log_tabular('TotalEnvInteracts', t)
             logger.log_tabular('Q1Vals', with_min_and_max=True)
-            logger.log_tabular('Q2Vals', with_min_and_max=True)
+            if num_q > 1:
+                logger.log_tabular('Q2Vals', with_min_and_max=True)
             logger.log_tabular('LogPi', with_min_and_max=True)
             logger.log_tabular('LossPi', average_only=True)
             logger.log_tabular('LossQ', average_only=True)
+            if bf16:
+                logger.log_tabular('Bf16DevQ', average_only=True)
+                logger.log_tabular('Bf16DevPi', average_only=True)
+                logger.log_tabular('Bf16SpeedupQ', average_only=True)
+                logger.log_tabular('Bf16SpeedupPi', average_only=True)
+            if dyna is not None:
+                logger.log_tabular('LossModel', average_only=True)
             logger.log_tabular('Time', time.time()-start_time)
             logger.dump_tabular()
 
@@ -4,6 +4,7 @@ import numpy as np
 from spinup.algos.tf1.ddpg.ddpg import ddpg
 from spinup.algos.tf1.ddpg import core
 from spinup.utils.run_utils import setup_logger_kwargs
+from spinup.utils.shared_env import SharedEnvFactory
 from pathlib import Path
 
 # Disable GPU
@@ -50,7 +51,12 @@ controller_params = {
 
 logger_kwargs = setup_logger_kwargs('NEW')
 
-env, logger, replay_buffer = ddpg(lambda: gym.make('liveline-v0'), actor_critic=core.mlp_actor_critic,
+# Load the dataset and predictor once, and share them between the train and test envs
+# (and, through the memory-mapped cache, with any other runs on this machine).
+env_fn = SharedEnvFactory(lambda: gym.make('liveline-v0'),
+                          cache_dir=os.path.join(logger_kwargs['output_dir'], '..', 'env_cache'))
+
+env, logger, replay_buffer = ddpg(env_fn, actor_critic=core.mlp_actor_critic,
                                   ac_kwargs=dict(hidden_sizes=[256] * 2),
                                   gamma=0.99, seed=42,
 
@@ -5,6 +5,10 @@ import time
 from spinup.algos.tf1.ddpg import core
 from spinup.algos.tf1.ddpg.core import get_vars
 from spinup.utils.logx import EpochLogger
+from spinup.utils.numpy_policy import DeterministicNumpyPolicy, \
+    kwarg_or_default, max_action_error
+from spinup.utils.replay_tf import GraphReplayBuffer, polyak_update, update_loop
+from spinup.utils.session_tf import make_session, session_kwargs
 from spinup.utils.logx import colorize
 import copy
 
@@ -47,8 +51,9 @@ def ddpg(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
          steps_per_epoch=4000, epochs=100, replay_size=int(1e6), gamma=0.99,
          polyak=0.995, pi_lr=1e-3, q_lr=1e-3, batch_size=100, start_steps=10000,
          update_after=1000, update_every=50, act_noise=0.1, num_test_episodes=10,
-         max_ep_len=1000, logger_kwargs=dict(), save_freq=1, env_params=None,
-         controller_params=None,):
+         max_ep_len=1000, logger_kwargs=dict(), save_freq=1, numpy_act=False,
+         graph_buffer=False, fused_update=False, env_params=None, controller_params=None,
+         sess_kwargs=dict()):
     """
     Deep Deterministic Policy Gradient (DDPG)
 
@@ -129,11 +134,40 @@ def ddpg(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         save_freq (int): How often (in terms of gap between epochs) to save
             the current policy and value function.
 
+        numpy_act (bool): Whether to compute actions in the env loop from a
+            NumPy copy of the policy, refreshed after every burst of updates,
+            instead of running the TF graph for each observation. The copy
+            is checked against the graph after every refresh, and acting
+            falls back to the graph if they disagree (e.g. for a custom
+            ``actor_critic`` the NumPy policy cannot reproduce).
+
+        graph_buffer (bool): Whether to also keep the replay buffer in TF
+            variables and run each burst of ``update_every`` updates as a
+            ``tf.while_loop`` in a single ``sess.run``, instead of feeding
+            NumPy minibatches to separate ``sess.run`` calls. Much faster
+            for small networks. (Uses resource variables for the networks.)
+
+        fused_update (bool): Whether to run the critic step, the actor step
+            and the target update as one op, sequenced with control
+            dependencies, so that each update is a single ``sess.run`` with
+            a single feed. (Uses resource variables for the networks.)
+
         env_params (dict): Environment settings.
 
         controller_params (dict): Controller settings.
+
+        sess_kwargs (dict): Settings for the TF session: ``intra_op_threads``
+            and ``inter_op_threads`` (by default sized to this process's
+            share of the CPUs, so that MPI processes do not oversubscribe
+            them) and ``xla`` (compile the update steps with XLA JIT). The
+            thread counts used are saved with the config. See
+            ``spinup/utils/session_tf.py``.
+
     """
 
+    # Session settings, with the thread counts filled in (saved with the config)
+    sess_kwargs = session_kwargs(**sess_kwargs)
+
     logger = EpochLogger(**logger_kwargs)
     logger.save_config(locals())
 
@@ -176,17 +210,22 @@ def ddpg(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     x_ph, a_ph, x2_ph, r_ph, d_ph = core.placeholders(obs_dim, act_dim, obs_dim, None, None)
 
     # Main outputs from computation graph
-    with tf.variable_scope('main'):
+    # (resource variables, if updating in a graph loop, so that each
+    # iteration reads the latest values)
+    use_resource = True if (graph_buffer or fused_update) else None
+    with tf.variable_scope('main', use_resource=use_resource):
         pi, q, q_pi = actor_critic(x_ph, a_ph, **ac_kwargs)
 
     # Target networks
-    with tf.variable_scope('target'):
+    with tf.variable_scope('target', use_resource=use_resource):
         # Note that the action placeholder going to actor_critic here is 
         # irrelevant, because we only need q_targ(s, pi_targ(s)).
         pi_targ, _, q_pi_targ = actor_critic(x2_ph, a_ph, **ac_kwargs)
 
     # Experience buffer
     replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
+    if graph_buffer:
+        graph_replay_buffer = GraphReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
 
     # Count variables
     var_counts = tuple(core.count_vars(scope) for scope in ['main/pi', 'main/q', 'main'])
@@ -206,20 +245,90 @@ def ddpg(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     train_q_op = q_optimizer.minimize(q_loss, var_list=get_vars('main/q'))
 
     # Polyak averaging for target variables
-    target_update = tf.group([tf.assign(v_targ, polyak * v_targ + (1 - polyak) * v_main)
-                              for v_main, v_targ in zip(get_vars('main'), get_vars('target'))])
+    main_vars, targ_vars = get_vars('main'), get_vars('target')
+    target_update = polyak_update(polyak, main_vars, targ_vars)
+
+    pi_params, q_params = tf.trainable_variables('main/pi'), tf.trainable_variables('main/q')
+
+    def policy_step(x, a, after):
+        # Policy update, then target update, both after op `after`
+        with tf.control_dependencies([after]):
+            with tf.variable_scope('main', reuse=True):
+                _, _, q_pi = actor_critic(x, a, **ac_kwargs)
+            pi_loss = -tf.reduce_mean(q_pi)
+            train_pi = pi_optimizer.apply_gradients(
+                pi_optimizer.compute_gradients(pi_loss, var_list=pi_params))
+        with tf.control_dependencies([train_pi]):
+            target_update = polyak_update(polyak, main_vars, targ_vars)
+        with tf.control_dependencies([target_update]):
+            return tf.identity(pi_loss)
+
+    # Critic step, actor step and target update in one op
+    if fused_update:
+        fused_step_ops = [q_loss, q, policy_step(x_ph, a_ph, train_q_op)]
+
+    # Burst of update_every updates on minibatches from the in-graph buffer,
+    # as a graph loop (mirrors the update handling in the main loop below)
+    if graph_buffer:
+        def update_step(j):
+            batch = graph_replay_buffer.sample_batch(batch_size)
+            with tf.variable_scope('main', reuse=True):
+                _, q_b, _ = actor_critic(batch['obs1'], batch['acts'], **ac_kwargs)
+            with tf.variable_scope('target', reuse=True):
+                _, _, q_pi_targ_b = actor_critic(batch['obs2'], batch['acts'], **ac_kwargs)
+            backup_b = tf.stop_gradient(batch['rews'] + gamma * (1 - batch['done']) * q_pi_targ_b)
+            q_loss_b = tf.reduce_mean((q_b - backup_b) ** 2)
+            train_q_b = q_optimizer.apply_gradients(
+                q_optimizer.compute_gradients(q_loss_b, var_list=q_params))
+            pi_loss_b = policy_step(batch['obs1'], batch['acts'], train_q_b)
+            return [q_loss_b, q_b, pi_loss_b], pi_loss_b
+
+        update_outs = update_loop(update_every, update_step, [tf.float32]*3)
 
     # Initializing targets to match main variables
     target_init = tf.group([tf.assign(v_targ, v_main)
                             for v_main, v_targ in zip(get_vars('main'), get_vars('target'))])
 
-    sess = tf.Session()
+    # Ops run by the update steps (compiled with XLA, if enabled)
+    update_ops = [train_q_op, train_pi_op, target_update]
+    if fused_update:
+        update_ops += fused_step_ops
+    if graph_buffer:
+        update_ops += update_outs
+    sess = make_session(update_ops=update_ops, **sess_kwargs)
     sess.run(tf.global_variables_initializer())
     sess.run(target_init)
+    if graph_buffer:
+        sess.run(graph_replay_buffer.initializer)
 
     # Setup model saving
     logger.setup_tf_saver(sess, inputs={'x': x_ph, 'a': a_ph}, outputs={'pi': pi, 'q': q})
 
+    # NumPy copy of the policy for fast acting (optional)
+    np_pi, pi_vars = None, tf.trainable_variables('main/pi')
+    if numpy_act:
+        try:
+            np_pi = DeterministicNumpyPolicy(
+                sess.run(pi_vars), act_limit,
+                activation=kwarg_or_default(actor_critic, ac_kwargs, 'activation'),
+                output_activation=kwarg_or_default(actor_critic, ac_kwargs, 'output_activation'))
+        except (ValueError, IndexError) as e:
+            logger.log('Cannot build NumPy policy (%s), acting with the graph.'%e, color='red')
+
+    def sync_numpy_policy():
+        # Snapshot the latest policy weights, then make sure the NumPy
+        # policy still agrees with the graph.
+        nonlocal np_pi
+        np_pi.set_params(sess.run(pi_vars))
+        err = max_action_error(np_pi, lambda obs: sess.run(pi, feed_dict={x_ph: obs}), obs_dim)
+        if err > 1e-4 * act_limit:
+            logger.log('NumPy policy disagrees with graph (max error %.3g), '
+                       'acting with the graph.'%err, color='red')
+            np_pi = None
+
+    if np_pi is not None:
+        sync_numpy_policy()
+
     def rolling_setpoints(my_env, batch_window=500):
         v = copy.copy(my_env.verbosity)
         my_env.verbosity = 0
@@ -239,7 +348,10 @@ def ddpg(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         return a_str
 
     def get_action(o, noise_scale):
-        a = sess.run(pi, feed_dict={x_ph: o.reshape(1, -1)})[0]
+        if np_pi is not None:
+            a = np_pi.act(o)
+        else:
+            a = sess.run(pi, feed_dict={x_ph: o.reshape(1, -1)})[0]
         a += noise_scale * np.random.randn(act_dim)
         return np.clip(a, -act_limit, act_limit)
 
@@ -356,6 +468,8 @@ def ddpg(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
 
         # Store experience to replay buffer
         replay_buffer.store(raw[0], o, a, r, o2, d)
+        if graph_buffer:
+            graph_replay_buffer.store(o, a, r, o2, d)
 
         # Super critical, easy to overlook step: make sure to update most recent observation!
         o = o2
@@ -377,22 +491,37 @@ def ddpg(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
             # DEBUG cc
             print(colorize('\n\nUpdating Q-learning and Policy...\n', color='magenta', bold=True))
 
-            for _ in range(update_every):
-                batch = replay_buffer.sample_batch(batch_size)
-                feed_dict = {x_ph: batch['obs1'],
-                             x2_ph: batch['obs2'],
-                             a_ph: batch['acts'],
-                             r_ph: batch['rews'],
-                             d_ph: batch['done']
-                             }
-
-                # Q-learning update
-                outs = sess.run([q_loss, q, train_q_op], feed_dict)
-                logger.store(LossQ=outs[0], QVals=outs[1])
-
-                # Policy update
-                outs = sess.run([pi_loss, train_pi_op, target_update], feed_dict)
-                logger.store(LossPi=outs[0])
+            if graph_buffer:
+                # Append new experience and run all updates in one sess.run
+                outs = sess.run(update_outs, graph_replay_buffer.feed_dict())
+                logger.store(LossQ=outs[0], QVals=outs[1].ravel(), LossPi=outs[2])
+            else:
+                for _ in range(update_every):
+                    batch = replay_buffer.sample_batch(batch_size)
+                    feed_dict = {x_ph: batch['obs1'],
+                                 x2_ph: batch['obs2'],
+                                 a_ph: batch['acts'],
+                                 r_ph: batch['rews'],
+                                 d_ph: batch['done']
+                                 }
+
+                    if fused_update:
+                        # Q-learning update, policy update and target update
+                        outs = sess.run(fused_step_ops, feed_dict)
+                        logger.store(LossQ=outs[0], QVals=outs[1], LossPi=outs[2])
+                        continue
+
+                    # Q-learning update
+                    outs = sess.run([q_loss, q, train_q_op], feed_dict)
+                    logger.store(LossQ=outs[0], QVals=outs[1])
+
+                    # Policy update
+                    outs = sess.run([pi_loss, train_pi_op, target_update], feed_dict)
+                    logger.store(LossPi=outs[0])
+
+            # Refresh the NumPy copy of the policy
+            if np_pi is not None:
+                sync_numpy_policy()
 
         # End of epoch wrap-up
         if (t + 1) % steps_per_epoch == 0:
@@ -3,8 +3,11 @@ import tensorflow as tf
 import gym
 import time
 import spinup.algos.tf1.ppo.core as core
+from spinup.utils.advantages import gae_and_returns
 from spinup.utils.logx import EpochLogger
 from spinup.utils.mpi_tf import MpiAdamOptimizer, sync_all_params
+from spinup.utils.resident_tf import ResidentBatch
+from spinup.utils.session_tf import make_session, session_kwargs
 from spinup.utils.mpi_tools import mpi_fork, mpi_avg, proc_id, mpi_statistics_scalar, num_procs
 
 
@@ -25,6 +28,7 @@ class PPOBuffer:
         self.logp_buf = np.zeros(size, dtype=np.float32)
         self.gamma, self.lam = gamma, lam
         self.ptr, self.path_start_idx, self.max_size = 0, 0, size
+        self.path_ends, self.last_vals = [], []
 
     def store(self, obs, act, rew, val, logp):
         """
@@ -41,11 +45,12 @@ class PPOBuffer:
     def finish_path(self, last_val=0):
         """
         Call this at the end of a trajectory, or when one gets cut off
-        by an epoch ending. This looks back in the buffer to where the
-        trajectory started, and uses rewards and value estimates from
-        the whole trajectory to compute advantage estimates with GAE-Lambda,
-        as well as compute the rewards-to-go for each state, to use as
-        the targets for the value function.
+        by an epoch ending. This marks where the trajectory ends, so that
+        ``get`` can use rewards and value estimates from the whole
+        trajectory to compute advantage estimates with GAE-Lambda, as well
+        as compute the rewards-to-go for each state, to use as the targets
+        for the value function. (All trajectories of the epoch are processed
+        together; see ``spinup/utils/advantages.py``.)
 
         The "last_val" argument should be 0 if the trajectory ended
         because the agent reached a terminal state (died), and otherwise
@@ -54,17 +59,8 @@ class PPOBuffer:
         for timesteps beyond the arbitrary episode horizon (or epoch cutoff).
         """
 
-        path_slice = slice(self.path_start_idx, self.ptr)
-        rews = np.append(self.rew_buf[path_slice], last_val)
-        vals = np.append(self.val_buf[path_slice], last_val)
-        
-        # the next two lines implement GAE-Lambda advantage calculation
-        deltas = rews[:-1] + self.gamma * vals[1:] - vals[:-1]
-        self.adv_buf[path_slice] = core.discount_cumsum(deltas, self.gamma * self.lam)
-        
-        # the next line computes rewards-to-go, to be targets for the value function
-        self.ret_buf[path_slice] = core.discount_cumsum(rews, self.gamma)[:-1]
-        
+        self.path_ends.append(self.ptr)
+        self.last_vals.append(last_val)
         self.path_start_idx = self.ptr
 
     def get(self):
@@ -75,6 +71,10 @@ class PPOBuffer:
         """
         assert self.ptr == self.max_size    # buffer has to be full before you can get
         self.ptr, self.path_start_idx = 0, 0
+        # GAE-Lambda advantages and rewards-to-go, for all trajectories at once
+        self.adv_buf[:], self.ret_buf[:] = gae_and_returns(
+            self.rew_buf, self.val_buf, self.path_ends, self.last_vals, self.gamma, self.lam)
+        self.path_ends, self.last_vals = [], []
         # the next two lines implement the advantage normalization trick
         adv_mean, adv_std = mpi_statistics_scalar(self.adv_buf)
         self.adv_buf = (self.adv_buf - adv_mean) / adv_std
@@ -86,7 +86,9 @@ class PPOBuffer:
 def ppo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0, 
         steps_per_epoch=4000, epochs=50, gamma=0.99, clip_ratio=0.2, pi_lr=3e-4,
         vf_lr=1e-3, train_pi_iters=80, train_v_iters=80, lam=0.97, max_ep_len=1000,
-        target_kl=0.01, logger_kwargs=dict(), save_freq=10):
+        target_kl=0.01, logger_kwargs=dict(), save_freq=10,
+        minibatch_size=None, resident_data=False,
+        sess_kwargs=dict()):
     """
     Proximal Policy Optimization (by clipping), 
 
@@ -161,8 +163,29 @@ def ppo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         save_freq (int): How often (in terms of gap between epochs) to save
             the current policy and value function.
 
+        minibatch_size (int): If set, the update makes passes over the
+            epoch's data in shuffled minibatches of this size (per MPI
+            process), and ``train_pi_iters`` and ``train_v_iters`` count
+            passes instead of gradient steps. Early stopping then checks
+            the mean KL over each pass of policy updates.
+
+        resident_data (bool): Upload each epoch's data into TF variables
+            once (see ``spinup/utils/resident_tf.py``) and run all training
+            iterations and early stopping checks on it without feeds,
+            instead of feeding the whole batch to every ``sess.run``.
+
+        sess_kwargs (dict): Settings for the TF session: ``intra_op_threads``
+            and ``inter_op_threads`` (by default sized to this process's
+            share of the CPUs, so that MPI processes do not oversubscribe
+            them) and ``xla`` (compile the update steps with XLA JIT). The
+            thread counts used are saved with the config. See
+            ``spinup/utils/session_tf.py``.
+
     """
 
+    # Session settings, with the thread counts filled in (saved with the config)
+    sess_kwargs = session_kwargs(**sess_kwargs)
+
     logger = EpochLogger(**logger_kwargs)
     logger.save_config(locals())
 
@@ -181,17 +204,23 @@ def ppo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     x_ph, a_ph = core.placeholders_from_spaces(env.observation_space, env.action_space)
     adv_ph, ret_ph, logp_old_ph = core.placeholders(None, None, None)
 
-    # Main outputs from computation graph
-    pi, logp, logp_pi, v = actor_critic(x_ph, a_ph, **ac_kwargs)
-
     # Need all placeholders in *this* order later (to zip with data from buffer)
     all_phs = [x_ph, a_ph, adv_ph, ret_ph, logp_old_ph]
 
+    # Optionally keep each epoch's data in the graph instead of feeding it
+    local_steps_per_epoch = int(steps_per_epoch / num_procs())
+    if resident_data:
+        batch = ResidentBatch(all_phs, local_steps_per_epoch,
+                              indexed=minibatch_size is not None)
+        x_ph, a_ph, adv_ph, ret_ph, logp_old_ph = batch.inputs
+
+    # Main outputs from computation graph
+    pi, logp, logp_pi, v = actor_critic(x_ph, a_ph, **ac_kwargs)
+
     # Every step, get: action, value, and logprob
     get_action_ops = [pi, v, logp_pi]
 
     # Experience buffer
-    local_steps_per_epoch = int(steps_per_epoch / num_procs())
     buf = PPOBuffer(obs_dim, act_dim, local_steps_per_epoch, gamma, lam)
 
     # Count variables
@@ -214,8 +243,12 @@ def ppo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     train_pi = MpiAdamOptimizer(learning_rate=pi_lr).minimize(pi_loss)
     train_v = MpiAdamOptimizer(learning_rate=vf_lr).minimize(v_loss)
 
-    sess = tf.Session()
+    # Ops run by the update steps (compiled with XLA, if enabled)
+    update_ops = [train_pi, train_v]
+    sess = make_session(update_ops=update_ops, **sess_kwargs)
     sess.run(tf.global_variables_initializer())
+    if resident_data:
+        sess.run(batch.initializer)
 
     # Sync params across processes
     sess.run(sync_all_params())
@@ -223,20 +256,49 @@ def ppo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     # Setup model saving
     logger.setup_tf_saver(sess, inputs={'x': x_ph}, outputs={'pi': pi, 'v': v})
 
+    # Shuffled minibatches that cover the data once (or all the data at once)
+    def minibatches(inputs):
+        n = local_steps_per_epoch
+        if minibatch_size is None or minibatch_size >= n:
+            yield inputs
+            return
+        idxs = np.random.permutation(n)
+        # Drop the remainder, so that all minibatches have the same size
+        for start in range(0, n - minibatch_size + 1, minibatch_size):
+            mb = idxs[start:start+minibatch_size]
+            if resident_data:
+                yield {batch.idxs_ph: mb}
+            else:
+                yield {k: v[mb] for k, v in inputs.items()}
+
     def update():
-        inputs = {k:v for k,v in zip(all_phs, buf.get())}
+        if resident_data:
+            batch.load(sess, buf.get())
+            inputs = {}
+        else:
+            inputs = {k:v for k,v in zip(all_phs, buf.get())}
         pi_l_old, v_l_old, ent = sess.run([pi_loss, v_loss, approx_ent], feed_dict=inputs)
 
         # Training
-        for i in range(train_pi_iters):
-            _, kl = sess.run([train_pi, approx_kl], feed_dict=inputs)
-            kl = mpi_avg(kl)
-            if kl > 1.5 * target_kl:
-                logger.log('Early stopping at step %d due to reaching max kl.'%i)
-                break
+        if minibatch_size is None:
+            for i in range(train_pi_iters):
+                _, kl = sess.run([train_pi, approx_kl], feed_dict=inputs)
+                kl = mpi_avg(kl)
+                if kl > 1.5 * target_kl:
+                    logger.log('Early stopping at step %d due to reaching max kl.'%i)
+                    break
+        else:
+            for i in range(train_pi_iters):
+                kls = [sess.run([train_pi, approx_kl], feed_dict=mb)[1]
+                       for mb in minibatches(inputs)]
+                kl = mpi_avg(np.mean(kls))
+                if kl > 1.5 * target_kl:
+                    logger.log('Early stopping at pass %d due to reaching max kl.'%i)
+                    break
         logger.store(StopIter=i)
         for _ in range(train_v_iters):
-            sess.run(train_v, feed_dict=inputs)
+            for mb in minibatches(inputs):
+                sess.run(train_v, feed_dict=mb)
 
         # Log changes from update
         pi_l_new, v_l_new, kl, cf = sess.run([pi_loss, v_loss, approx_kl, clipfrac], feed_dict=inputs)
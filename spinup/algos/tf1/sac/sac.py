@@ -5,6 +5,10 @@ import time
 from spinup.algos.tf1.sac import core
 from spinup.algos.tf1.sac.core import get_vars
 from spinup.utils.logx import EpochLogger
+from spinup.utils.numpy_policy import SquashedGaussianNumpyPolicy, \
+    kwarg_or_default, max_action_error
+from spinup.utils.replay_tf import GraphReplayBuffer, polyak_update, update_loop
+from spinup.utils.session_tf import make_session, session_kwargs
 
 
 class ReplayBuffer:
@@ -43,7 +47,8 @@ def sac(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         steps_per_epoch=4000, epochs=100, replay_size=int(1e6), gamma=0.99, 
         polyak=0.995, lr=1e-3, alpha=0.2, batch_size=100, start_steps=10000, 
         update_after=1000, update_every=50, num_test_episodes=10, max_ep_len=1000, 
-        logger_kwargs=dict(), save_freq=1):
+        logger_kwargs=dict(), save_freq=1, numpy_act=False, graph_buffer=False,
+        sess_kwargs=dict()):
     """
     Soft Actor-Critic (SAC)
 
@@ -129,8 +134,31 @@ def sac(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         save_freq (int): How often (in terms of gap between epochs) to save
             the current policy and value function.
 
+        numpy_act (bool): Whether to compute actions in the env loop from a
+            NumPy copy of the policy, refreshed after every burst of updates,
+            instead of running the TF graph for each observation. The copy
+            is checked against the graph after every refresh, and acting
+            falls back to the graph if they disagree (e.g. for a custom
+            ``actor_critic`` the NumPy policy cannot reproduce).
+
+        graph_buffer (bool): Whether to keep the replay buffer in TF
+            variables and run each burst of ``update_every`` updates as a
+            ``tf.while_loop`` in a single ``sess.run``, instead of feeding
+            NumPy minibatches to separate ``sess.run`` calls. Much faster
+            for small networks. (Uses resource variables for the networks.)
+
+        sess_kwargs (dict): Settings for the TF session: ``intra_op_threads``
+            and ``inter_op_threads`` (by default sized to this process's
+            share of the CPUs, so that MPI processes do not oversubscribe
+            them) and ``xla`` (compile the update steps with XLA JIT). The
+            thread counts used are saved with the config. See
+            ``spinup/utils/session_tf.py``.
+
     """
 
+    # Session settings, with the thread counts filled in (saved with the config)
+    sess_kwargs = session_kwargs(**sess_kwargs)
+
     logger = EpochLogger(**logger_kwargs)
     logger.save_config(locals())
 
@@ -151,39 +179,55 @@ def sac(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     x_ph, a_ph, x2_ph, r_ph, d_ph = core.placeholders(obs_dim, act_dim, obs_dim, None, None)
 
     # Main outputs from computation graph
-    with tf.variable_scope('main'):
+    # (resource variables, if updating in a graph loop, so that each
+    # iteration reads the latest values)
+    use_resource = True if graph_buffer else None
+    with tf.variable_scope('main', use_resource=use_resource):
         mu, pi, logp_pi, q1, q2 = actor_critic(x_ph, a_ph, **ac_kwargs)
 
-    with tf.variable_scope('main', reuse=True):
-        # compose q with pi, for pi-learning
-        _, _, _, q1_pi, q2_pi = actor_critic(x_ph, pi, **ac_kwargs)
-
-        # get actions and log probs of actions for next states, for Q-learning
-        _, pi_next, logp_pi_next, _, _ = actor_critic(x2_ph, a_ph, **ac_kwargs)
-    
     # Target value network
-    with tf.variable_scope('target'):
-        # target q values, using actions from *current* policy
-        _, _, _, q1_targ, q2_targ  = actor_critic(x2_ph, pi_next, **ac_kwargs)
+    with tf.variable_scope('target', use_resource=use_resource):
+        actor_critic(x2_ph, a_ph, **ac_kwargs)
+
+    def sac_losses(x, a, x2, r, d):
+        with tf.variable_scope('main', reuse=True):
+            _, pi, logp_pi, q1, q2 = actor_critic(x, a, **ac_kwargs)
+
+            # compose q with pi, for pi-learning
+            _, _, _, q1_pi, q2_pi = actor_critic(x, pi, **ac_kwargs)
+
+            # get actions and log probs of actions for next states, for Q-learning
+            _, pi_next, logp_pi_next, _, _ = actor_critic(x2, a, **ac_kwargs)
+
+        with tf.variable_scope('target', reuse=True):
+            # target q values, using actions from *current* policy
+            _, _, _, q1_targ, q2_targ  = actor_critic(x2, pi_next, **ac_kwargs)
+
+        # Min Double-Q:
+        min_q_pi = tf.minimum(q1_pi, q2_pi)
+        min_q_targ = tf.minimum(q1_targ, q2_targ)
+
+        # Entropy-regularized Bellman backup for Q functions, using Clipped Double-Q targets
+        q_backup = tf.stop_gradient(r + gamma*(1-d)*(min_q_targ - alpha * logp_pi_next))
+
+        # Soft actor-critic losses
+        pi_loss = tf.reduce_mean(alpha * logp_pi - min_q_pi)
+        q1_loss = 0.5 * tf.reduce_mean((q_backup - q1)**2)
+        q2_loss = 0.5 * tf.reduce_mean((q_backup - q2)**2)
+        return pi_loss, q1_loss, q2_loss, q1, q2, logp_pi
 
     # Experience buffer
-    replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
+    if graph_buffer:
+        replay_buffer = GraphReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
+    else:
+        replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
 
     # Count variables
     var_counts = tuple(core.count_vars(scope) for scope in ['main/pi', 'main/q1', 'main/q2', 'main'])
     print('\nNumber of parameters: \t pi: %d, \t q1: %d, \t q2: %d, \t total: %d\n'%var_counts)
 
-    # Min Double-Q:
-    min_q_pi = tf.minimum(q1_pi, q2_pi)
-    min_q_targ = tf.minimum(q1_targ, q2_targ)
-
-    # Entropy-regularized Bellman backup for Q functions, using Clipped Double-Q targets
-    q_backup = tf.stop_gradient(r_ph + gamma*(1-d_ph)*(min_q_targ - alpha * logp_pi_next))
-
     # Soft actor-critic losses
-    pi_loss = tf.reduce_mean(alpha * logp_pi - min_q_pi)
-    q1_loss = 0.5 * tf.reduce_mean((q_backup - q1)**2)
-    q2_loss = 0.5 * tf.reduce_mean((q_backup - q2)**2)
+    pi_loss, q1_loss, q2_loss, q1, q2, logp_pi = sac_losses(x_ph, a_ph, x2_ph, r_ph, d_ph)
     value_loss = q1_loss + q2_loss
 
     # Policy train op 
@@ -200,27 +244,80 @@ def sac(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
 
     # Polyak averaging for target variables
     # (control flow because sess.run otherwise evaluates in nondeterministic order)
+    main_vars, targ_vars = get_vars('main'), get_vars('target')
     with tf.control_dependencies([train_value_op]):
-        target_update = tf.group([tf.assign(v_targ, polyak*v_targ + (1-polyak)*v_main)
-                                  for v_main, v_targ in zip(get_vars('main'), get_vars('target'))])
+        target_update = polyak_update(polyak, main_vars, targ_vars)
 
     # All ops to call during one training step
     step_ops = [pi_loss, q1_loss, q2_loss, q1, q2, logp_pi, 
                 train_pi_op, train_value_op, target_update]
 
+    # Burst of update_every training steps on minibatches from the in-graph
+    # buffer, as a graph loop
+    if graph_buffer:
+        pi_params = tf.trainable_variables('main/pi')
+
+        def update_step(j):
+            b = replay_buffer.sample_batch(batch_size)
+            outs = sac_losses(b['obs1'], b['acts'], b['obs2'], b['rews'], b['done'])
+            train_pi_b = pi_optimizer.apply_gradients(
+                pi_optimizer.compute_gradients(outs[0], var_list=pi_params))
+            with tf.control_dependencies([train_pi_b]):
+                train_value_b = value_optimizer.apply_gradients(
+                    value_optimizer.compute_gradients(outs[1] + outs[2], var_list=value_params))
+            with tf.control_dependencies([train_value_b]):
+                target_update_b = polyak_update(polyak, main_vars, targ_vars)
+            return outs, target_update_b
+
+        update_outs = update_loop(update_every, update_step, [tf.float32]*6)
+
     # Initializing targets to match main variables
     target_init = tf.group([tf.assign(v_targ, v_main)
                               for v_main, v_targ in zip(get_vars('main'), get_vars('target'))])
 
-    sess = tf.Session()
+    # Ops run by the update steps (compiled with XLA, if enabled)
+    update_ops = list(step_ops)
+    if graph_buffer:
+        update_ops += update_outs
+    sess = make_session(update_ops=update_ops, **sess_kwargs)
     sess.run(tf.global_variables_initializer())
     sess.run(target_init)
+    if graph_buffer:
+        sess.run(replay_buffer.initializer)
 
     # Setup model saving
     logger.setup_tf_saver(sess, inputs={'x': x_ph, 'a': a_ph}, 
                                 outputs={'mu': mu, 'pi': pi, 'q1': q1, 'q2': q2})
 
+    # NumPy copy of the policy for fast acting (optional)
+    np_pi, pi_vars = None, tf.trainable_variables('main/pi')
+    if numpy_act:
+        try:
+            np_pi = SquashedGaussianNumpyPolicy(
+                sess.run(pi_vars), env.action_space.high[0],
+                activation=kwarg_or_default(actor_critic, ac_kwargs, 'activation'),
+                log_std_min=core.LOG_STD_MIN, log_std_max=core.LOG_STD_MAX)
+        except (ValueError, IndexError) as e:
+            logger.log('Cannot build NumPy policy (%s), acting with the graph.'%e, color='red')
+
+    def sync_numpy_policy():
+        # Snapshot the latest policy weights, then make sure the NumPy
+        # policy still agrees with the graph (deterministic actions only,
+        # since the two sample noise from different generators).
+        nonlocal np_pi
+        np_pi.set_params(sess.run(pi_vars))
+        err = max_action_error(np_pi, lambda obs: sess.run(mu, feed_dict={x_ph: obs}), obs_dim)
+        if err > 1e-4 * env.action_space.high[0]:
+            logger.log('NumPy policy disagrees with graph (max error %.3g), '
+                       'acting with the graph.'%err, color='red')
+            np_pi = None
+
+    if np_pi is not None:
+        sync_numpy_policy()
+
     def get_action(o, deterministic=False):
+        if np_pi is not None:
+            return np_pi.act(o, deterministic)
         act_op = mu if deterministic else pi
         return sess.run(act_op, feed_dict={x_ph: o.reshape(1,-1)})[0]
 
@@ -272,7 +369,17 @@ def sac(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
             o, ep_ret, ep_len = env.reset(), 0, 0
 
         # Update handling
-        if t >= update_after and t % update_every == 0:
+        if t >= update_after and t % update_every == 0 and graph_buffer:
+            # Append new experience and run all updates in one sess.run
+            outs = sess.run(update_outs, replay_buffer.feed_dict())
+            logger.store(LossPi=outs[0], LossQ1=outs[1], LossQ2=outs[2],
+                         Q1Vals=outs[3].ravel(), Q2Vals=outs[4].ravel(), LogPi=outs[5].ravel())
+
+            # Refresh the NumPy copy of the policy
+            if np_pi is not None:
+                sync_numpy_policy()
+
+        elif t >= update_after and t % update_every == 0:
             for j in range(update_every):
                 batch = replay_buffer.sample_batch(batch_size)
                 feed_dict = {x_ph: batch['obs1'],
@@ -285,6 +392,10 @@ def sac(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
                 logger.store(LossPi=outs[0], LossQ1=outs[1], LossQ2=outs[2],
                              Q1Vals=outs[3], Q2Vals=outs[4], LogPi=outs[5])
 
+            # Refresh the NumPy copy of the policy
+            if np_pi is not None:
+                sync_numpy_policy()
+
         # End of epoch wrap-up
         if (t+1) % steps_per_epoch == 0:
             epoch = (t+1) // steps_per_epoch
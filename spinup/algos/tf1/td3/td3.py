@@ -5,6 +5,10 @@ import time
 from spinup.algos.tf1.td3 import core
 from spinup.algos.tf1.td3.core import get_vars
 from spinup.utils.logx import EpochLogger
+from spinup.utils.numpy_policy import DeterministicNumpyPolicy, \
+    kwarg_or_default, max_action_error
+from spinup.utils.replay_tf import GraphReplayBuffer, polyak_update, update_loop
+from spinup.utils.session_tf import make_session, session_kwargs
 
 
 class ReplayBuffer:
@@ -44,7 +48,9 @@ def td3(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         polyak=0.995, pi_lr=1e-3, q_lr=1e-3, batch_size=100, start_steps=10000, 
         update_after=1000, update_every=50, act_noise=0.1, target_noise=0.2, 
         noise_clip=0.5, policy_delay=2, num_test_episodes=10, max_ep_len=1000, 
-        logger_kwargs=dict(), save_freq=1):
+        logger_kwargs=dict(), save_freq=1, numpy_act=False, graph_buffer=False,
+        fused_update=False,
+        sess_kwargs=dict()):
     """
     Twin Delayed Deep Deterministic Policy Gradient (TD3)
 
@@ -137,8 +143,37 @@ def td3(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         save_freq (int): How often (in terms of gap between epochs) to save
             the current policy and value function.
 
+        numpy_act (bool): Whether to compute actions in the env loop from a
+            NumPy copy of the policy, refreshed after every burst of updates,
+            instead of running the TF graph for each observation. The copy
+            is checked against the graph after every refresh, and acting
+            falls back to the graph if they disagree (e.g. for a custom
+            ``actor_critic`` the NumPy policy cannot reproduce).
+
+        graph_buffer (bool): Whether to keep the replay buffer in TF
+            variables and run each burst of ``update_every`` updates as a
+            ``tf.while_loop`` in a single ``sess.run``, instead of feeding
+            NumPy minibatches to separate ``sess.run`` calls. Much faster
+            for small networks. (Uses resource variables for the networks.)
+
+        fused_update (bool): Whether to run the critic step, the delayed
+            actor step and the target update as one op, sequenced with
+            control dependencies, so that each update is a single
+            ``sess.run`` with a single feed. (Uses resource variables for
+            the networks.)
+
+        sess_kwargs (dict): Settings for the TF session: ``intra_op_threads``
+            and ``inter_op_threads`` (by default sized to this process's
+            share of the CPUs, so that MPI processes do not oversubscribe
+            them) and ``xla`` (compile the update steps with XLA JIT). The
+            thread counts used are saved with the config. See
+            ``spinup/utils/session_tf.py``.
+
     """
 
+    # Session settings, with the thread counts filled in (saved with the config)
+    sess_kwargs = session_kwargs(**sess_kwargs)
+
     logger = EpochLogger(**logger_kwargs)
     logger.save_config(locals())
 
@@ -159,27 +194,38 @@ def td3(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     x_ph, a_ph, x2_ph, r_ph, d_ph = core.placeholders(obs_dim, act_dim, obs_dim, None, None)
 
     # Main outputs from computation graph
-    with tf.variable_scope('main'):
+    # (resource variables, if updating in a graph loop, so that each
+    # iteration reads the latest values)
+    use_resource = True if (graph_buffer or fused_update) else None
+    with tf.variable_scope('main', use_resource=use_resource):
         pi, q1, q2, q1_pi = actor_critic(x_ph, a_ph, **ac_kwargs)
     
     # Target policy network
-    with tf.variable_scope('target'):
+    with tf.variable_scope('target', use_resource=use_resource):
         pi_targ, _, _, _  = actor_critic(x2_ph, a_ph, **ac_kwargs)
-    
-    # Target Q networks
-    with tf.variable_scope('target', reuse=True):
 
-        # Target policy smoothing, by adding clipped noise to target actions
-        epsilon = tf.random_normal(tf.shape(pi_targ), stddev=target_noise)
-        epsilon = tf.clip_by_value(epsilon, -noise_clip, noise_clip)
-        a2 = pi_targ + epsilon
-        a2 = tf.clip_by_value(a2, -act_limit, act_limit)
+    def target_q(x2, a, reuse=True):
+        with tf.variable_scope('target', reuse=reuse):
+            pi_targ = actor_critic(x2, a, **ac_kwargs)[0]
 
-        # Target Q-values, using action from target policy
-        _, q1_targ, q2_targ, _ = actor_critic(x2_ph, a2, **ac_kwargs)
+            # Target policy smoothing, by adding clipped noise to target actions
+            epsilon = tf.random_normal(tf.shape(pi_targ), stddev=target_noise)
+            epsilon = tf.clip_by_value(epsilon, -noise_clip, noise_clip)
+            a2 = pi_targ + epsilon
+            a2 = tf.clip_by_value(a2, -act_limit, act_limit)
+
+            # Target Q-values, using action from target policy
+            _, q1_targ, q2_targ, _ = actor_critic(x2, a2, **ac_kwargs)
+        return q1_targ, q2_targ
+
+    # Target Q networks
+    q1_targ, q2_targ = target_q(x2_ph, a_ph)
 
     # Experience buffer
-    replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
+    if graph_buffer:
+        replay_buffer = GraphReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
+    else:
+        replay_buffer = ReplayBuffer(obs_dim=obs_dim, act_dim=act_dim, size=replay_size)
 
     # Count variables
     var_counts = tuple(core.count_vars(scope) for scope in ['main/pi', 'main/q1', 'main/q2', 'main'])
@@ -202,22 +248,97 @@ def td3(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     train_q_op = q_optimizer.minimize(q_loss, var_list=get_vars('main/q'))
 
     # Polyak averaging for target variables
-    target_update = tf.group([tf.assign(v_targ, polyak*v_targ + (1-polyak)*v_main)
-                              for v_main, v_targ in zip(get_vars('main'), get_vars('target'))])
+    main_vars, targ_vars = get_vars('main'), get_vars('target')
+    target_update = polyak_update(polyak, main_vars, targ_vars)
+
+    pi_params, q_params = tf.trainable_variables('main/pi'), tf.trainable_variables('main/q')
+
+    def policy_step(x, a, after):
+        # Delayed policy update, then target update, both after op `after`
+        with tf.control_dependencies([after]):
+            with tf.variable_scope('main', reuse=True):
+                q1_pi = actor_critic(x, a, **ac_kwargs)[3]
+            pi_loss = -tf.reduce_mean(q1_pi)
+            train_pi = pi_optimizer.apply_gradients(
+                pi_optimizer.compute_gradients(pi_loss, var_list=pi_params))
+        with tf.control_dependencies([train_pi]):
+            target_update = polyak_update(polyak, main_vars, targ_vars)
+        with tf.control_dependencies([target_update]):
+            return tf.identity(pi_loss)
+
+    # Critic step, actor step and target update in one op
+    if fused_update:
+        fused_step_ops = [q_loss, q1, q2, policy_step(x_ph, a_ph, train_q_op)]
+
+    # Burst of update_every updates on minibatches from the in-graph buffer,
+    # as a graph loop (mirrors the update handling in the main loop below)
+    if graph_buffer:
+        def update_step(j):
+            batch = replay_buffer.sample_batch(batch_size)
+            with tf.variable_scope('main', reuse=True):
+                _, q1_b, q2_b, _ = actor_critic(batch['obs1'], batch['acts'], **ac_kwargs)
+            q1_targ_b, q2_targ_b = target_q(batch['obs2'], batch['acts'])
+            min_q_targ_b = tf.minimum(q1_targ_b, q2_targ_b)
+            backup_b = tf.stop_gradient(batch['rews'] + gamma*(1-batch['done'])*min_q_targ_b)
+            q_loss_b = tf.reduce_mean((q1_b-backup_b)**2) + tf.reduce_mean((q2_b-backup_b)**2)
+            train_q_b = q_optimizer.apply_gradients(
+                q_optimizer.compute_gradients(q_loss_b, var_list=q_params))
+            pi_loss_b = tf.cond(tf.equal(j % policy_delay, 0),
+                                lambda: policy_step(batch['obs1'], batch['acts'], train_q_b),
+                                lambda: 0.)
+            return [q_loss_b, q1_b, q2_b, pi_loss_b], tf.group(train_q_b, pi_loss_b)
+
+        update_outs = update_loop(update_every, update_step, [tf.float32]*4)
 
     # Initializing targets to match main variables
     target_init = tf.group([tf.assign(v_targ, v_main)
                               for v_main, v_targ in zip(get_vars('main'), get_vars('target'))])
 
-    sess = tf.Session()
+    # Ops run by the update steps (compiled with XLA, if enabled)
+    update_ops = [train_q_op, train_pi_op, target_update]
+    if fused_update:
+        update_ops += fused_step_ops
+    if graph_buffer:
+        update_ops += update_outs
+    sess = make_session(update_ops=update_ops, **sess_kwargs)
     sess.run(tf.global_variables_initializer())
     sess.run(target_init)
+    if graph_buffer:
+        sess.run(replay_buffer.initializer)
 
     # Setup model saving
     logger.setup_tf_saver(sess, inputs={'x': x_ph, 'a': a_ph}, outputs={'pi': pi, 'q1': q1, 'q2': q2})
 
+    # NumPy copy of the policy for fast acting (optional)
+    np_pi, pi_vars = None, tf.trainable_variables('main/pi')
+    if numpy_act:
+        try:
+            np_pi = DeterministicNumpyPolicy(
+                sess.run(pi_vars), act_limit,
+                activation=kwarg_or_default(actor_critic, ac_kwargs, 'activation'),
+                output_activation=kwarg_or_default(actor_critic, ac_kwargs, 'output_activation'))
+        except (ValueError, IndexError) as e:
+            logger.log('Cannot build NumPy policy (%s), acting with the graph.'%e, color='red')
+
+    def sync_numpy_policy():
+        # Snapshot the latest policy weights, then make sure the NumPy
+        # policy still agrees with the graph.
+        nonlocal np_pi
+        np_pi.set_params(sess.run(pi_vars))
+        err = max_action_error(np_pi, lambda obs: sess.run(pi, feed_dict={x_ph: obs}), obs_dim)
+        if err > 1e-4 * act_limit:
+            logger.log('NumPy policy disagrees with graph (max error %.3g), '
+                       'acting with the graph.'%err, color='red')
+            np_pi = None
+
+    if np_pi is not None:
+        sync_numpy_policy()
+
     def get_action(o, noise_scale):
-        a = sess.run(pi, feed_dict={x_ph: o.reshape(1,-1)})[0]
+        if np_pi is not None:
+            a = np_pi.act(o)
+        else:
+            a = sess.run(pi, feed_dict={x_ph: o.reshape(1,-1)})[0]
         a += noise_scale * np.random.randn(act_dim)
         return np.clip(a, -act_limit, act_limit)
 
@@ -269,7 +390,17 @@ def td3(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
             o, ep_ret, ep_len = env.reset(), 0, 0
 
         # Update handling
-        if t >= update_after and t % update_every == 0:
+        if t >= update_after and t % update_every == 0 and graph_buffer:
+            # Append new experience and run all updates in one sess.run
+            outs = sess.run(update_outs, replay_buffer.feed_dict())
+            logger.store(LossQ=outs[0], Q1Vals=outs[1].ravel(), Q2Vals=outs[2].ravel(),
+                         LossPi=outs[3][::policy_delay])
+
+            # Refresh the NumPy copy of the policy
+            if np_pi is not None:
+                sync_numpy_policy()
+
+        elif t >= update_after and t % update_every == 0:
             for j in range(update_every):
                 batch = replay_buffer.sample_batch(batch_size)
                 feed_dict = {x_ph: batch['obs1'],
@@ -278,6 +409,12 @@ def td3(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
                              r_ph: batch['rews'],
                              d_ph: batch['done']
                             }
+                if fused_update and j % policy_delay == 0:
+                    # Q update, delayed policy update and target update
+                    outs = sess.run(fused_step_ops, feed_dict)
+                    logger.store(LossQ=outs[0], Q1Vals=outs[1], Q2Vals=outs[2], LossPi=outs[3])
+                    continue
+
                 q_step_ops = [q_loss, q1, q2, train_q_op]
                 outs = sess.run(q_step_ops, feed_dict)
                 logger.store(LossQ=outs[0], Q1Vals=outs[1], Q2Vals=outs[2])
@@ -287,6 +424,10 @@ def td3(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
                     outs = sess.run([pi_loss, train_pi_op, target_update], feed_dict)
                     logger.store(LossPi=outs[0])
 
+            # Refresh the NumPy copy of the policy
+            if np_pi is not None:
+                sync_numpy_policy()
+
         # End of epoch wrap-up
         if (t+1) % steps_per_epoch == 0:
             epoch = (t+1) // steps_per_epoch
@@ -79,6 +79,29 @@ def hessian_vector_product(f, params):
     x = tf.placeholder(tf.float32, shape=g.shape)
     return x, flat_grad(tf.reduce_sum(g*x), params)
 
+def hessian_vector_product_fn(f, params):
+    # for H = grad**2 f, a function of a vector tensor x returning Hx
+    g = flat_grad(f, params)
+    return lambda x: flat_grad(tf.reduce_sum(g*tf.stop_gradient(x)), params)
+
+def conjugate_gradient(Ax, b, iters, eps=1e-8):
+    """
+    Conjugate gradient algorithm, unrolled in the graph for a function
+    ``Ax`` of vector tensors (see ``cg`` in ``trpo.py``).
+    """
+    x = tf.zeros_like(b)
+    r, p = b, b
+    r_dot_old = tf.reduce_sum(r*r)
+    for _ in range(iters):
+        z = Ax(p)
+        alpha = r_dot_old / (tf.reduce_sum(p*z) + eps)
+        x += alpha * p
+        r -= alpha * z
+        r_dot_new = tf.reduce_sum(r*r)
+        p = r + (r_dot_new / r_dot_old) * p
+        r_dot_old = r_dot_new
+    return x
+
 def assign_params_from_flat(x, params):
     flat_size = lambda p : int(np.prod(p.shape.as_list())) # the 'int' is important for scalars
     splits = tf.split(x, [flat_size(p) for p in params])
@@ -106,7 +129,8 @@ def discount_cumsum(x, discount):
 Policies
 """
 
-def mlp_categorical_policy(x, a, hidden_sizes, activation, output_activation, action_space):
+def mlp_categorical_policy(x, a, hidden_sizes, activation, output_activation, action_space,
+                           info_phs=None):
     act_dim = action_space.n
     logits = mlp(x, list(hidden_sizes)+[act_dim], activation, None)
     logp_all = tf.nn.log_softmax(logits)
@@ -114,7 +138,7 @@ def mlp_categorical_policy(x, a, hidden_sizes, activation, output_activation, ac
     logp = tf.reduce_sum(tf.one_hot(a, depth=act_dim) * logp_all, axis=1)
     logp_pi = tf.reduce_sum(tf.one_hot(pi, depth=act_dim) * logp_all, axis=1)
 
-    old_logp_all = placeholder(act_dim)
+    old_logp_all = placeholder(act_dim) if info_phs is None else info_phs['logp_all']
     d_kl = categorical_kl(logp_all, old_logp_all)
 
     info = {'logp_all': logp_all}
@@ -123,7 +147,8 @@ def mlp_categorical_policy(x, a, hidden_sizes, activation, output_activation, ac
     return pi, logp, logp_pi, info, info_phs, d_kl
 
 
-def mlp_gaussian_policy(x, a, hidden_sizes, activation, output_activation, action_space):
+def mlp_gaussian_policy(x, a, hidden_sizes, activation, output_activation, action_space,
+                        info_phs=None):
     act_dim = a.shape.as_list()[-1]
     mu = mlp(x, list(hidden_sizes)+[act_dim], activation, output_activation)
     log_std = tf.get_variable(name='log_std', initializer=-0.5*np.ones(act_dim, dtype=np.float32))
@@ -132,7 +157,10 @@ def mlp_gaussian_policy(x, a, hidden_sizes, activation, output_activation, actio
     logp = gaussian_likelihood(a, mu, log_std)
     logp_pi = gaussian_likelihood(pi, mu, log_std)
 
-    old_mu_ph, old_log_std_ph = placeholders(act_dim, act_dim)
+    if info_phs is None:
+        old_mu_ph, old_log_std_ph = placeholders(act_dim, act_dim)
+    else:
+        old_mu_ph, old_log_std_ph = info_phs['mu'], info_phs['log_std']
     d_kl = diagonal_gaussian_kl(mu, log_std, old_mu_ph, old_log_std_ph)
 
     info = {'mu': mu, 'log_std': log_std}
@@ -145,7 +173,7 @@ def mlp_gaussian_policy(x, a, hidden_sizes, activation, output_activation, actio
 Actor-Critics
 """
 def mlp_actor_critic(x, a, hidden_sizes=(64,64), activation=tf.tanh, 
-                     output_activation=None, policy=None, action_space=None):
+                     output_activation=None, policy=None, action_space=None, info_phs=None):
 
     # default policy builder depends on action space
     if policy is None and isinstance(action_space, Box):
@@ -154,7 +182,10 @@ def mlp_actor_critic(x, a, hidden_sizes=(64,64), activation=tf.tanh,
         policy = mlp_categorical_policy
 
     with tf.variable_scope('pi'):
-        policy_outs = policy(x, a, hidden_sizes, activation, output_activation, action_space)
+        # info_phs: inputs to use for the old pdist, instead of new placeholders
+        policy_kwargs = {} if info_phs is None else dict(info_phs=info_phs)
+        policy_outs = policy(x, a, hidden_sizes, activation, output_activation, action_space,
+                             **policy_kwargs)
         pi, logp, logp_pi, info, info_phs, d_kl = policy_outs
     with tf.variable_scope('v'):
         v = tf.squeeze(mlp(x, list(hidden_sizes)+[1], activation, None), axis=1)
@@ -3,8 +3,11 @@ import tensorflow as tf
 import gym
 import time
 import spinup.algos.tf1.trpo.core as core
+from spinup.utils.advantages import gae_and_returns
 from spinup.utils.logx import EpochLogger
-from spinup.utils.mpi_tf import MpiAdamOptimizer, sync_all_params
+from spinup.utils.mpi_tf import MpiAdamOptimizer, sync_all_params, mpi_avg_tensor
+from spinup.utils.resident_tf import ResidentBatch
+from spinup.utils.session_tf import make_session, session_kwargs
 from spinup.utils.mpi_tools import mpi_fork, mpi_avg, proc_id, mpi_statistics_scalar, num_procs
 
 
@@ -29,6 +32,7 @@ class GAEBuffer:
         self.sorted_info_keys = core.keys_as_sorted_list(self.info_bufs)
         self.gamma, self.lam = gamma, lam
         self.ptr, self.path_start_idx, self.max_size = 0, 0, size
+        self.path_ends, self.last_vals = [], []
 
     def store(self, obs, act, rew, val, logp, info):
         """
@@ -47,11 +51,12 @@ class GAEBuffer:
     def finish_path(self, last_val=0):
         """
         Call this at the end of a trajectory, or when one gets cut off
-        by an epoch ending. This looks back in the buffer to where the
-        trajectory started, and uses rewards and value estimates from
-        the whole trajectory to compute advantage estimates with GAE-Lambda,
-        as well as compute the rewards-to-go for each state, to use as
-        the targets for the value function.
+        by an epoch ending. This marks where the trajectory ends, so that
+        ``get`` can use rewards and value estimates from the whole
+        trajectory to compute advantage estimates with GAE-Lambda, as well
+        as compute the rewards-to-go for each state, to use as the targets
+        for the value function. (All trajectories of the epoch are processed
+        together; see ``spinup/utils/advantages.py``.)
 
         The "last_val" argument should be 0 if the trajectory ended
         because the agent reached a terminal state (died), and otherwise
@@ -60,17 +65,8 @@ class GAEBuffer:
         for timesteps beyond the arbitrary episode horizon (or epoch cutoff).
         """
 
-        path_slice = slice(self.path_start_idx, self.ptr)
-        rews = np.append(self.rew_buf[path_slice], last_val)
-        vals = np.append(self.val_buf[path_slice], last_val)
-        
-        # the next two lines implement GAE-Lambda advantage calculation
-        deltas = rews[:-1] + self.gamma * vals[1:] - vals[:-1]
-        self.adv_buf[path_slice] = core.discount_cumsum(deltas, self.gamma * self.lam)
-        
-        # the next line computes rewards-to-go, to be targets for the value function
-        self.ret_buf[path_slice] = core.discount_cumsum(rews, self.gamma)[:-1]
-        
+        self.path_ends.append(self.ptr)
+        self.last_vals.append(last_val)
         self.path_start_idx = self.ptr
 
     def get(self):
@@ -81,6 +77,10 @@ class GAEBuffer:
         """
         assert self.ptr == self.max_size    # buffer has to be full before you can get
         self.ptr, self.path_start_idx = 0, 0
+        # GAE-Lambda advantages and rewards-to-go, for all trajectories at once
+        self.adv_buf[:], self.ret_buf[:] = gae_and_returns(
+            self.rew_buf, self.val_buf, self.path_ends, self.last_vals, self.gamma, self.lam)
+        self.path_ends, self.last_vals = [], []
         # the next two lines implement the advantage normalization trick
         adv_mean, adv_std = mpi_statistics_scalar(self.adv_buf)
         self.adv_buf = (self.adv_buf - adv_mean) / adv_std
@@ -93,7 +93,9 @@ def trpo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
          steps_per_epoch=4000, epochs=50, gamma=0.99, delta=0.01, vf_lr=1e-3,
          train_v_iters=80, damping_coeff=0.1, cg_iters=10, backtrack_iters=10, 
          backtrack_coeff=0.8, lam=0.97, max_ep_len=1000, logger_kwargs=dict(), 
-         save_freq=10, algo='trpo'):
+         save_freq=10, algo='trpo', resident_data=False,
+         graph_cg=False, hvp_subsample=1.0,
+         sess_kwargs=dict()):
     """
     Trust Region Policy Optimization 
 
@@ -194,8 +196,38 @@ def trpo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
         algo: Either 'trpo' or 'npg': this code supports both, since they are 
             almost the same.
 
+        resident_data (bool): Upload each epoch's data into TF variables
+            once (see ``spinup/utils/resident_tf.py``) and run the gradient,
+            Hessian-vector products, line search and value function updates
+            on it without feeds, instead of feeding the whole batch to every
+            ``sess.run``. A custom ``actor_critic`` must then take an
+            ``info_phs`` argument: a dict of tensors to use for the old
+            pdist instead of making its own placeholders (as
+            ``core.mlp_actor_critic`` does).
+
+        graph_cg (bool): Run the conjugate gradient solve (unrolled in the
+            graph, with the gradient and step size) in a single
+            ``sess.run``, instead of one ``sess.run`` per Hessian-vector
+            product. Best combined with ``resident_data``, so that the line
+            search does not feed the batch either.
+
+        hvp_subsample (float): Fraction of the batch (per MPI process),
+            resampled every update, on which to compute the Hessian-vector
+            products for CG and the step size. The gradient and the line
+            search always use the full batch.
+
+        sess_kwargs (dict): Settings for the TF session: ``intra_op_threads``
+            and ``inter_op_threads`` (by default sized to this process's
+            share of the CPUs, so that MPI processes do not oversubscribe
+            them) and ``xla`` (compile the update steps with XLA JIT). The
+            thread counts used are saved with the config. See
+            ``spinup/utils/session_tf.py``.
+
     """
 
+    # Session settings, with the thread counts filled in (saved with the config)
+    sess_kwargs = session_kwargs(**sess_kwargs)
+
     logger = EpochLogger(**logger_kwargs)
     logger.save_config(locals())
 
@@ -213,9 +245,28 @@ def trpo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     # Inputs to computation graph
     x_ph, a_ph = core.placeholders_from_spaces(env.observation_space, env.action_space)
     adv_ph, ret_ph, logp_old_ph = core.placeholders(None, None, None)
+    local_steps_per_epoch = int(steps_per_epoch / num_procs())
+
+    # Optionally keep each epoch's data in the graph instead of feeding it
+    resident_kwargs = dict()
+    if resident_data:
+        # actor_critic makes the placeholders for the old pdist: take their
+        # keys and shapes from a copy built in a scratch graph, and pass it
+        # the matching resident inputs instead
+        with tf.Graph().as_default():
+            scratch_phs = core.placeholders_from_spaces(env.observation_space, env.action_space)
+            scratch_info_phs = actor_critic(*scratch_phs, **ac_kwargs)[4]
+        info_keys = core.keys_as_sorted_list(scratch_info_phs)
+        info_phs = [tf.placeholder(scratch_info_phs[k].dtype, scratch_info_phs[k].shape)
+                    for k in info_keys]
+        batch = ResidentBatch([x_ph, a_ph, adv_ph, ret_ph, logp_old_ph] + info_phs,
+                              local_steps_per_epoch, indexed=hvp_subsample < 1)
+        x_ph, a_ph, adv_ph, ret_ph, logp_old_ph = batch.inputs[:5]
+        resident_kwargs['info_phs'] = dict(zip(info_keys, batch.inputs[5:]))
 
     # Main outputs from computation graph, plus placeholders for old pdist (for KL)
-    pi, logp, logp_pi, info, info_phs, d_kl, v = actor_critic(x_ph, a_ph, **ac_kwargs)
+    pi, logp, logp_pi, info, info_phs, d_kl, v = actor_critic(x_ph, a_ph, **ac_kwargs,
+                                                              **resident_kwargs)
 
     # Need all placeholders in *this* order later (to zip with data from buffer)
     all_phs = [x_ph, a_ph, adv_ph, ret_ph, logp_old_ph] + core.values_as_sorted_list(info_phs)
@@ -224,7 +275,6 @@ def trpo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     get_action_ops = [pi, v, logp_pi] + core.values_as_sorted_list(info)
 
     # Experience buffer
-    local_steps_per_epoch = int(steps_per_epoch / num_procs())
     info_shapes = {k: v.shape.as_list()[1:] for k,v in info_phs.items()}
     buf = GAEBuffer(obs_dim, act_dim, local_steps_per_epoch, info_shapes, gamma, lam)
 
@@ -251,8 +301,21 @@ def trpo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
     get_pi_params = core.flat_concat(pi_params)
     set_pi_params = core.assign_params_from_flat(v_ph, pi_params)
 
-    sess = tf.Session()
+    # Symbols for the whole CG solve in one go (Hx averaged across processes)
+    if graph_cg:
+        hvp_fn = core.hessian_vector_product_fn(d_kl, pi_params)
+        Hx_t = lambda x: mpi_avg_tensor(hvp_fn(x)) + damping_coeff * x
+        cg_x = core.conjugate_gradient(Hx_t, mpi_avg_tensor(gradient), cg_iters, EPS)
+        cg_xHx = tf.reduce_sum(cg_x * Hx_t(cg_x))
+
+    # Ops run by the update steps (compiled with XLA, if enabled)
+    update_ops = [train_vf, gradient, hvp]
+    if graph_cg:
+        update_ops += [cg_x, cg_xHx]
+    sess = make_session(update_ops=update_ops, **sess_kwargs)
     sess.run(tf.global_variables_initializer())
+    if resident_data:
+        sess.run(batch.initializer)
 
     # Sync params across processes
     sess.run(sync_all_params())
@@ -281,15 +344,41 @@ def trpo(env_fn, actor_critic=core.mlp_actor_critic, ac_kwargs=dict(), seed=0,
 
     def update():
         # Prepare hessian func, gradient eval
-        inputs = {k:v for k,v in zip(all_phs, buf.get())}
-        Hx = lambda x : mpi_avg(sess.run(hvp, feed_dict={**inputs, v_ph: x}))
-        g, pi_l_old, v_l_old = sess.run([gradient, pi_loss, v_loss], feed_dict=inputs)
-        g, pi_l_old = mpi_avg(g), mpi_avg(pi_l_old)
+        if resident_data:
+            batch.load(sess, buf.get())
+            inputs = {}
+        else:
+            inputs = {k:v for k,v in zip(all_phs, buf.get())}
+
+        # Optionally compute the Hessian-vector products on a subsample
+        hvp_inputs = inputs
+        if hvp_subsample < 1:
+            n = local_steps_per_epoch
+            idxs = np.sort(np.random.choice(n, max(int(hvp_subsample * n), 1), replace=False))
+            if resident_data:
+                hvp_inputs = {batch.idxs_ph: idxs}
+            else:
+                hvp_inputs = {k: v[idxs] for k, v in inputs.items()}
+        Hx = lambda x : mpi_avg(sess.run(hvp, feed_dict={**hvp_inputs, v_ph: x}))
 
         # Core calculations for TRPO or NPG
-        x = cg(Hx, g)
-        alpha = np.sqrt(2*delta/(np.dot(x, Hx(x))+EPS))
-        old_params = sess.run(get_pi_params)
+        if graph_cg and hvp_subsample < 1:
+            # Full-batch gradient first, then CG fed with it on the subsample
+            g, pi_l_old, v_l_old, old_params = sess.run(
+                [gradient, pi_loss, v_loss, get_pi_params], feed_dict=inputs)
+            x, xHx = sess.run([cg_x, cg_xHx], feed_dict={**hvp_inputs, gradient: g})
+            pi_l_old = mpi_avg(pi_l_old)
+        elif graph_cg:
+            x, xHx, pi_l_old, v_l_old, old_params = sess.run(
+                [cg_x, cg_xHx, pi_loss, v_loss, get_pi_params], feed_dict=inputs)
+            pi_l_old = mpi_avg(pi_l_old)
+        else:
+            g, pi_l_old, v_l_old = sess.run([gradient, pi_loss, v_loss], feed_dict=inputs)
+            g, pi_l_old = mpi_avg(g), mpi_avg(pi_l_old)
+            x = cg(Hx, g)
+            xHx = np.dot(x, Hx(x))
+            old_params = sess.run(get_pi_params)
+        alpha = np.sqrt(2*delta/(xHx+EPS))
 
         def set_and_eval(step):
             sess.run(set_pi_params, feed_dict={v_ph: old_params - alpha * x * step})
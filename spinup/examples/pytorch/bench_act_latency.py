@@ -0,0 +1,69 @@
+"""
+Per-step acting latency of the PyTorch actor-critics: the standard
+``step``/``act`` methods versus the single-observation fast paths
+(``step_single``/``act_single``). Also checks that both give identical
+outputs from the same random seed.
+"""
+import time
+import numpy as np
+import torch
+from gym.spaces import Box, Discrete
+import spinup.algos.pytorch.ppo.core as ppo_core
+import spinup.algos.pytorch.sac.core as sac_core
+import spinup.algos.pytorch.td3.core as td3_core
+
+
+def time_per_call(fn, obs):
+    fn(obs[0])
+    start = time.perf_counter()
+    for o in obs:
+        fn(o)
+    return (time.perf_counter() - start) / len(obs)
+
+
+def outputs(fn, obs, seed):
+    torch.manual_seed(seed)
+    return [fn(o) for o in obs]
+
+
+def same(x, y):
+    if isinstance(x, tuple):
+        return all(same(a, b) for a, b in zip(x, y))
+    return np.array_equal(np.asarray(x), np.asarray(y))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--obs_dim', type=int, default=17)
+    parser.add_argument('--act_dim', type=int, default=6)
+    parser.add_argument('--steps', type=int, default=10000)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    obs_space = Box(-np.inf, np.inf, (args.obs_dim,), dtype=np.float32)
+    act_space = Box(-1, 1, (args.act_dim,), dtype=np.float32)
+    obs = np.random.randn(args.steps, args.obs_dim)
+
+    as_tensor = lambda o: torch.as_tensor(o, dtype=torch.float32)
+    ppo_box = ppo_core.MLPActorCritic(obs_space, act_space)
+    ppo_discrete = ppo_core.MLPActorCritic(obs_space, Discrete(args.act_dim))
+    sac = sac_core.MLPActorCritic(obs_space, act_space)
+    td3 = td3_core.MLPActorCritic(obs_space, act_space)
+    cases = [
+        ('ppo/vpg step (Box)', lambda o: ppo_box.step(as_tensor(o)), ppo_box.step_single),
+        ('ppo/vpg step (Discrete)', lambda o: ppo_discrete.step(as_tensor(o)), ppo_discrete.step_single),
+        ('sac act', lambda o: sac.act(as_tensor(o)), sac.act_single),
+        ('sac act (deterministic)', lambda o: sac.act(as_tensor(o), True),
+                                    lambda o: sac.act_single(o, True)),
+        ('td3/ddpg act', lambda o: td3.act(as_tensor(o)), td3.act_single),
+    ]
+
+    print('%-26s %12s %12s %8s %10s'%('', 'before (us)', 'after (us)', 'speedup', 'identical'))
+    for name, before, after in cases:
+        identical = all(same(x, y) for x, y in zip(outputs(before, obs[:1000], 0),
+                                                   outputs(after, obs[:1000], 0)))
+        t_before, t_after = time_per_call(before, obs), time_per_call(after, obs)
+        print('%-26s %12.1f %12.1f %7.1fx %10s'%(name, 1e6*t_before, 1e6*t_after,
+                                                   t_before/t_after, identical))
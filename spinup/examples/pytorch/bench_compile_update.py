@@ -0,0 +1,61 @@
+"""
+Speedup of ``compile_update=True`` for each PyTorch algorithm.
+
+Trains every algorithm for a few short epochs, eagerly and compiled, and
+compares the time per epoch after the first one (which includes the
+compilation). The epochs include environment interaction, so the speedup
+of the updates alone is larger than the one reported.
+"""
+import gym
+import numpy as np
+import os.path as osp
+import pandas as pd
+import tempfile
+import torch
+from spinup import ddpg_pytorch, ppo_pytorch, sac_pytorch, td3_pytorch, vpg_pytorch
+from spinup.utils.logx import colorize
+
+ALGOS = dict(sac=sac_pytorch, td3=td3_pytorch, ddpg=ddpg_pytorch,
+             ppo=ppo_pytorch, vpg=vpg_pytorch)
+
+def epoch_time(algo, env_fn, compile_update, epochs=3, steps_per_epoch=2000,
+               hid=(64,64)):
+    """Mean wall time of the epochs after the first one."""
+    output_dir = tempfile.mkdtemp()
+    kwargs = dict(ac_kwargs=dict(hidden_sizes=hid), epochs=epochs,
+                  steps_per_epoch=steps_per_epoch, compile_update=compile_update,
+                  logger_kwargs=dict(output_dir=output_dir))
+    if algo in ['sac', 'td3', 'ddpg']:
+        kwargs.update(start_steps=steps_per_epoch//2, update_after=steps_per_epoch//2)
+    # Compiled code is cached per function; start each run from scratch
+    if hasattr(torch, '_dynamo'):
+        torch._dynamo.reset()
+    torch.manual_seed(0)
+    ALGOS[algo](env_fn, **kwargs)
+    times = pd.read_table(osp.join(output_dir, 'progress.txt'))['Time'].values
+    return np.diff(times).mean()
+
+def bench(env_fn, algos=tuple(ALGOS), **kwargs):
+    results = {}
+    for algo in algos:
+        eager = epoch_time(algo, env_fn, False, **kwargs)
+        compiled = epoch_time(algo, env_fn, True, **kwargs)
+        results[algo] = (eager, compiled)
+    print(colorize('\nTime per epoch (s), eager vs compiled:', color='green', bold=True))
+    for algo, (eager, compiled) in results.items():
+        print('  %-5s %8.2f %8.2f   %.2fx'%(algo, eager, compiled, eager/compiled))
+    return results
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default='Pendulum-v0')
+    parser.add_argument('--algos', type=str, nargs='+', default=list(ALGOS))
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--hid', type=int, default=64)
+    parser.add_argument('--l', type=int, default=2)
+    args = parser.parse_args()
+
+    bench(lambda : gym.make(args.env), args.algos, epochs=args.epochs,
+          steps_per_epoch=args.steps, hid=[args.hid]*args.l)
@@ -0,0 +1,20 @@
+from spinup import ppo_multiseed_pytorch
+import gym
+import torch
+
+if __name__ == '__main__':
+    # Same benchmark as bench_ppo_cartpole.py, with all seeds of each
+    # configuration trained in one process with stacked networks
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_runs', type=int, default=3)
+    args = parser.parse_args()
+
+    for hid, hid_name in [((32,), '32'), ((64,64), '64-64')]:
+        for activation in [torch.nn.Tanh, torch.nn.ReLU]:
+            ppo_multiseed_pytorch(lambda : gym.make('CartPole-v0'),
+                                  ac_kwargs=dict(hidden_sizes=hid, activation=activation),
+                                  seeds=[10*i for i in range(args.num_runs)],
+                                  epochs=10, steps_per_epoch=4000,
+                                  exp_name='ppo-pyt-bench-multiseed_hid%s_%s'%(
+                                      hid_name, activation.__name__.lower()))
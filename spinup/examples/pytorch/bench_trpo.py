@@ -0,0 +1,52 @@
+"""
+Throughput of the PyTorch TRPO against the Tensorflow one.
+
+Trains both versions for a few short epochs with the same settings and
+compares the time per epoch after the first one (which includes graph
+construction and warm-up). The epochs include environment interaction, so
+the difference between the updates alone is not reported separately.
+"""
+import gym
+import numpy as np
+import os.path as osp
+import pandas as pd
+import tempfile
+from spinup import trpo_pytorch, trpo_tf1
+from spinup.utils.logx import colorize
+
+ALGOS = dict(pytorch=trpo_pytorch, tf1=trpo_tf1)
+
+def epoch_time(backend, env_fn, epochs=4, steps_per_epoch=4000, hid=(64,64), **kwargs):
+    """Mean wall time of the epochs after the first one."""
+    output_dir = tempfile.mkdtemp()
+    if backend == 'tf1':
+        import tensorflow as tf
+        tf.reset_default_graph()
+    ALGOS[backend](env_fn, ac_kwargs=dict(hidden_sizes=hid), epochs=epochs,
+                   steps_per_epoch=steps_per_epoch,
+                   logger_kwargs=dict(output_dir=output_dir), **kwargs)
+    times = pd.read_table(osp.join(output_dir, 'progress.txt'))['Time'].values
+    return np.diff(times).mean()
+
+def bench(env_fn, backends=tuple(ALGOS), steps_per_epoch=4000, **kwargs):
+    results = {b: epoch_time(b, env_fn, steps_per_epoch=steps_per_epoch, **kwargs)
+               for b in backends}
+    print(colorize('\nTime per epoch (s), and env steps per second:', color='green', bold=True))
+    for backend, t in results.items():
+        print('  %-8s %8.2f %10.0f'%(backend, t, steps_per_epoch/t))
+    return results
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--env', type=str, default='HalfCheetah-v2')
+    parser.add_argument('--backends', type=str, nargs='+', default=list(ALGOS))
+    parser.add_argument('--algo', type=str, default='trpo')
+    parser.add_argument('--epochs', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=4000)
+    parser.add_argument('--hid', type=int, default=64)
+    parser.add_argument('--l', type=int, default=2)
+    args = parser.parse_args()
+
+    bench(lambda : gym.make(args.env), args.backends, epochs=args.epochs,
+          steps_per_epoch=args.steps, hid=[args.hid]*args.l, algo=args.algo)
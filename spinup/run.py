@@ -193,7 +193,7 @@ if __name__ == '__main__':
 
     cmd = sys.argv[1] if len(sys.argv) > 1 else 'help'
     valid_algos = add_with_backends(BASE_ALGO_NAMES)
-    valid_utils = ['plot', 'test_policy']
+    valid_utils = ['plot', 'test_policy', 'export_policy', 'policy_server']
     valid_help = ['--help', '-h', 'help']
     valid_cmds = valid_algos + valid_utils + valid_help
     assert cmd in valid_cmds, \
@@ -0,0 +1,100 @@
+"""
+
+GAE-Lambda advantages and rewards-to-go for all paths of an epoch at once.
+
+The on-policy buffers used to compute advantages and returns in
+``finish_path``, with two ``discount_cumsum`` calls (and a few array
+copies) per trajectory, which adds up with many short episodes. Here the
+buffers only record where each path ends, and at ``get()`` time all paths
+are laid out as the rows of one zero-padded array (each row reversed, as
+``discount_cumsum`` reverses its input) and filtered with a single
+``scipy.signal.lfilter`` call along the rows. Every element goes through
+the same arithmetic as in the per-path computation, so the results are
+identical.
+
+"""
+import numpy as np
+import scipy.signal
+
+
+def _discount_cumsum_rows(rows, discount):
+    """``discount_cumsum`` along each row of a 2D array, with rows reversed."""
+    return scipy.signal.lfilter([1], [1, float(-discount)], rows, axis=1)
+
+
+def _reversed_rows(x, ends, lens, width, first=None):
+    """
+    The paths of ``x`` (ending at ``ends``, of lengths ``lens``) as the rows
+    of a zero-padded array of ``width`` columns, each path reversed. If
+    ``first`` is given, it fills an extra first column (the value after the
+    end of each path).
+
+    Also returns the indices into ``x`` of the path elements, and the mask
+    of the row entries holding them.
+    """
+    cols = np.arange(width)
+    mask = cols < lens[:, None]
+    idxs = (ends[:, None] - 1 - cols)[mask]
+    offset = 0 if first is None else 1
+    rows = np.zeros((len(lens), width + offset), dtype=x.dtype)
+    if first is not None:
+        rows[:, 0] = first
+    rows[:, offset:][mask] = x[idxs]
+    return rows, idxs, mask
+
+
+def gae_and_returns(rews, vals, path_ends, last_vals, gamma, lam):
+    """
+    GAE-Lambda advantages and rewards-to-go for consecutive paths.
+
+    Matches calling ``finish_path(last_val)`` at the end of each path, in a
+    single pass over all of them.
+
+    Args:
+        rews (array): Rewards of all paths, one after the other.
+
+        vals (array): Value estimates for the same timesteps.
+
+        path_ends (list): Index one past the last timestep of each path
+            (the buffer pointer when ``finish_path`` was called).
+
+        last_vals (list): Bootstrap value for each path: 0 if it ended in
+            a terminal state, else V(s_T) for the state it was cut off at.
+
+        gamma (float): Discount factor.
+
+        lam (float): Lambda for GAE-Lambda.
+
+    Returns:
+        ``(adv, ret)``: Arrays of advantages and rewards-to-go, of the type
+        of ``rews``, for the timesteps up to the last path end.
+    """
+    ends = np.asarray(path_ends, dtype=np.int64)
+    lens = np.diff(ends, prepend=0)
+    n = ends[-1]
+    rews, vals = rews[:n], vals[:n]
+
+    # finish_path appended each bootstrap value to its path, which promoted
+    # the path to the (wider) type of that value, e.g. float64 for a Python 0
+    last_vals = [np.asarray(v).reshape(-1) for v in last_vals]
+    types = [np.result_type(rews, v) for v in last_vals]
+    boot = np.array([v.astype(t)[0] for v, t in zip(last_vals, types)], dtype=np.float64)
+    wide = np.repeat([t != rews.dtype for t in types], lens)
+
+    # GAE-Lambda: TD residuals, bootstrapped from the last value of each path
+    next_vals = np.empty_like(vals, dtype=np.float64)
+    next_vals[:-1] = vals[1:]
+    next_vals[ends - 1] = boot
+    deltas = rews + gamma * next_vals.astype(vals.dtype) - vals
+    if wide.any():
+        wide_deltas = rews.astype(np.float64) + gamma * next_vals - vals
+        deltas = np.where(wide, wide_deltas, deltas)
+    rows, idxs, mask = _reversed_rows(deltas, ends, lens, lens.max())
+    adv = np.zeros(n, dtype=rews.dtype)
+    adv[idxs] = _discount_cumsum_rows(rows, gamma * lam)[mask]
+
+    # Rewards-to-go, with the bootstrap value after the end of each path
+    rows, idxs, mask = _reversed_rows(rews.astype(np.float64), ends, lens, lens.max(), first=boot)
+    ret = np.zeros(n, dtype=rews.dtype)
+    ret[idxs] = _discount_cumsum_rows(rows, gamma)[:, 1:][mask]
+    return adv, ret
@@ -0,0 +1,100 @@
+"""
+
+bfloat16 mixed precision on CPU for the PyTorch algorithms.
+
+Under ``autocast``, matmuls (``nn.Linear`` layers) run in bf16, which
+recent CPUs (with AVX512-BF16 or AMX) execute several times faster than
+fp32. Parameters, gradients, optimizer state and target networks all stay
+in fp32: only the forward (and hence backward) computation is cast.
+
+Since bf16 has a short mantissa, ``bf16_probe`` compares a loss in bf16 and
+fp32 on the same batch, so that the algorithms can log how far the two
+drift apart and how much faster bf16 is.
+
+"""
+import contextlib
+import time
+import torch
+from spinup.utils.logx import colorize
+
+
+def bf16_supported():
+    """Whether this PyTorch build and CPU support fast bf16 matmuls."""
+    if not hasattr(torch, 'autocast'):
+        return False
+    checks = [getattr(torch.cpu, name, None) for name in
+              ['_is_avx512_bf16_supported', '_is_amx_tile_supported']]
+    if any(checks):
+        return any(check() for check in checks if check is not None)
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+
+def check_bf16(enabled):
+    """
+    Whether to use bf16 autocast, given that it was requested if ``enabled``:
+    warns (and returns False) if autocast is unavailable, and warns if the
+    CPU lacks native bf16 support.
+    """
+    if not enabled:
+        return False
+    if not hasattr(torch, 'autocast'):
+        print(colorize('bf16 autocast needs PyTorch >= 1.10 (found %s); '
+                       'training in fp32.'%torch.__version__, color='yellow', bold=True))
+        return False
+    if not bf16_supported():
+        print(colorize('This CPU has no native bf16 support; bf16 autocast will '
+                       'likely be slower than fp32.', color='yellow', bold=True))
+    return True
+
+
+def autocast(enabled):
+    """Context manager for bf16 autocast on CPU (a no-op if not ``enabled``)."""
+    if not enabled:
+        return contextlib.nullcontext()
+    return torch.autocast('cpu', dtype=torch.bfloat16)
+
+
+def bf16_probe(loss_fn, data, params, repeats=5):
+    """
+    Evaluate ``loss_fn(data)`` and its gradient with respect to ``params``
+    in fp32 and under bf16 autocast, with the same random numbers.
+
+    Gradients are not accumulated into ``params``, and the global torch
+    random state is left as it was.
+
+    Args:
+        loss_fn (callable): Returns a scalar loss, or a tuple whose first
+            element is the loss.
+
+        data: Argument for ``loss_fn``.
+
+        params (list): Parameters to differentiate the loss with respect to.
+
+        repeats (int): Number of timed evaluations (the fastest counts).
+
+    Returns:
+        ``(dev, speedup)``: the relative deviation of the bf16 loss from the
+        fp32 loss, and the fp32 time over the bf16 time of forward and
+        backward passes.
+    """
+    rng_state = torch.get_rng_state()
+    params = list(params)
+
+    def run(enabled):
+        torch.set_rng_state(rng_state)
+        start = time.perf_counter()
+        with autocast(enabled):
+            out = loss_fn(data)
+        loss = out[0] if isinstance(out, tuple) else out
+        torch.autograd.grad(loss, params, allow_unused=True)
+        return loss.item(), time.perf_counter() - start
+
+    losses, times = {}, {}
+    for enabled in [False, True]:
+        run(enabled)
+        results = [run(enabled) for _ in range(repeats)]
+        losses[enabled] = results[0][0]
+        times[enabled] = min(t for _, t in results)
+    torch.set_rng_state(rng_state)
+    dev = abs(losses[True] - losses[False]) / max(abs(losses[False]), 1e-8)
+    return dev, times[False] / times[True]
@@ -0,0 +1,86 @@
+"""
+
+Opt-in ``torch.compile`` for the update steps of the PyTorch algorithms.
+
+Each update of a Spinning Up algorithm is a handful of small forward and
+backward passes plus an optimizer step, so on CPU it is dominated by
+per-op dispatch overhead. Compiling the loss functions (their forward and
+backward graphs) and the optimizer steps fuses those ops into a few
+kernels.
+
+Compilation happens on the first call, and the compiled graphs are cached
+and reused on every later call. If ``torch.compile`` is unavailable, or
+tracing or compiling a function fails, the function runs eagerly instead.
+Errors raised while running a compiled function are not caught: it may
+have done part of its work (e.g. an optimizer step), so running it again
+eagerly could apply that work twice.
+
+"""
+import torch
+from spinup.utils.logx import colorize
+
+
+def compile_fn(fn, name=None, **compile_kwargs):
+    """
+    Wrap ``fn`` with ``torch.compile``, falling back to running ``fn``
+    eagerly if ``torch.compile`` is unavailable, or if tracing or compiling
+    fails (which happens before the compiled code runs). Other errors are
+    raised as usual.
+
+    Args:
+        fn (callable): Function to compile.
+
+        name (str): Name for messages (defaults to ``fn.__name__``).
+
+        compile_kwargs: Any kwargs for ``torch.compile`` (e.g. ``mode``).
+
+    Returns:
+        A function with the same signature as ``fn``.
+    """
+    name = name or getattr(fn, '__name__', repr(fn))
+    if not hasattr(torch, 'compile'):
+        print(colorize('torch.compile is not available (PyTorch %s); running %s eagerly.'%(
+                       torch.__version__, name), color='yellow'))
+        return fn
+
+    def fall_back(e):
+        print(colorize('Compiling %s failed (%s: %s); running it eagerly.'%(
+                       name, type(e).__name__, str(e).split('\n')[0]), color='yellow'))
+        state['fn'] = fn
+
+    state = dict()
+    try:
+        state['fn'] = torch.compile(fn, **compile_kwargs)
+    except Exception as e:
+        fall_back(e)
+        return fn
+
+    def wrapper(*args, **kwargs):
+        if state['fn'] is fn:
+            return fn(*args, **kwargs)
+        try:
+            return state['fn'](*args, **kwargs)
+        except Exception as e:
+            if not _is_compile_error(e):
+                raise
+            fall_back(e)
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def _is_compile_error(e):
+    """Whether ``e`` was raised by Dynamo or its backend, i.e. while tracing
+    or compiling, rather than by running the compiled code."""
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+    except ImportError:
+        return False
+    return isinstance(e, TorchDynamoException)
+
+
+def compile_optimizer(optimizer, **compile_kwargs):
+    """Compile ``optimizer.step`` in place (see ``compile_fn``)."""
+    optimizer.step = compile_fn(optimizer.step, type(optimizer).__name__ + '.step',
+                                **compile_kwargs)
+    return optimizer
@@ -0,0 +1,252 @@
+"""
+
+Dyna-style model rollouts for the PyTorch off-policy algorithms.
+
+SAC, TD3 and DDPG normally train only on real transitions, so on envs
+where each real step is expensive (e.g. ``liveline-v0``, which steps a
+predictive model) sample efficiency is limited by env interaction. With
+``real_ratio < 1``, a ``DynaModel`` is fit to the replay buffer every
+``train_every`` steps, short imagined rollouts are generated from real
+start states, and each training batch mixes real and imagined transitions
+in that ratio.
+
+This is only implemented for the PyTorch algorithms. The liveline training
+script (``spinup/algos/tf1/ddpg/cc_project_runner.py``) uses the TF1
+``ddpg``, which has no model-based option: to use it there, switch to
+``ddpg_pytorch`` and apply ``env_params`` and ``controller_params`` to the
+env in ``env_fn`` (the TF1 ``ddpg`` does that itself).
+
+"""
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.optim import Adam
+
+
+class EnsembleLinear(nn.Module):
+    """
+    A stack of independent linear layers, evaluated with one batched matmul.
+
+    Inputs have shape (ensemble_size, batch, in_dim) and outputs have shape
+    (ensemble_size, batch, out_dim).
+    """
+
+    def __init__(self, ensemble_size, in_dim, out_dim):
+        super().__init__()
+        bound = 1 / np.sqrt(in_dim)
+        self.weight = nn.Parameter(torch.empty(ensemble_size, in_dim, out_dim).uniform_(-bound, bound))
+        self.bias = nn.Parameter(torch.empty(ensemble_size, 1, out_dim).uniform_(-bound, bound))
+
+    def forward(self, x):
+        return torch.baddbmm(self.bias, x, self.weight)
+
+
+def ensemble_mlp(ensemble_size, sizes, activation, output_activation=nn.Identity):
+    layers = []
+    for j in range(len(sizes)-1):
+        act = activation if j < len(sizes)-2 else output_activation
+        layers += [EnsembleLinear(ensemble_size, sizes[j], sizes[j+1]), act()]
+    return nn.Sequential(*layers)
+
+
+LOG_STD_MAX = 0.5
+LOG_STD_MIN = -10
+
+class EnsembleDynamicsModel(nn.Module):
+    """
+    Ensemble of Gaussian models of the change in observation and the reward.
+
+    Each member maps (obs, act) to the mean and log std of a diagonal
+    Gaussian over [next_obs - obs, rew]. Inputs are normalized with
+    statistics taken from the data the model was last fit on.
+    """
+
+    def __init__(self, obs_dim, act_dim, hidden_sizes=(200,200), activation=nn.ReLU,
+                 ensemble_size=5):
+        super().__init__()
+        self.obs_dim, self.ensemble_size = obs_dim, ensemble_size
+        out_dim = obs_dim + 1
+        self.net = ensemble_mlp(ensemble_size, [obs_dim + act_dim] + list(hidden_sizes) + [2 * out_dim],
+                                activation)
+        self.register_buffer('in_mean', torch.zeros(obs_dim + act_dim))
+        self.register_buffer('in_std', torch.ones(obs_dim + act_dim))
+
+    def set_normalizer(self, inputs):
+        self.in_mean.copy_(inputs.mean(dim=0))
+        self.in_std.copy_(inputs.std(dim=0).clamp(min=1e-6))
+
+    def forward(self, obs, act):
+        # obs, act: (batch, dim), shared by all members, or
+        # (ensemble_size, batch, dim), one batch per member.
+        x = (torch.cat([obs, act], dim=-1) - self.in_mean) / self.in_std
+        if x.dim() == 2:
+            x = x.expand(self.ensemble_size, *x.shape)
+        mean, log_std = self.net(x).chunk(2, dim=-1)
+        log_std = torch.clamp(log_std, LOG_STD_MIN, LOG_STD_MAX)
+        return mean, log_std
+
+
+class ModelReplayBuffer:
+    """
+    A FIFO buffer for imagined transitions, filled a batch at a time.
+    """
+
+    def __init__(self, obs_dim, act_dim, size):
+        self.obs_buf = np.zeros((size, obs_dim), dtype=np.float32)
+        self.obs2_buf = np.zeros((size, obs_dim), dtype=np.float32)
+        self.act_buf = np.zeros((size, act_dim), dtype=np.float32)
+        self.rew_buf = np.zeros(size, dtype=np.float32)
+        self.done_buf = np.zeros(size, dtype=np.float32)
+        self.ptr, self.size, self.max_size = 0, 0, size
+
+    def store_batch(self, obs, act, rew, next_obs, done):
+        n = len(obs)
+        idxs = (self.ptr + np.arange(n)) % self.max_size
+        self.obs_buf[idxs] = obs
+        self.obs2_buf[idxs] = next_obs
+        self.act_buf[idxs] = act
+        self.rew_buf[idxs] = rew
+        self.done_buf[idxs] = done
+        self.ptr = (self.ptr+n) % self.max_size
+        self.size = min(self.size+n, self.max_size)
+
+    def sample_batch(self, batch_size=32):
+        idxs = np.random.randint(0, self.size, size=batch_size)
+        # Gather each field once, into arrays that the tensors then wrap
+        batch = dict(obs=self.obs_buf.take(idxs, axis=0),
+                     obs2=self.obs2_buf.take(idxs, axis=0),
+                     act=self.act_buf.take(idxs, axis=0),
+                     rew=self.rew_buf.take(idxs),
+                     done=self.done_buf.take(idxs))
+        return {k: torch.from_numpy(v) for k,v in batch.items()}
+
+
+class DynaModel:
+    """
+    Dyna-style acceleration layer for the off-policy algorithms.
+
+    Fits an ensemble dynamics and reward model to the real replay buffer,
+    uses it to generate short imagined rollouts from real start states into
+    a separate buffer, and serves training batches that mix real and
+    imagined transitions.
+    """
+
+    def __init__(self, obs_dim, act_dim, hidden_sizes=(200,200), activation=nn.ReLU,
+                 ensemble_size=5, lr=1e-3, train_every=250, train_iters=200,
+                 train_batch_size=256, rollout_batch_size=10000, rollout_horizon=1,
+                 model_buffer_size=int(4e5), termination_fn=None):
+        """
+        Args:
+            obs_dim (int): Observation dimension.
+
+            act_dim (int): Action dimension.
+
+            hidden_sizes, activation, ensemble_size: Model architecture.
+
+            lr (float): Learning rate for the model.
+
+            train_every (int): Number of env interactions between refits
+                of the model (each refit is followed by new rollouts).
+
+            train_iters (int): Gradient steps per refit.
+
+            train_batch_size (int): Minibatch size per member for model
+                training. Each member draws its own minibatch.
+
+            rollout_batch_size (int): Number of real start states per
+                round of imagined rollouts.
+
+            rollout_horizon (int): Length of imagined rollouts. Keep this
+                short: model error compounds with every step.
+
+            model_buffer_size (int): Capacity of the imagined-data buffer.
+
+            termination_fn (callable): Optional function mapping batches of
+                (obs, act, next_obs) as numpy arrays to a boolean array of
+                terminal flags. Without it, imagined transitions are never
+                terminal.
+        """
+        self.model = EnsembleDynamicsModel(obs_dim, act_dim, hidden_sizes, activation, ensemble_size)
+        self.optimizer = Adam(self.model.parameters(), lr=lr)
+        self.model_buffer = ModelReplayBuffer(obs_dim, act_dim, model_buffer_size)
+        self.train_every, self.train_iters = train_every, train_iters
+        self.train_batch_size = train_batch_size
+        self.rollout_batch_size, self.rollout_horizon = rollout_batch_size, rollout_horizon
+        self.termination_fn = termination_fn
+
+    def train(self, replay_buffer):
+        """
+        Fit the model to the real replay buffer. Returns the mean loss over
+        the ``train_iters`` gradient steps.
+        """
+        n = replay_buffer.size
+        obs = torch.as_tensor(replay_buffer.obs_buf[:n])
+        act = torch.as_tensor(replay_buffer.act_buf[:n])
+        self.model.set_normalizer(torch.cat([obs, act], dim=-1))
+        shape = (self.model.ensemble_size, self.train_batch_size)
+        losses = []
+        for _ in range(self.train_iters):
+            idxs = np.random.randint(0, n, size=shape)
+            o = torch.as_tensor(replay_buffer.obs_buf[idxs])
+            a = torch.as_tensor(replay_buffer.act_buf[idxs])
+            o2 = torch.as_tensor(replay_buffer.obs2_buf[idxs])
+            r = torch.as_tensor(replay_buffer.rew_buf[idxs])
+            target = torch.cat([o2 - o, r.unsqueeze(-1)], dim=-1)
+
+            # Gaussian negative log likelihood (up to a constant)
+            mean, log_std = self.model(o, a)
+            loss = (((mean - target) * torch.exp(-log_std))**2 + 2 * log_std).mean()
+
+            self.optimizer.zero_grad()
+            loss.backward()
+            self.optimizer.step()
+            losses.append(loss.detach())
+        return torch.stack(losses).mean().item()
+
+    def generate(self, replay_buffer, policy):
+        """
+        Roll out the model from real start states, storing imagined
+        transitions in the model buffer.
+
+        Args:
+            replay_buffer: The real replay buffer, to draw start states from.
+
+            policy (callable): Maps a batch of observations (torch tensor)
+                to a batch of actions (torch tensor).
+        """
+        idxs = np.random.randint(0, replay_buffer.size, size=self.rollout_batch_size)
+        o = torch.as_tensor(replay_buffer.obs_buf[idxs])
+        with torch.no_grad():
+            for _ in range(self.rollout_horizon):
+                a = policy(o)
+                mean, log_std = self.model(o, a)
+
+                # Each transition is sampled from one randomly chosen member
+                members = torch.randint(0, self.model.ensemble_size, (len(o),))
+                rows = torch.arange(len(o))
+                mean, std = mean[members, rows], torch.exp(log_std[members, rows])
+                pred = mean + torch.randn_like(mean) * std
+                o2, r = o + pred[:, :-1], pred[:, -1]
+
+                if self.termination_fn is None:
+                    d = np.zeros(len(o), dtype=bool)
+                else:
+                    d = np.asarray(self.termination_fn(o.numpy(), a.numpy(), o2.numpy()), dtype=bool)
+                self.model_buffer.store_batch(o.numpy(), a.numpy(), r.numpy(), o2.numpy(), d)
+
+                # Only keep rolling out from non-terminal states
+                o = o2[torch.as_tensor(~d)]
+                if len(o) == 0:
+                    break
+
+    def sample_batch(self, replay_buffer, batch_size, real_ratio):
+        """
+        Sample a batch with a fraction ``real_ratio`` of real transitions and
+        the rest imagined.
+        """
+        num_real = int(round(batch_size * real_ratio))
+        if self.model_buffer.size == 0 or num_real == batch_size:
+            return replay_buffer.sample_batch(batch_size)
+        real = replay_buffer.sample_batch(num_real)
+        fake = self.model_buffer.sample_batch(batch_size - num_real)
+        return {k: torch.cat([real[k], fake[k]]) for k in real}
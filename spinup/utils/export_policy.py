@@ -0,0 +1,202 @@
+"""
+
+Export a saved policy as a frozen, NumPy-only artifact.
+
+Reads a TF1 (``tf1_save``) or PyTorch (``pyt_save``) save written by the
+Spinning Up logger, and writes ``np_save/policyXX.npz`` (the policy weights)
+and ``np_save/policyXX.json`` (the architecture spec) into the same
+experiment directory. The artifact is loaded with
+``spinup.utils.numpy_policy.load_numpy_policy``, which needs nothing but
+NumPy.
+
+Supports the MLP policies of the Spinning Up actor-critics: deterministic
+(DDPG, TD3), squashed Gaussian (SAC), and Gaussian or categorical (VPG,
+PPO, TRPO).
+
+"""
+import os.path as osp
+import tensorflow as tf
+import torch
+import torch.nn as nn
+from spinup.utils.logx import restore_tf_graph
+from spinup.utils.numpy_policy import POLICY_HEADS, activation_name, \
+    load_numpy_policy, max_action_error, save_numpy_policy
+from spinup.utils.test_policy import find_save
+
+
+def _torch_mlp(seq):
+    """Parameters and activation names of a Spinning Up PyTorch ``mlp``."""
+    linears = [m for m in seq if isinstance(m, nn.Linear)]
+    acts = [activation_name(type(m).__name__) for m in seq if not isinstance(m, nn.Linear)]
+    params = []
+    for m in linears:
+        params += [m.weight.detach().numpy().T, m.bias.detach().numpy()]
+    activation = acts[0] if len(acts) > 1 else 'identity'
+    output_activation = acts[-1] if len(acts) > 0 else 'identity'
+    return params, activation, output_activation
+
+
+def extract_pytorch_policy(model):
+    """
+    Returns ``(head, params, kwargs, reference)`` for a PyTorch actor-critic,
+    where ``reference`` maps a batch of observations to the deterministic
+    actions of the original model.
+    """
+    pi = model.pi
+    as_tensor = lambda obs: torch.as_tensor(obs, dtype=torch.float32)
+    if hasattr(pi, 'mu_layer') and hasattr(pi, 'log_std_layer'):
+        params, activation, _ = _torch_mlp(pi.net)
+        mu, _, _ = _torch_mlp([pi.mu_layer])
+        log_std, _, _ = _torch_mlp([pi.log_std_layer])
+        kwargs = dict(act_limit=float(pi.act_limit), activation=activation)
+        return 'squashed_gaussian', params + mu + log_std, kwargs, \
+            lambda obs: model.act(as_tensor(obs), deterministic=True)
+    elif hasattr(pi, 'mu_net'):
+        params, activation, output_activation = _torch_mlp(pi.mu_net)
+        kwargs = dict(activation=activation, output_activation=output_activation)
+        return 'gaussian', params + [pi.log_std.detach().numpy()], kwargs, \
+            lambda obs: pi.mu_net(as_tensor(obs)).detach().numpy()
+    elif hasattr(pi, 'logits_net'):
+        params, activation, output_activation = _torch_mlp(pi.logits_net)
+        kwargs = dict(activation=activation, output_activation=output_activation)
+        return 'categorical', params, kwargs, \
+            lambda obs: pi.logits_net(as_tensor(obs)).argmax(-1).numpy()
+    elif hasattr(pi, 'pi') and hasattr(pi, 'act_limit'):
+        params, activation, output_activation = _torch_mlp(pi.pi)
+        kwargs = dict(act_limit=float(pi.act_limit), activation=activation,
+                      output_activation=output_activation)
+        return 'deterministic', params, kwargs, lambda obs: model.act(as_tensor(obs))
+    raise ValueError('Unrecognized PyTorch policy: %s'%type(pi).__name__)
+
+
+_TF_ACTIVATIONS = dict(Relu='relu', Tanh='tanh', Sigmoid='sigmoid', Elu='elu')
+
+def _tf_dense_layers(sess, scope):
+    """
+    Parameters of the dense layers under ``scope`` (in creation order), and
+    the activation applied to the output of each layer.
+    """
+    graph = sess.graph
+    # (fetch variables, not tensors by name, so resource variables work too)
+    variables = {v.name: v for v in tf.trainable_variables()}
+    names = [n[:-len('/kernel:0')] for n in variables
+             if n.startswith(scope) and n.endswith('/kernel:0')]
+    params, acts, outputs = [], [], []
+    for name in names:
+        params += sess.run([variables[name + '/kernel:0'], variables[name + '/bias:0']])
+        out = graph.get_tensor_by_name(name + '/BiasAdd:0')
+        act = 'identity'
+        for op in out.consumers():
+            if op.type in _TF_ACTIVATIONS:
+                act, out = _TF_ACTIVATIONS[op.type], op.outputs[0]
+        acts.append(act)
+        outputs.append(out)
+    return params, acts, outputs
+
+def _tf_scale(sess, tensor):
+    """Constant factor of a ``const * x`` (or ``x * const``) tensor."""
+    op = tensor.op
+    if op.type == 'Mul':
+        for inp in op.inputs:
+            if inp.op.type == 'Const':
+                return float(sess.run(inp))
+    return 1.0
+
+
+def extract_tf_policy(sess, model):
+    """
+    Returns ``(head, params, kwargs, reference)`` for a TF1 actor-critic
+    restored with ``restore_tf_graph``, where ``reference`` maps a batch of
+    observations to the deterministic actions of the original graph.
+    """
+    variables = {v.name: v for v in tf.trainable_variables()}
+    scope = 'main/pi/' if any(n.startswith('main/pi/') for n in variables) else 'pi/'
+    params, acts, outputs = _tf_dense_layers(sess, scope)
+    x = model['x']
+    run = lambda t: (lambda obs: sess.run(t, feed_dict={x: obs}))
+    if 'mu' in model:
+        kwargs = dict(act_limit=_tf_scale(sess, model['mu']), activation=acts[0])
+        return 'squashed_gaussian', params, kwargs, run(model['mu'])
+    elif 'v' in model and scope + 'log_std:0' in variables:
+        kwargs = dict(activation=acts[0], output_activation=acts[-1])
+        log_std = sess.run(variables[scope + 'log_std:0'])
+        return 'gaussian', params + [log_std], kwargs, run(outputs[-1])
+    elif 'v' in model:
+        kwargs = dict(activation=acts[0], output_activation=acts[-1])
+        return 'categorical', params, kwargs, run(tf.argmax(outputs[-1], axis=-1))
+    else:
+        kwargs = dict(act_limit=_tf_scale(sess, model['pi']), activation=acts[0],
+                      output_activation=acts[-1])
+        return 'deterministic', params, kwargs, run(model['pi'])
+
+
+def extract_policy(fpath, itr='last'):
+    """
+    Read the policy saved in experiment directory ``fpath`` and convert it
+    to the parameters of a NumPy policy.
+
+    Returns:
+        ``(head, params, kwargs, error)``: the arguments for
+        ``POLICY_HEADS[head](params, **kwargs)``, and the largest difference
+        between deterministic actions of that policy and of the original.
+    """
+    backend, itr = find_save(fpath, itr)
+    if backend == 'tf1':
+        with tf.Graph().as_default():
+            sess = tf.Session()
+            model = restore_tf_graph(sess, osp.join(fpath, 'tf1_save'+itr))
+            head, params, kwargs, reference = extract_tf_policy(sess, model)
+            obs_dim = model['x'].shape.as_list()[-1]
+            error = _check(head, params, kwargs, reference, obs_dim)
+            sess.close()
+    else:
+        model = torch.load(osp.join(fpath, 'pyt_save', 'model'+itr+'.pt'))
+        head, params, kwargs, reference = extract_pytorch_policy(model)
+        obs_dim = params[0].shape[0]
+        error = _check(head, params, kwargs, reference, obs_dim)
+    return head, params, kwargs, error
+
+
+def export_policy(fpath, itr='last', tol=1e-4):
+    """
+    Export the policy saved in experiment directory ``fpath`` as a frozen
+    NumPy artifact, and check it against the original.
+
+    Args:
+        fpath (string): Experiment directory.
+
+        itr: Iteration of the save to export, as an int, or 'last'.
+
+        tol (float): Largest acceptable difference between deterministic
+            actions of the artifact and of the original policy.
+
+    Returns:
+        Path of the artifact (without extension).
+    """
+    head, params, kwargs, error = extract_policy(fpath, itr)
+    _, itr = find_save(fpath, itr)
+    assert error <= tol, \
+        "Exported policy disagrees with the original (max error %.3g)."%error
+    fname = osp.join(fpath, 'np_save', 'policy'+itr)
+    save_numpy_policy(fname, head, params, **kwargs)
+    print('Exported %s policy to %s.{npz,json} (max error %.3g).'%(head, fname, error))
+    return fname
+
+
+def _check(head, params, kwargs, reference, obs_dim):
+    policy = POLICY_HEADS[head](params, **kwargs)
+    return max_action_error(policy, reference, obs_dim)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fpath', type=str)
+    parser.add_argument('--itr', '-i', type=int, default=-1)
+    parser.add_argument('--tol', type=float, default=1e-4)
+    args = parser.parse_args()
+    fname = export_policy(args.fpath, args.itr if args.itr >=0 else 'last', args.tol)
+    start = time.time()
+    load_numpy_policy(fname)
+    print('Artifact loads in %.1f ms.'%(1000*(time.time()-start)))
@@ -0,0 +1,88 @@
+"""
+
+Flat, contiguous parameter storage for PyTorch modules.
+
+Spinning Up actor-critics are made of many small tensors, so anything that
+walks over all of their parameters (polyak averaging of target networks,
+MPI parameter sync and gradient averaging) pays one or two tiny ops, or
+one MPI call, per tensor. ``FlatParams`` moves every parameter of a module
+(and its gradient) into one flat buffer and leaves behind views into it,
+so those loops become a single vectorized operation on the buffer.
+
+The module keeps working as before: forward passes, optimizers and
+``torch.save`` (which stores the shared buffer once) all see ordinary
+parameters.
+
+"""
+import torch
+
+
+class FlatParams:
+    """
+    The parameters of a module, and their gradients, stored as views into
+    one flat data buffer (``data``) and one flat gradient buffer (``grad``).
+
+    Constructing a FlatParams attaches it to the module as ``flat_params``.
+    Each direct child of the module (e.g. ``ac.pi``, ``ac.q1``) gets a
+    FlatParams covering its own contiguous slice of the buffers, so that
+    helpers like ``mpi_avg_grads(ac.pi)`` can find it.
+    """
+
+    def __init__(self, module):
+        params = list(module.parameters())
+        self.data = torch.cat([p.data.reshape(-1) for p in params])
+        self.grad = torch.zeros_like(self.data)
+        self.params, self.grads = params, []
+        offset = 0
+        for p in params:
+            n = p.numel()
+            p.data = self.data[offset:offset+n].view_as(p)
+            g = self.grad[offset:offset+n].view_as(p)
+            if p.grad is not None:
+                g.copy_(p.grad)
+            p.grad = g
+            self.grads.append(g)
+            offset += n
+
+        module.flat_params = self
+        own = list(module.parameters(recurse=False))
+        start, first = sum(p.numel() for p in own), len(own)
+        for child in module.children():
+            child_params = list(child.parameters())
+            stop, last = start + sum(p.numel() for p in child_params), first + len(child_params)
+            child.flat_params = self._slice(start, stop, first, last)
+            start, first = stop, last
+
+    def _slice(self, start, stop, first, last):
+        flat = FlatParams.__new__(FlatParams)
+        flat.data, flat.grad = self.data[start:stop], self.grad[start:stop]
+        flat.params, flat.grads = self.params[first:last], self.grads[first:last]
+        return flat
+
+    def flat_grad(self):
+        """
+        The flat gradient buffer, holding the current gradients.
+
+        ``optimizer.zero_grad()`` resets gradients to ``None`` in recent
+        PyTorch versions, after which ``backward`` allocates fresh gradient
+        tensors. Any such gradients are copied back into the buffer (and
+        the views restored), so this is only a pointer check per parameter
+        when the views are intact.
+        """
+        for p, g in zip(self.params, self.grads):
+            if p.grad is not g:
+                if p.grad is None:
+                    g.zero_()
+                else:
+                    g.copy_(p.grad)
+                p.grad = g
+        return self.grad
+
+
+def polyak_update(polyak, flat, flat_targ):
+    """
+    Move target parameters towards main parameters, in one op:
+    ``targ <- polyak * targ + (1 - polyak) * main``.
+    """
+    with torch.no_grad():
+        flat_targ.data.mul_(polyak).add_(flat.data, alpha=1 - polyak)
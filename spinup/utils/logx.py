@@ -43,7 +43,7 @@ def colorize(string, color, bold=False, highlight=False):
     return '\x1b[%sm%s\x1b[0m' % (';'.join(attr), string)
 
 
-def restore_tf_graph(sess, fpath):
+def restore_tf_graph(sess, fpath, seed=None):
     """
     Loads graphs saved by Logger.
 
@@ -53,16 +53,36 @@ def restore_tf_graph(sess, fpath):
     Args:
         sess: A Tensorflow session.
         fpath: Filepath to save directory.
+        seed (int): If given, reseed the random ops of the graph (e.g. the
+            policy's action noise) with it. Otherwise they keep the seeds
+            they were saved with, so every restored copy draws the same
+            random numbers.
 
     Returns:
         A dictionary mapping from keys to tensors in the computation graph
         loaded from ``fpath``. 
     """
-    tf.saved_model.loader.load(
-        sess,
-        [tf.saved_model.tag_constants.SERVING],
-        fpath
-    )
+    if seed is None:
+        tf.saved_model.loader.load(
+            sess,
+            [tf.saved_model.tag_constants.SERVING],
+            fpath
+        )
+    else:
+        # Random ops carry their seeds as attributes, which a graph-level
+        # seed does not change once they are built, so rewrite them in the
+        # saved graph before importing it.
+        with tf.Graph().as_default(), tf.Session() as scratch_sess:
+            meta_graph = tf.saved_model.loader.load(
+                scratch_sess,
+                [tf.saved_model.tag_constants.SERVING],
+                fpath
+            )
+        for node in meta_graph.graph_def.node:
+            if 'seed' in node.attr and 'seed2' in node.attr:
+                node.attr['seed'].i = seed
+        saver = tf.train.import_meta_graph(meta_graph)
+        saver.restore(sess, osp.join(fpath, 'variables', 'variables'))
     model_info = joblib.load(osp.join(fpath, 'model_info.pkl'))
     graph = tf.get_default_graph()
     model = dict()
@@ -186,6 +206,7 @@ class Logger:
         if proc_id() == 0:
             fname = 'vars.pkl' if itr is None else 'vars%d.pkl' % itr
             try:
+                # (uncompressed, so load_env can memory-map large arrays)
                 joblib.dump(state_dict, osp.join(self.output_dir, fname))
             except:
                 self.log('Warning: could not pickle state_dict.', color='red')
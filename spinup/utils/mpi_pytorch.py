@@ -21,6 +21,12 @@ def mpi_avg_grads(module):
     """ Average contents of gradient buffers across MPI processes. """
     if num_procs()==1:
         return
+    flat = getattr(module, 'flat_params', None)
+    if flat is not None:
+        # one allreduce over the flat gradient buffer (see flat_pytorch.py)
+        grad = flat.flat_grad()
+        grad.numpy()[:] = mpi_avg(grad.numpy())
+        return
     for p in module.parameters():
         p_grad_numpy = p.grad.numpy()   # numpy view of tensor data
         avg_p_grad = mpi_avg(p.grad)
@@ -30,6 +36,10 @@ def sync_params(module):
     """ Sync all parameters of module across all MPI processes. """
     if num_procs()==1:
         return
+    flat = getattr(module, 'flat_params', None)
+    if flat is not None:
+        broadcast(flat.data.numpy())
+        return
     for p in module.parameters():
         p_numpy = p.data.numpy()
         broadcast(p_numpy)
\ No newline at end of file
@@ -25,6 +25,19 @@ def sync_all_params():
     """Sync all tf variables across MPI processes."""
     return sync_params(tf.global_variables())
 
+def mpi_avg_tensor(x):
+    """Average a float32 tensor across MPI processes, inside the graph."""
+    comm = MPI.COMM_WORLD
+    if comm.Get_size() == 1:
+        return x
+    def _avg(x):
+        buf = np.zeros_like(x)
+        comm.Allreduce(x, buf, op=MPI.SUM)
+        return buf / np.float32(comm.Get_size())
+    avg = tf.py_func(_avg, [x], tf.float32)
+    avg.set_shape(x.shape)
+    return avg
+
 
 class MpiAdamOptimizer(tf.train.AdamOptimizer):
     """
@@ -0,0 +1,292 @@
+"""
+
+NumPy-only policy evaluation and loading.
+
+Running a small MLP policy on a single observation through a TF session (or
+through PyTorch) costs far more in framework dispatch than in arithmetic.
+The policies here hold a copy of the weights as NumPy arrays and evaluate
+them with matmuls into preallocated buffers, so acting costs a few
+microseconds. The same policies load the frozen policy artifacts written by
+``spinup/utils/export_policy.py`` in milliseconds. This module deliberately
+imports nothing but NumPy (and the standard library).
+
+"""
+import inspect
+import json
+import numpy as np
+import os
+import os.path as osp
+
+
+def _identity(x, out):
+    return x
+
+def _relu(x, out):
+    return np.maximum(x, 0, out=out)
+
+def _tanh(x, out):
+    return np.tanh(x, out=out)
+
+def _sigmoid(x, out):
+    np.negative(x, out=out)
+    np.exp(out, out=out)
+    out += 1
+    return np.reciprocal(out, out=out)
+
+def _elu(x, out):
+    neg = np.expm1(np.minimum(x, 0))
+    np.maximum(x, 0, out=out)
+    out += neg
+    return out
+
+ACTIVATIONS = dict(identity=_identity, relu=_relu, tanh=_tanh, sigmoid=_sigmoid, elu=_elu)
+
+
+def activation_name(fn):
+    """
+    Name of an activation function, as used in ACTIVATIONS.
+
+    Accepts TF functions (e.g. ``tf.nn.relu``), PyTorch module classes (e.g.
+    ``nn.ReLU``) or names, and maps None to ``'identity'``.
+    """
+    if fn is None:
+        return 'identity'
+    name = fn if isinstance(fn, str) else getattr(fn, '__name__', repr(fn))
+    return name.lower()
+
+
+def kwarg_or_default(fn, kwargs, name):
+    """
+    Value that keyword ``name`` takes in the call ``fn(**kwargs)``, or None
+    if ``fn`` has no such argument.
+    """
+    if name in kwargs:
+        return kwargs[name]
+    param = inspect.signature(fn).parameters.get(name)
+    return None if param is None else param.default
+
+
+class NumpyMLP:
+    """
+    Multi-layer perceptron evaluated on one observation at a time.
+
+    Each call writes into the same preallocated buffers, so the returned
+    array is overwritten by the next call: copy it if you need to keep it.
+    """
+
+    def __init__(self, params, activation='relu', output_activation='identity'):
+        """
+        Args:
+            params (list): Alternating kernels of shape (in, out) and biases
+                of shape (out,), one pair per layer.
+
+            activation: Hidden activation (see ``activation_name``).
+
+            output_activation: Activation of the last layer.
+        """
+        self.kernels = [np.array(w, dtype=np.float32) for w in params[0::2]]
+        self.biases = [np.array(b, dtype=np.float32) for b in params[1::2]]
+        act, out_act = activation_name(activation), activation_name(output_activation)
+        if act not in ACTIVATIONS or out_act not in ACTIVATIONS:
+            raise ValueError('Unsupported activation: %s / %s'%(act, out_act))
+        self.acts = [ACTIVATIONS[act]] * (len(self.kernels)-1) + [ACTIVATIONS[out_act]]
+        self.bufs = [np.empty(w.shape[1], dtype=np.float32) for w in self.kernels]
+        self.in_buf = np.empty(self.kernels[0].shape[0], dtype=np.float32)
+
+    @property
+    def out_dim(self):
+        return self.kernels[-1].shape[1]
+
+    def set_params(self, params):
+        """Copy new weights into the existing arrays."""
+        for w, b, new_w, new_b in zip(self.kernels, self.biases, params[0::2], params[1::2]):
+            np.copyto(w, new_w)
+            np.copyto(b, new_b)
+
+    def __call__(self, x):
+        np.copyto(self.in_buf, x, casting='unsafe')
+        h = self.in_buf
+        for w, b, act, buf in zip(self.kernels, self.biases, self.acts, self.bufs):
+            np.dot(h, w, out=buf)
+            buf += b
+            h = act(buf, buf)
+        return h
+
+
+class DeterministicNumpyPolicy:
+    """
+    Policy of the form ``act_limit * mlp(obs)`` (DDPG, TD3).
+    """
+
+    def __init__(self, params, act_limit, activation='relu', output_activation='tanh'):
+        self.net = NumpyMLP(params, activation, output_activation)
+        self.act_limit = np.float32(act_limit)
+
+    def set_params(self, params):
+        self.net.set_params(params)
+
+    def act(self, o, deterministic=True):
+        return self.act_limit * self.net(o)
+
+
+class SquashedGaussianNumpyPolicy:
+    """
+    Tanh-squashed Gaussian policy (SAC): an MLP body with the hidden
+    activation on every layer, followed by linear mean and log std layers.
+    """
+
+    def __init__(self, params, act_limit, activation='relu', log_std_min=-20, log_std_max=2):
+        """
+        Args:
+            params (list): Kernel/bias pairs for the body layers, then for
+                the mean layer, then for the log std layer.
+        """
+        self.body = NumpyMLP(params[:-4], activation, activation)
+        self.mu_layer = NumpyMLP(params[-4:-2], 'identity', 'identity')
+        self.log_std_layer = NumpyMLP(params[-2:], 'identity', 'identity')
+        self.act_limit = np.float32(act_limit)
+        self.log_std_min, self.log_std_max = log_std_min, log_std_max
+        self.std_buf = np.empty(self.mu_layer.out_dim, dtype=np.float32)
+
+    def set_params(self, params):
+        self.body.set_params(params[:-4])
+        self.mu_layer.set_params(params[-4:-2])
+        self.log_std_layer.set_params(params[-2:])
+
+    def act(self, o, deterministic=False):
+        h = self.body(o)
+        a = self.mu_layer(h)
+        if not deterministic:
+            std = self.std_buf
+            np.clip(self.log_std_layer(h), self.log_std_min, self.log_std_max, out=std)
+            np.exp(std, out=std)
+            std *= np.random.randn(len(std))
+            a += std
+        return self.act_limit * np.tanh(a)
+
+
+class GaussianNumpyPolicy:
+    """
+    Diagonal Gaussian policy with state-independent log std (VPG, PPO, TRPO).
+    """
+
+    def __init__(self, params, activation='tanh', output_activation='identity'):
+        """
+        Args:
+            params (list): Kernel/bias pairs for the mean MLP, then the
+                log std vector.
+        """
+        self.net = NumpyMLP(params[:-1], activation, output_activation)
+        self.std = np.exp(np.array(params[-1], dtype=np.float32))
+
+    def set_params(self, params):
+        self.net.set_params(params[:-1])
+        np.exp(params[-1], out=self.std)
+
+    def act(self, o, deterministic=False):
+        mu = self.net(o)
+        if deterministic:
+            return mu.copy()
+        return mu + self.std * np.random.randn(len(mu))
+
+
+class CategoricalNumpyPolicy:
+    """
+    Categorical policy over the outputs of a logits MLP (VPG, PPO, TRPO).
+    """
+
+    def __init__(self, params, activation='tanh', output_activation='identity'):
+        self.net = NumpyMLP(params, activation, output_activation)
+        self.probs = np.empty(self.net.out_dim, dtype=np.float64)
+
+    def set_params(self, params):
+        self.net.set_params(params)
+
+    def act(self, o, deterministic=False):
+        logits = self.net(o)
+        if deterministic:
+            return np.argmax(logits)
+        p = self.probs
+        np.subtract(logits, logits.max(), out=p)
+        np.exp(p, out=p)
+        np.cumsum(p, out=p)
+        return min(np.searchsorted(p, np.random.rand() * p[-1], side='right'), len(p)-1)
+
+
+POLICY_HEADS = dict(deterministic=DeterministicNumpyPolicy,
+                    squashed_gaussian=SquashedGaussianNumpyPolicy,
+                    gaussian=GaussianNumpyPolicy,
+                    categorical=CategoricalNumpyPolicy)
+
+
+def save_numpy_policy(fname, head, params, **kwargs):
+    """
+    Write a frozen policy: ``fname.npz`` with the parameter arrays, and
+    ``fname.json`` with the spec needed to rebuild the policy.
+
+    Args:
+        fname (string): Path of the artifact, without extension.
+
+        head (string): One of the keys of POLICY_HEADS.
+
+        params (list): Parameter arrays, in the order the head expects.
+
+        kwargs: Constructor kwargs for the head (activations, act_limit...).
+    """
+    assert head in POLICY_HEADS, 'Unknown policy head %s'%head
+    os.makedirs(osp.dirname(fname) or '.', exist_ok=True)
+    np.savez(fname + '.npz', *[np.asarray(p, dtype=np.float32) for p in params])
+    spec = dict(head=head, num_params=len(params), kwargs=kwargs)
+    with open(fname + '.json', 'w') as f:
+        json.dump(spec, f, indent=4, sort_keys=True)
+
+
+def load_numpy_policy(fpath, itr='last'):
+    """
+    Load a frozen policy written by ``spinup/utils/export_policy.py``.
+
+    Args:
+        fpath (string): Experiment directory (containing ``np_save``), the
+            ``np_save`` directory itself, or the path of one artifact
+            without extension.
+
+        itr: Iteration of the artifact, as an int, or 'last'.
+
+    Returns:
+        The NumPy policy. Call ``policy.act(obs, deterministic)`` to act.
+    """
+    if osp.isdir(osp.join(fpath, 'np_save')):
+        fpath = osp.join(fpath, 'np_save')
+    if osp.isdir(fpath):
+        if itr == 'last':
+            saves = [int(x[6:-5]) for x in os.listdir(fpath) 
+                     if x.startswith('policy') and x.endswith('.json') and len(x) > 11]
+            itr = '%d'%max(saves) if len(saves) > 0 else ''
+        else:
+            itr = '%d'%itr
+        fpath = osp.join(fpath, 'policy' + itr)
+    with open(fpath + '.json') as f:
+        spec = json.load(f)
+    with np.load(fpath + '.npz') as data:
+        params = [data['arr_%d'%i] for i in range(spec['num_params'])]
+    return POLICY_HEADS[spec['head']](params, **spec['kwargs'])
+
+
+def max_action_error(np_policy, graph_act, obs_dim, num_obs=32, obs_scale=1.0):
+    """
+    Largest absolute difference between a NumPy policy's deterministic
+    actions and a reference implementation, on random observations.
+
+    Args:
+        np_policy: A NumPy policy with an ``act`` method.
+
+        graph_act (callable): Maps a batch of observations to the batch of
+            deterministic actions computed by the reference (e.g. a TF
+            session run of the policy mean).
+
+        obs_dim (int): Observation dimension.
+    """
+    obs = obs_scale * np.random.RandomState(0).randn(num_obs, obs_dim).astype(np.float32)
+    ref = np.asarray(graph_act(obs))
+    ours = np.stack([np_policy.act(o, deterministic=True) for o in obs])
+    return float(np.max(np.abs(ours - ref)))
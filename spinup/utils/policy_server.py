@@ -0,0 +1,293 @@
+"""
+
+Local policy server with request micro-batching.
+
+Loads a saved policy once and serves actions over a Unix domain socket (or
+a local TCP port, where Unix sockets are unavailable). Single-observation
+requests that arrive from different clients within a short window are
+coalesced into one batched forward pass.
+
+Start a server with
+
+    python -m spinup.run policy_server path/to/output_directory --socket /tmp/policy.sock
+
+and query it from any process with
+
+>>> from spinup.utils.policy_server import PolicyClient
+>>> client = PolicyClient('/tmp/policy.sock')
+>>> a = client.act(o)
+
+Wire format: every message is a 4-byte little-endian payload length, a
+1-byte type code, then the payload. Requests carry a float32 observation
+(or, with length 0, ask for statistics). Replies carry the action as
+float32 ('f') or int64 ('i'), statistics as JSON ('j'), or an error
+message ('e') for a request that could not be served.
+
+"""
+from collections import Counter, deque
+import json
+import numpy as np
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from spinup.utils.logx import colorize
+
+_HEADER = struct.Struct('<IB')
+_DTYPES = {ord('f'): np.float32, ord('i'): np.int64}
+
+
+def _recv_exactly(conn, n):
+    buf = bytearray(n)
+    view, pos = memoryview(buf), 0
+    while pos < n:
+        k = conn.recv_into(view[pos:], n - pos)
+        if k == 0:
+            raise ConnectionError('Connection closed.')
+        pos += k
+    return bytes(buf)
+
+def _recv_message(conn):
+    length, code = _HEADER.unpack(_recv_exactly(conn, _HEADER.size))
+    return code, _recv_exactly(conn, length) if length else b''
+
+def _send_message(conn, code, payload):
+    conn.sendall(_HEADER.pack(len(payload), code) + payload)
+
+def _send_error(conn, msg):
+    try:
+        _send_message(conn, ord('e'), msg.encode())
+    except OSError:
+        pass
+
+def _make_socket(address):
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class PolicyServer:
+    """
+    Serves actions from a batched policy function to many clients.
+
+    One thread per client reads requests and puts them on a shared queue.
+    A single batching thread takes the first waiting request, keeps
+    collecting requests until ``max_batch_size`` is reached or ``max_delay``
+    seconds have passed since that first request, runs one forward pass on
+    the stacked observations, and sends each client its action.
+    """
+
+    def __init__(self, get_actions, address, max_batch_size=64, max_delay=1e-3,
+                 history=100000, report_every=0, obs_dim=None):
+        """
+        Args:
+            get_actions (callable): Maps a batch of observations, shape
+                (N, obs_dim), to a batch of actions (e.g. from
+                ``load_policy(..., batched=True)``).
+
+            address: Path of the Unix socket to listen on, or a
+                ``(host, port)`` tuple for TCP.
+
+            max_batch_size (int): Largest number of requests per forward pass.
+
+            max_delay (float): Longest time (in seconds) the first request of
+                a batch waits for others to join it.
+
+            history (int): Number of recent requests kept for the latency
+                statistics.
+
+            report_every (float): If positive, print the statistics every
+                ``report_every`` seconds while serving.
+
+            obs_dim (int): Number of floats in an observation. Requests of
+                any other size are answered with an error instead of being
+                batched. If None, it is taken from the first request.
+        """
+        self.get_actions = get_actions
+        self.address = address
+        self.max_batch_size, self.max_delay = max_batch_size, max_delay
+        self._requests = queue.Queue()
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = Counter()
+        self._num_requests = 0
+        self._stats_lock = threading.Lock()
+        self._running = False
+        self.report_every = report_every
+        self._last_report = time.time()
+        self.obs_dim = obs_dim
+
+    def serve_forever(self):
+        """Listen for clients until interrupted (Ctrl-C) or ``stop`` is called."""
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self._sock = _make_socket(self.address)
+        self._sock.bind(self.address)
+        self._sock.listen()
+        self._running = True
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        print(colorize('Serving policy on %s.'%(self.address,), color='green', bold=True))
+        try:
+            while self._running:
+                try:
+                    conn, _ = self._sock.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._client_loop, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            print(self.report())
+
+    def stop(self):
+        self._running = False
+        self._sock.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _client_loop(self, conn):
+        with conn:
+            while True:
+                try:
+                    code, payload = _recv_message(conn)
+                except (ConnectionError, OSError):
+                    return
+                if len(payload) == 0:
+                    _send_message(conn, ord('j'), json.dumps(self.stats()).encode())
+                else:
+                    obs = np.frombuffer(payload, dtype=np.float32)
+                    if self.obs_dim is None:
+                        self.obs_dim = len(obs)
+                    if len(obs) != self.obs_dim:
+                        _send_error(conn, 'Expected an observation of %d floats, got %d.'
+                                    %(self.obs_dim, len(obs)))
+                    else:
+                        self._requests.put((time.perf_counter(), obs, conn))
+
+    def _batch_loop(self):
+        while self._running:
+            first = self._requests.get()
+            batch = [first]
+            deadline = first[0] + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    batch.append(self._requests.get(timeout=timeout) if timeout > 0
+                                 else self._requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                acts = np.asarray(self.get_actions(np.stack([obs for _, obs, _ in batch])))
+                code = ord('i') if np.issubdtype(acts.dtype, np.integer) else ord('f')
+                replies = [(code, a.tobytes()) for a in acts.astype(_DTYPES[code])]
+            except Exception as e:
+                # Fail only the requests of this batch, and keep serving
+                msg = 'Policy failed on a batch of %d: %r'%(len(batch), e)
+                print(colorize(msg, color='red'))
+                replies = [(ord('e'), msg.encode())] * len(batch)
+            for (start, _, conn), (code, payload) in zip(batch, replies):
+                try:
+                    _send_message(conn, code, payload)
+                except OSError:
+                    pass
+
+            done = time.perf_counter()
+            with self._stats_lock:
+                self._latencies.extend(done - start for start, _, _ in batch)
+                self._batch_sizes[len(batch)] += 1
+                self._num_requests += len(batch)
+            if self.report_every > 0 and time.time() - self._last_report > self.report_every:
+                self._last_report = time.time()
+                print(self.report())
+
+    def stats(self):
+        """
+        Request latency percentiles (in ms, over recent requests) and the
+        histogram of batch sizes (over all requests).
+        """
+        with self._stats_lock:
+            lat = 1000 * np.array(self._latencies)
+            hist = dict(sorted(self._batch_sizes.items()))
+            n = self._num_requests
+        stats = dict(NumRequests=n, NumBatches=sum(hist.values()),
+                     BatchSizeHist={str(k): v for k, v in hist.items()})
+        if len(lat) > 0:
+            for p in [50, 90, 99]:
+                stats['LatencyP%d'%p] = float(np.percentile(lat, p))
+            stats['LatencyMax'] = float(lat.max())
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        lines = ['Requests: %d in %d batches'%(stats['NumRequests'], stats['NumBatches'])]
+        if 'LatencyP50' in stats:
+            lines.append('Latency (ms): p50 %.3f, p90 %.3f, p99 %.3f, max %.3f'%tuple(
+                stats[k] for k in ['LatencyP50', 'LatencyP90', 'LatencyP99', 'LatencyMax']))
+        lines.append('Batch sizes:')
+        for size, count in stats['BatchSizeHist'].items():
+            lines.append('  %4s: %d'%(size, count))
+        return '\n'.join(lines)
+
+
+class PolicyClient:
+    """
+    Client for a PolicyServer. ``client.act`` can be used anywhere a
+    ``get_action`` function is expected (e.g. ``run_policy``).
+    """
+
+    def __init__(self, address):
+        self.sock = _make_socket(address)
+        self.sock.connect(address)
+
+    def act(self, o):
+        _send_message(self.sock, ord('f'), np.asarray(o, dtype=np.float32).tobytes())
+        code, payload = _recv_message(self.sock)
+        if code == ord('e'):
+            raise RuntimeError('Policy server: ' + payload.decode())
+        return np.frombuffer(payload, dtype=_DTYPES[code]).copy()
+
+    def stats(self):
+        _send_message(self.sock, ord('f'), b'')
+        _, payload = _recv_message(self.sock)
+        return json.loads(payload.decode())
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    from spinup.utils.test_policy import load_env, load_policy
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fpath', type=str)
+    parser.add_argument('--socket', type=str, default='/tmp/spinup_policy.sock')
+    parser.add_argument('--port', type=int, default=0,
+                        help='Serve on this localhost TCP port instead of a Unix socket.')
+    parser.add_argument('--itr', '-i', type=int, default=-1)
+    parser.add_argument('--deterministic', '-d', action='store_true')
+    parser.add_argument('--frozen', '-f', action='store_true')
+    parser.add_argument('--quantize', '-q', action='store_true')
+    parser.add_argument('--max_batch_size', type=int, default=64)
+    parser.add_argument('--max_delay', type=float, default=1e-3)
+    parser.add_argument('--report_every', type=float, default=60)
+    args = parser.parse_args()
+
+    get_actions = load_policy(args.fpath, args.itr if args.itr >=0 else 'last',
+                              args.deterministic, args.frozen, batched=True,
+                              quantize=args.quantize)
+    env = load_env(args.fpath, args.itr if args.itr >=0 else 'last')
+    obs_dim = int(np.prod(env.observation_space.shape)) if env is not None else None
+    address = ('127.0.0.1', args.port) if args.port else args.socket
+    PolicyServer(get_actions, address, args.max_batch_size, args.max_delay,
+                 report_every=args.report_every, obs_dim=obs_dim).serve_forever()
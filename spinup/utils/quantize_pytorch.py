@@ -0,0 +1,148 @@
+"""
+
+Int8 dynamic quantization of saved PyTorch policies.
+
+Only ``act`` is needed to deploy a trained actor-critic, and its cost is
+dominated by the linear layers of the policy MLP. Dynamic quantization
+stores those weights as int8 and quantizes activations on the fly, which
+cuts the cost of each matmul on CPU. The value functions are left alone.
+
+Since quantization changes the actions slightly, ``quantize_policy`` checks
+the quantized policy against the fp32 one on a set of observations
+(preferably ones recorded with ``test_policy --record``) and keeps the fp32
+model if the error is too large.
+
+"""
+import copy
+import numpy as np
+import time
+import torch
+import torch.nn as nn
+from spinup.utils.logx import colorize
+from spinup.utils.trajectory_recorder import load_trajectories
+
+quantize_dynamic = torch.ao.quantization.quantize_dynamic if hasattr(torch, 'ao') \
+    else torch.quantization.quantize_dynamic
+
+
+class QuantizedLinear(nn.Module):
+    """
+    Wraps a dynamically quantized linear layer so that, like ``nn.Linear``,
+    it also accepts a single (1-D) input.
+    """
+
+    def __init__(self, linear):
+        super().__init__()
+        self.linear = linear
+        self.in_features, self.out_features = linear.in_features, linear.out_features
+
+    def forward(self, x):
+        if x.dim() == 1:
+            return self.linear(x.unsqueeze(0))[0]
+        return self.linear(x)
+
+
+def _quantize(module):
+    """Int8 dynamic quantization of the linear layers of ``module``, in place."""
+    module = quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    for parent in list(module.modules()):
+        for name, child in parent.named_children():
+            if not isinstance(child, (nn.Linear, QuantizedLinear)) and \
+                    hasattr(child, 'in_features') and callable(getattr(child, 'weight', None)):
+                setattr(parent, name, QuantizedLinear(child))
+    return module
+
+
+def deterministic_action(model, obs):
+    """
+    Deterministic actions of a Spinning Up actor-critic on a batch of
+    observations: the policy mean (or most likely action, for categorical
+    policies).
+    """
+    pi = model.pi
+    with torch.no_grad():
+        obs = torch.as_tensor(obs, dtype=torch.float32)
+        if hasattr(pi, 'mu_layer'):
+            return model.act(obs, deterministic=True)
+        elif hasattr(pi, 'mu_net'):
+            return pi.mu_net(obs).numpy()
+        elif hasattr(pi, 'logits_net'):
+            return pi.logits_net(obs).argmax(-1).numpy()
+        return model.act(obs)
+
+
+def validation_observations(fpath, model, num_obs=1000):
+    """
+    Up to ``num_obs`` observations recorded under ``fpath`` by a
+    TrajectoryRecorder, or standard normal observations (sized for the
+    policy of ``model``) if there are none.
+    """
+    obs = []
+    for chunk in load_trajectories(fpath, keys=['obs']):
+        obs.append(chunk['obs'].reshape(len(chunk['obs']), -1))
+        if sum(len(o) for o in obs) >= num_obs:
+            break
+    if len(obs) > 0:
+        return np.concatenate(obs)[:num_obs].astype(np.float32)
+    print(colorize('No recorded observations found in %s; validating quantized '
+                   'policy on random observations.'%fpath, color='yellow'))
+    obs_dim = next(m for m in model.pi.modules() if isinstance(m, nn.Linear)).in_features
+    return np.random.RandomState(0).randn(num_obs, obs_dim).astype(np.float32)
+
+
+def _act_latency(model, obs, num_obs=200):
+    """Mean time (in seconds) of ``act`` on single observations."""
+    obs = torch.as_tensor(obs[:num_obs], dtype=torch.float32)
+    with torch.no_grad():
+        for o in obs[:10]:
+            model.act(o)
+        start = time.perf_counter()
+        for o in obs:
+            model.act(o)
+    return (time.perf_counter() - start) / len(obs)
+
+
+def quantize_policy(model, obs, tol=0.05, require_speedup=True):
+    """
+    Apply int8 dynamic quantization to the linear layers of ``model.pi``.
+
+    Args:
+        model: A Spinning Up PyTorch actor-critic (as saved in ``pyt_save``).
+
+        obs (array): Observations, shape (N, obs_dim), to validate on.
+
+        tol (float): Largest acceptable absolute difference between
+            deterministic actions of the quantized and fp32 policies.
+            For categorical policies, tol bounds the fraction of
+            observations on which the two policies pick different actions.
+
+        require_speedup (bool): Also keep the fp32 model if the quantized
+            policy turns out no faster (as for very small networks, where
+            the quantization overhead dominates).
+
+    Returns:
+        The quantized model, or ``model`` itself if validation fails. The
+        input model is never modified.
+    """
+    qmodel = copy.deepcopy(model)
+    qmodel.pi = _quantize(qmodel.pi)
+
+    ref, ours = deterministic_action(model, obs), deterministic_action(qmodel, obs)
+    if np.issubdtype(np.asarray(ref).dtype, np.integer):
+        error = float(np.mean(ours != ref))
+    else:
+        error = float(np.max(np.abs(ours - ref)))
+    fp32_time, int8_time = _act_latency(model, obs), _act_latency(qmodel, obs)
+    print('Int8 policy: max action error %.3g on %d observations; '
+          'act latency %.1f us (fp32 %.1f us, %.2fx).'%(
+          error, len(obs), 1e6*int8_time, 1e6*fp32_time, fp32_time/int8_time))
+
+    if error > tol:
+        print(colorize('Int8 action error exceeds tolerance %.3g, '
+                       'using fp32 policy.'%tol, color='yellow', bold=True))
+        return model
+    if require_speedup and int8_time >= fp32_time:
+        print(colorize('Int8 policy is not faster, using fp32 policy.', 
+                       color='yellow', bold=True))
+        return model
+    return qmodel
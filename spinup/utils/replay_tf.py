@@ -0,0 +1,120 @@
+"""
+
+In-graph replay buffer and update loops for TF1 off-policy algorithms.
+
+With a NumPy replay buffer, every gradient step costs a NumPy sample, a
+``feed_dict`` copy into the graph, and two or three ``sess.run`` dispatches.
+For small networks that overhead dominates the update. Here the replay
+buffer lives in (non-saved) TF variables: transitions are collected in
+Python and appended in bulk, and a whole burst of sample-and-update steps
+runs as a ``tf.while_loop`` inside a single ``sess.run``.
+
+"""
+import numpy as np
+import tensorflow as tf
+
+
+class GraphReplayBuffer:
+    """
+    A FIFO experience replay buffer whose contents live in TF variables.
+
+    ``store`` only queues transitions in Python. ``feed_dict`` returns the
+    feeds that append all queued transitions (via ``append_op``) in one go;
+    ops built on ``sample_batch`` run after the append when evaluated in
+    the same ``sess.run``.
+
+    The buffer variables are local variables, so they are not written to
+    ``tf1_save``. Run ``initializer`` (or ``tf.local_variables_initializer()``)
+    before use.
+    """
+
+    def __init__(self, obs_dim, act_dim, size, scope='replay'):
+        self.max_size = size
+        self.ptr, self.size = 0, 0
+        self.pending = []
+        shapes = dict(obs1=[obs_dim], obs2=[obs_dim], acts=[act_dim], rews=[], done=[])
+        with tf.variable_scope(scope):
+            self.bufs = {k: tf.get_variable(k, [size] + s, tf.float32, tf.zeros_initializer(),
+                                            trainable=False,
+                                            collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                         for k, s in shapes.items()}
+            self.phs = {k: tf.placeholder(tf.float32, [None] + s, name=k+'_ph')
+                        for k, s in shapes.items()}
+            self.idxs_ph = tf.placeholder(tf.int32, [None], name='idxs_ph')
+            self.size_ph = tf.placeholder(tf.int32, [], name='size_ph')
+            self.append_op = tf.group([tf.scatter_update(self.bufs[k], self.idxs_ph, self.phs[k])
+                                       for k in shapes])
+            # buffer size, available only once the append has run
+            with tf.control_dependencies([self.append_op]):
+                self.size_t = tf.identity(self.size_ph)
+        self.initializer = tf.variables_initializer(list(self.bufs.values()))
+
+    def store(self, obs, act, rew, next_obs, done):
+        self.pending.append((obs, next_obs, act, rew, done))
+
+    def feed_dict(self):
+        """
+        Feeds for ``append_op`` with all transitions stored since the last
+        call. Include them in the ``sess.run`` that samples from the buffer.
+        """
+        pending = self.pending[-self.max_size:]
+        self.pending = []
+        n = len(pending)
+        idxs = (self.ptr + np.arange(n)) % self.max_size
+        self.ptr = (self.ptr + n) % self.max_size
+        self.size = min(self.size + n, self.max_size)
+        feeds = {self.idxs_ph: idxs, self.size_ph: self.size}
+        for k, col in zip(['obs1', 'obs2', 'acts', 'rews', 'done'], zip(*pending)):
+            feeds[self.phs[k]] = np.array(col, dtype=np.float32)
+        if n == 0:
+            feeds.update({ph: np.zeros([0] + ph.shape.as_list()[1:], dtype=np.float32)
+                          for ph in self.phs.values()})
+        return feeds
+
+    def sample_batch(self, batch_size):
+        """Tensors for a uniformly sampled minibatch of stored transitions."""
+        idxs = tf.random_uniform([batch_size], 0, self.size_t, dtype=tf.int32)
+        return {k: tf.gather(buf, idxs) for k, buf in self.bufs.items()}
+
+
+def update_loop(num_steps, step_fn, out_dtypes):
+    """
+    Run ``step_fn`` ``num_steps`` times in a ``tf.while_loop``, one step
+    after the other.
+
+    Args:
+        num_steps (int): Number of iterations.
+
+        step_fn (callable): Takes the iteration index ``j`` (a scalar
+            tensor) and builds one step, returning ``(outs, update_op)``:
+            a list of tensors to record (with dtypes ``out_dtypes``) and
+            an op to run every iteration (e.g. the train ops). Variables
+            must already exist: build the usual train ops (e.g. with
+            ``optimizer.minimize``) before calling this, so that optimizer
+            slots are not created inside the loop.
+
+        out_dtypes (list): Dtypes of the tensors returned by ``step_fn``.
+
+    Returns:
+        A list with one tensor per output of ``step_fn``, stacking its
+        values over the iterations (along a new first axis).
+    """
+    def cond(j, *arrays):
+        return j < num_steps
+
+    def body(j, *arrays):
+        outs, update_op = step_fn(j)
+        with tf.control_dependencies([update_op]):
+            arrays = [arr.write(j, out) for arr, out in zip(arrays, outs)]
+            return [j + 1] + arrays
+
+    arrays = [tf.TensorArray(dtype, size=num_steps) for dtype in out_dtypes]
+    results = tf.while_loop(cond, body, [tf.constant(0)] + arrays,
+                            parallel_iterations=1, back_prop=False)
+    return [arr.stack() for arr in results[1:]]
+
+
+def polyak_update(polyak, main_vars, targ_vars):
+    """Op moving target variables towards main variables."""
+    return tf.group([tf.assign(v_targ, polyak*v_targ + (1-polyak)*v_main)
+                     for v_main, v_targ in zip(main_vars, targ_vars)])
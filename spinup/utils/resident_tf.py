@@ -0,0 +1,61 @@
+"""
+
+Keep an epoch of on-policy data resident in the graph for TF1 updates.
+
+The TF1 on-policy algorithms feed the whole epoch's data through
+``feed_dict`` on every training ``sess.run``, so each of the (up to a
+hundred or more) runs per update starts by copying the full batch into TF.
+Here the data is uploaded once per epoch into (non-saved) TF variables, and
+the losses are built on inputs that read those variables unless fed, so the
+training runs need no feeds at all.
+
+"""
+import tensorflow as tf
+
+
+class ResidentBatch:
+    """
+    One epoch of data for a set of placeholders, kept in TF variables.
+
+    For each placeholder in ``phs`` there is an input (in ``inputs``): a
+    ``tf.placeholder_with_default`` that reads the matching variable. Build
+    the batch right after the placeholders, and build the actor-critic,
+    losses and train ops on ``inputs`` instead. Ops run without feeds then
+    use the resident data, and feeding an input (e.g. observations, when
+    acting) works as it would for a placeholder. The placeholders
+    themselves only feed ``load``.
+
+    The variables are local variables, so they are not written to
+    ``tf1_save``. Run ``initializer`` before use.
+    """
+
+    def __init__(self, phs, size, indexed=False, scope='resident'):
+        """
+        Args:
+            phs (list): Placeholders, each with a leading batch dimension.
+
+            size (int): Number of samples per epoch.
+
+            indexed (bool): Make the inputs gather the rows given by
+                ``idxs_ph`` (all rows unless fed), so that minibatches
+                can be selected by feeding only their indices.
+
+            scope (str): Variable scope for the data variables.
+        """
+        self.phs = phs
+        with tf.variable_scope(scope):
+            self.vars = [tf.get_variable('data%d'%i, [size] + ph.shape.as_list()[1:], ph.dtype,
+                                         tf.zeros_initializer(), trainable=False,
+                                         collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                         for i, ph in enumerate(phs)]
+            if indexed:
+                self.idxs_ph = tf.placeholder_with_default(tf.range(size), [None], name='idxs_ph')
+            self.inputs = [tf.placeholder_with_default(tf.gather(var, self.idxs_ph) if indexed
+                                                       else var.value(), ph.shape)
+                           for ph, var in zip(phs, self.vars)]
+            self.load_op = tf.group([tf.assign(var, ph) for var, ph in zip(self.vars, phs)])
+        self.initializer = tf.variables_initializer(self.vars)
+
+    def load(self, sess, data):
+        """Upload one epoch of data (arrays in the order of ``phs``)."""
+        sess.run(self.load_op, feed_dict=dict(zip(self.phs, data)))
@@ -0,0 +1,85 @@
+"""
+
+Session settings for the TF1 algorithms.
+
+By default a ``tf.Session`` sizes its inter- and intra-op thread pools to
+all cores of the machine. Under ``mpi_fork`` every process does the same,
+so N processes run N full sets of threads that fight over the cores. Here
+the thread pools are sized from this process's share of the CPUs instead,
+as ``setup_pytorch_for_mpi`` does for PyTorch.
+
+Optionally, the ops that the update steps run are marked for XLA JIT
+compilation. (Global JIT in ``ConfigProto`` is ignored on CPU unless TF
+is started with ``TF_XLA_FLAGS=--tf_xla_cpu_global_jit``, while ops marked
+for compilation are compiled on any device.)
+
+"""
+import os
+import tensorflow as tf
+from spinup.utils.mpi_tools import num_procs
+
+
+def cpu_budget():
+    """Number of cores for this process: its share of the usable ones."""
+    if hasattr(os, 'sched_getaffinity'):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    return max(cores // num_procs(), 1)
+
+
+def session_kwargs(intra_op_threads=None, inter_op_threads=None, xla=False):
+    """
+    Fill in the thread counts for ``make_session``, so that the settings a
+    run actually used can be saved with its config.
+
+    Args:
+        intra_op_threads (int): Threads for parallelism within an op (e.g.
+            a matmul). Defaults to ``cpu_budget()``.
+
+        inter_op_threads (int): Threads for running independent ops
+            concurrently. The graphs here have little such parallelism,
+            so this defaults to ``min(2, cpu_budget())``.
+
+        xla (bool): Compile the update steps with XLA.
+    """
+    budget = cpu_budget()
+    return dict(intra_op_threads=intra_op_threads or budget,
+                inter_op_threads=inter_op_threads or min(2, budget),
+                xla=xla)
+
+
+def make_session(intra_op_threads, inter_op_threads, xla=False, update_ops=()):
+    """
+    Create a ``tf.Session`` with the given thread pools.
+
+    Args:
+        intra_op_threads (int): See ``session_kwargs``.
+
+        inter_op_threads (int): See ``session_kwargs``.
+
+        xla (bool): Mark every op that ``update_ops`` depend on for XLA
+            compilation. Build the whole update graph before calling this.
+
+        update_ops (list): The tensors and ops run by the update steps.
+    """
+    if xla:
+        _mark_for_xla(update_ops)
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                            inter_op_parallelism_threads=inter_op_threads)
+    return tf.Session(config=config)
+
+
+def _mark_for_xla(fetches):
+    """Mark the ops that ``fetches`` depend on as in ``jit_scope``."""
+    compile_attr = tf.AttrValue(b=True)
+    stack = [getattr(t, 'op', t) for t in fetches]
+    seen = set()
+    while stack:
+        op = stack.pop()
+        if op.name in seen:
+            continue
+        seen.add(op.name)
+        op._set_attr('_XlaCompile', compile_attr)
+        stack.extend(t.op for t in op.inputs)
+        stack.extend(op.control_inputs)
@@ -0,0 +1,210 @@
+"""
+
+Environment factories that share heavy, read-only state between env copies.
+
+Algorithms build environments with ``env_fn()``, and the off-policy ones call
+it twice (train and test env). For envs that load a large dataset or a
+predictive model on construction, that doubles startup time and memory.
+``SharedEnvFactory`` wraps an ``env_fn`` so that the expensive construction
+happens once per process, and every env it hands out refers to the same
+dataset arrays and model objects. Optionally, the dataset arrays are also
+backed by memory-mapped files, so that every process on a machine (e.g. the
+variants of an ExperimentGrid) maps the same physical pages.
+
+"""
+import copy
+import hashlib
+import numpy as np
+import os
+import os.path as osp
+import random
+import tempfile
+import types
+from spinup.utils.logx import colorize
+
+
+def _get_attr(obj, path):
+    for name in path.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+def _set_attr(obj, path, value):
+    *parents, name = path.split('.')
+    for p in parents:
+        obj = getattr(obj, p)
+    setattr(obj, name, value)
+
+# Objects with a __dict__ that are not worth searching for shared attributes
+_NO_SEARCH = (type, types.ModuleType, types.FunctionType, types.MethodType)
+
+
+class SharedEnvFactory:
+    """
+    Callable env factory which builds the wrapped env once and hands out
+    copies of it that share heavy attributes.
+
+    Use it anywhere an ``env_fn`` is expected:
+
+    .. code-block:: python
+
+        env_fn = SharedEnvFactory(lambda : gym.make('liveline-v0'),
+                                  cache_dir='/tmp/liveline_cache')
+        ddpg(env_fn, ...)
+
+    Every call returns a fresh deep copy of a pristine prototype env, except
+    that the shared attributes are not copied: all envs refer to the same
+    objects. Shared attributes must therefore be treated as read-only.
+    Random number generators found on the copy (``RandomState``,
+    ``Generator`` or ``random.Random`` attributes of the env, its wrappers
+    and the objects they hold) are replaced by freshly seeded ones, so that
+    e.g. the train and test envs draw different random streams. Their seeds
+    are derived from the global NumPy RNG, so runs stay reproducible under
+    ``np.random.seed``.
+
+    The factory holds no env until its first call, so it stays cheap to
+    pickle and send to a subprocess (as ExperimentGrid does).
+    """
+
+    def __init__(self, env_fn, shared_attrs=None, cache_dir=None, min_share_bytes=2**20,
+                 search_depth=3):
+        """
+        Args:
+            env_fn : A function which creates a copy of the environment.
+
+            shared_attrs (list): Attribute names (dotted paths allowed, e.g.
+                ``'dataset.inputs'``) on the unwrapped env to share between
+                copies. If None, they are searched for in the unwrapped env
+                and the objects it holds (e.g. ``env.lpp.data``): every numpy
+                array attribute of at least ``min_share_bytes``, and every
+                attribute with a ``predict`` method (i.e. model objects), is
+                shared.
+
+            cache_dir (string): If given, shared numpy arrays are written to
+                ``.npy`` files in this directory (once) and replaced by
+                read-only memory maps of those files, so that processes
+                using the same cache_dir share one physical copy. Files are
+                named after the attribute and a hash of the array's
+                contents, so a changed dataset never maps a stale file.
+
+            min_share_bytes (int): Size threshold for automatically shared
+                arrays.
+
+            search_depth (int): How many levels of attribute objects below
+                the unwrapped env are searched when ``shared_attrs`` is None.
+        """
+        self.env_fn = env_fn
+        self.shared_attrs = shared_attrs
+        self.cache_dir = cache_dir
+        self.min_share_bytes = min_share_bytes
+        self.search_depth = search_depth
+        self._proto = None
+        self._shared = None
+        self._seeds = None
+
+    def __getstate__(self):
+        # Never ship the prototype env to another process.
+        state = self.__dict__.copy()
+        state['_proto'], state['_shared'], state['_seeds'] = None, None, None
+        return state
+
+    def _find_shared_attrs(self, obj, prefix='', depth=0, seen=None):
+        # Depth-first over attribute objects; ``seen`` guards against cycles
+        # (and against sharing one object under two names).
+        seen = {id(obj)} if seen is None else seen
+        names = []
+        for k, v in vars(obj).items():
+            if id(v) in seen:
+                continue
+            if isinstance(v, np.ndarray):
+                if v.nbytes >= self.min_share_bytes:
+                    seen.add(id(v))
+                    names.append(prefix + k)
+            elif callable(getattr(v, 'predict', None)):
+                seen.add(id(v))
+                names.append(prefix + k)
+            elif depth < self.search_depth and isinstance(getattr(v, '__dict__', None), dict) \
+                    and not isinstance(v, _NO_SEARCH):
+                seen.add(id(v))
+                names += self._find_shared_attrs(v, prefix + k + '.', depth + 1, seen)
+        return names
+
+    def _reseed(self, obj, seeds, depth=0, seen=None):
+        # Same walk as _find_shared_attrs; ``seen`` starts with the shared
+        # objects, which are left alone.
+        seen = {id(obj)} if seen is None else seen
+        for k, v in vars(obj).items():
+            if id(v) in seen:
+                continue
+            seen.add(id(v))
+            if isinstance(v, np.random.RandomState):
+                setattr(obj, k, np.random.RandomState(np.random.MT19937(seeds.spawn(1)[0])))
+            elif isinstance(v, np.random.Generator):
+                setattr(obj, k, np.random.default_rng(seeds.spawn(1)[0]))
+            elif isinstance(v, random.Random):
+                setattr(obj, k, random.Random(int(seeds.spawn(1)[0].generate_state(1)[0])))
+            elif depth < self.search_depth and isinstance(getattr(v, '__dict__', None), dict) \
+                    and not isinstance(v, _NO_SEARCH):
+                self._reseed(v, seeds, depth + 1, seen)
+
+    def _memmap(self, name, arr):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        digest = hashlib.sha1(str((arr.shape, arr.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(arr).view(np.uint8).reshape(-1))
+        fname = osp.join(self.cache_dir, '%s-%s.npy'%(name, digest.hexdigest()[:16]))
+        if osp.exists(fname):
+            return np.load(fname, mmap_mode='r')
+        # Write to a temporary file and rename it, so concurrent processes
+        # never map a half-written file.
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, arr)
+        os.replace(tmp, fname)
+        return np.load(fname, mmap_mode='r')
+
+    def _build(self):
+        proto = self.env_fn()
+        base = proto.unwrapped
+        names = self.shared_attrs
+        if names is None:
+            names = self._find_shared_attrs(base)
+        shared = []
+        for name in names:
+            value = _get_attr(base, name)
+            if self.cache_dir is not None and isinstance(value, np.ndarray) \
+                    and not isinstance(value, np.memmap) and not value.dtype.hasobject:
+                value = self._memmap(name, value)
+                _set_attr(base, name, value)
+            shared.append(value)
+        if names:
+            print(colorize('SharedEnvFactory: sharing %s'%', '.join(names), color='cyan'))
+        else:
+            print(colorize('SharedEnvFactory: found no attributes to share, so every env '
+                           'is a full copy. Pass shared_attrs to name them.', color='yellow'))
+        self._proto, self._shared = proto, shared
+        self._seeds = np.random.SeedSequence(np.random.randint(2**31))
+
+    def __call__(self):
+        if self._proto is None:
+            self._build()
+        # Pre-seeding the memo makes deepcopy treat shared objects as
+        # already copied, so every copy refers to the originals.
+        memo = {id(v): v for v in self._shared}
+        try:
+            env = copy.deepcopy(self._proto, memo)
+        except Exception as e:
+            # Some unshared attribute can't be copied (e.g. a session handle).
+            # Fall back to building the env from scratch.
+            print(colorize('SharedEnvFactory: could not copy env (%r), building a new one. '
+                           'Add the offending attribute to shared_attrs to avoid this.'%e,
+                           color='yellow'))
+            return self.env_fn()
+        # The copy starts from the prototype's RNG states: give it its own
+        # (innermost wrapper layer first, so the base env is searched fully)
+        seeds = self._seeds.spawn(1)[0]
+        seen = {id(v) for v in self._shared}
+        layers = [env]
+        while getattr(layers[-1], 'env', None) is not None:
+            layers.append(layers[-1].env)
+        for layer in reversed(layers):
+            self._reseed(layer, seeds, seen=seen)
+        return env
@@ -1,14 +1,19 @@
 import time
 import joblib
+import numpy as np
 import os
 import os.path as osp
 import tensorflow as tf
 import torch
 from spinup import EpochLogger
 from spinup.utils.logx import restore_tf_graph
+from spinup.utils.numpy_policy import POLICY_HEADS, load_numpy_policy
+from spinup.utils.session_tf import make_session
+from spinup.utils.trajectory_recorder import TrajectoryRecorder
 
 
-def load_policy_and_env(fpath, itr='last', deterministic=False):
+def load_policy_and_env(fpath, itr='last', deterministic=False, frozen=False, quantize=False,
+                        mmap_mode='c', seed=None, sess_kwargs=None):
     """
     Load a policy from save, whether it's TF or PyTorch, along with RL env.
 
@@ -18,6 +23,74 @@ def load_policy_and_env(fpath, itr='last', deterministic=False):
     Checks to see if there's a tf1_save folder. If yes, assumes the model
     is tensorflow and loads it that way. Otherwise, loads as if there's a 
     PyTorch save.
+
+    With ``frozen=True``, loads the NumPy-only policy artifact written by
+    ``spinup/utils/export_policy.py`` instead. With ``quantize=True``, the
+    linear layers of a PyTorch policy are quantized to int8 (see
+    ``spinup/utils/quantize_pytorch.py``).
+
+    This just calls ``load_policy`` and ``load_env``; use either one alone
+    if you only need the policy or the env.
+    """
+    get_action = load_policy(fpath, itr, deterministic, frozen, quantize=quantize,
+                             seed=seed, sess_kwargs=sess_kwargs)
+    env = load_env(fpath, itr, mmap_mode)
+    return env, get_action
+
+
+def load_env(fpath, itr='last', mmap_mode='c'):
+    """
+    Load only the env from a save, or None if it could not be restored.
+
+    NumPy arrays inside the saved env (e.g. its dataset) are memory-mapped
+    from ``vars.pkl`` instead of read into memory, so loading is fast and
+    pages are only read from disk as the env touches them. The default
+    ``mmap_mode='c'`` is copy-on-write: the env may modify its arrays
+    without affecting the file. Pass ``mmap_mode=None`` to load everything
+    into memory.
+    """
+    _, itr = find_save(fpath, itr)
+
+    # try to load environment from save
+    # (sometimes this will fail because the environment could not be pickled)
+    try:
+        state = joblib.load(osp.join(fpath, 'vars'+itr+'.pkl'), mmap_mode=mmap_mode)
+        env = state['env']
+    except:
+        env = None
+
+    return env
+
+
+def load_policy(fpath, itr='last', deterministic=False, frozen=False, batched=False,
+                quantize=False, seed=None, sess_kwargs=None):
+    """
+    Load only the policy from a save (see ``load_policy_and_env``).
+
+    With ``batched=True``, the returned function maps a batch of
+    observations, shape (N, obs_dim), to a batch of actions.
+
+    For TF policies, ``seed`` reseeds the action noise of the restored
+    graph, and ``sess_kwargs`` are passed to ``session_tf.make_session``
+    (e.g. to limit its threads); both are ignored for other policies.
+    """
+    backend, itr = find_save(fpath, itr)
+    if frozen:
+        return load_frozen_policy(fpath, itr, deterministic, batched)
+    elif backend == 'tf1':
+        return load_tf_policy(fpath, itr, deterministic, batched, seed, sess_kwargs)
+    else:
+        return load_pytorch_policy(fpath, itr, deterministic, batched, quantize)
+
+
+def find_save(fpath, itr='last'):
+    """
+    Work out whether the saves in ``fpath`` are TF or PyTorch, and the
+    suffix of the save to load for iteration ``itr`` (an int or 'last').
+
+    Returns:
+        A tuple ``(backend, itr)`` with backend 'tf1' or 'pytorch' and itr
+        as the string suffix of the save files.
     """
 
     # determine if tf save or pytorch save
@@ -47,32 +120,18 @@ def load_policy_and_env(fpath, itr='last', deterministic=False):
             "Bad value provided for itr (needs to be int or 'last')."
         itr = '%d'%itr
 
-    # load the get_action function
-    if backend == 'tf1':
-        get_action = load_tf_policy(fpath, itr, deterministic)
-    else:
-        get_action = load_pytorch_policy(fpath, itr, deterministic)
+    return backend, itr
 
-    # try to load environment from save
-    # (sometimes this will fail because the environment could not be pickled)
-    try:
-        state = joblib.load(osp.join(fpath, 'vars'+itr+'.pkl'))
-        env = state['env']
-    except:
-        env = None
 
-    return env, get_action
-
-
-def load_tf_policy(fpath, itr, deterministic=False):
+def load_tf_policy(fpath, itr, deterministic=False, batched=False, seed=None, sess_kwargs=None):
     """ Load a tensorflow policy saved with Spinning Up Logger."""
 
     fname = osp.join(fpath, 'tf1_save'+itr)
     print('\n\nLoading from %s.\n\n'%fname)
 
     # load the things!
-    sess = tf.Session()
-    model = restore_tf_graph(sess, fname)
+    sess = make_session(**sess_kwargs) if sess_kwargs else tf.Session()
+    model = restore_tf_graph(sess, fname, seed)
 
     # get the correct op for executing actions
     if deterministic and 'mu' in model.keys():
@@ -84,12 +143,16 @@ def load_tf_policy(fpath, itr, deterministic=False):
         action_op = model['pi']
 
     # make function for producing an action given a single state
-    get_action = lambda x : sess.run(action_op, feed_dict={model['x']: x[None,:]})[0]
+    # (or, if batched, a batch of actions given a batch of states)
+    if batched:
+        get_action = lambda x : sess.run(action_op, feed_dict={model['x']: x})
+    else:
+        get_action = lambda x : sess.run(action_op, feed_dict={model['x']: x[None,:]})[0]
 
     return get_action
 
 
-def load_pytorch_policy(fpath, itr, deterministic=False):
+def load_pytorch_policy(fpath, itr, deterministic=False, batched=False, quantize=False):
     """ Load a pytorch policy saved with Spinning Up Logger."""
     
     fname = osp.join(fpath, 'pyt_save', 'model'+itr+'.pt')
@@ -97,7 +160,14 @@ def load_pytorch_policy(fpath, itr, deterministic=False):
 
     model = torch.load(fname)
 
+    # optionally swap in an int8 policy, validated against the fp32 one
+    # on observations recorded in the experiment directory
+    if quantize:
+        from spinup.utils.quantize_pytorch import quantize_policy, validation_observations
+        model = quantize_policy(model, validation_observations(fpath, model))
+
     # make function for producing an action given a single state
+    # (model.act works on batches as-is, so batched needs no special case)
     def get_action(x):
         with torch.no_grad():
             x = torch.as_tensor(x, dtype=torch.float32)
@@ -107,7 +177,36 @@ def load_pytorch_policy(fpath, itr, deterministic=False):
     return get_action
 
 
-def run_policy(env, get_action, max_ep_len=None, num_episodes=100, render=True):
+def load_frozen_policy(fpath, itr, deterministic=False, batched=False):
+    """ Load a frozen NumPy policy exported from a Spinning Up save."""
+
+    fname = osp.join(fpath, 'np_save', 'policy'+itr)
+    print('\n\nLoading from %s.\n\n'%fname)
+
+    policy = load_numpy_policy(fname)
+
+    # make function for producing an action given a single state
+    # (or, if batched, a batch of actions given a batch of states)
+    if batched:
+        get_action = lambda x : np.stack([policy.act(o, deterministic) for o in x])
+    else:
+        get_action = lambda x : policy.act(x, deterministic)
+
+    return get_action
+
+
+def run_policy(env, get_action, max_ep_len=None, num_episodes=100, render=True,
+               recorder=None, seed=None):
+    """
+    Run a policy in an environment and report episode returns and lengths.
+
+    If a ``TrajectoryRecorder`` is given as ``recorder``, every transition
+    is streamed to it (with the episode index under ``ep``). The caller
+    is responsible for closing the recorder.
+
+    If ``seed`` is given, episode ``n`` is seeded with ``seed + n`` (see
+    ``seed_episode``), so results match ``run_policy_parallel``.
+    """
 
     assert env is not None, \
         "Environment not found!\n\n It looks like the environment wasn't saved, " + \
@@ -115,22 +214,100 @@ def run_policy(env, get_action, max_ep_len=None, num_episodes=100, render=True):
         "page on Experiment Outputs for how to handle this situation."
 
     logger = EpochLogger()
-    o, r, d, ep_ret, ep_len, n = env.reset(), 0, False, 0, 0, 0
-    while n < num_episodes:
+    for n in range(num_episodes):
+        if seed is not None:
+            seed_episode(env, seed + n)
+        ep_ret, ep_len = run_episode(env, get_action, max_ep_len, render, recorder, n)
+        logger.store(EpRet=ep_ret, EpLen=ep_len)
+        print('Episode %d \t EpRet %.3f \t EpLen %d'%(n, ep_ret, ep_len))
+
+    logger.log_tabular('EpRet', with_min_and_max=True)
+    logger.log_tabular('EpLen', average_only=True)
+    logger.dump_tabular()
+
+
+def run_episode(env, get_action, max_ep_len=None, render=False, recorder=None, ep=0):
+    """ Run one episode and return its return and length."""
+    o, ep_ret, ep_len = env.reset(), 0, 0
+    while True:
         if render:
             env.render()
             time.sleep(1e-3)
 
         a = get_action(o)
-        o, r, d, _ = env.step(a)
+        o2, r, d, _ = env.step(a)
+        if recorder is not None:
+            recorder.store(obs=o, act=a, rew=r, next_obs=o2, done=d, ep=ep)
+        o = o2
         ep_ret += r
         ep_len += 1
 
         if d or (ep_len == max_ep_len):
+            return ep_ret, ep_len
+
+
+def seed_episode(env, seed):
+    """ Seed the env and the global NumPy and PyTorch RNGs."""
+    if hasattr(env, 'seed'):
+        env.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+# Policy and env of each worker process, loaded once by _init_worker
+_worker = {}
+
+def _init_worker(fpath, itr, deterministic, frozen, max_ep_len):
+    torch.set_num_threads(1)
+    backend, _ = find_save(fpath, itr)
+    if backend == 'tf1' and not frozen:
+        # The action noise of a TF graph can't be reseeded per episode, so
+        # act with a NumPy copy of the policy, which samples from np.random.
+        from spinup.utils.export_policy import extract_policy
+        head, params, kwargs, error = extract_policy(fpath, itr)
+        assert error <= 1e-4, \
+            "Could not convert the TF policy to NumPy (max error %.3g)."%error
+        policy = POLICY_HEADS[head](params, **kwargs)
+        # Like load_tf_policy, act deterministically only if the graph has 'mu'
+        deterministic = deterministic and head == 'squashed_gaussian'
+        _worker['env'] = load_env(fpath, itr)
+        _worker['get_action'] = lambda x : policy.act(x, deterministic)
+    else:
+        _worker['env'], _worker['get_action'] = load_policy_and_env(
+            fpath, itr, deterministic, frozen)
+    _worker['max_ep_len'] = max_ep_len
+
+def _worker_episode(seed):
+    seed_episode(_worker['env'], seed)
+    return run_episode(_worker['env'], _worker['get_action'], _worker['max_ep_len'])
+
+
+def run_policy_parallel(fpath, itr='last', deterministic=False, frozen=False, max_ep_len=None,
+                        num_episodes=100, workers=None, seed=0):
+    """
+    Evaluate a saved policy like ``run_policy`` (without rendering), with
+    episodes spread over a pool of worker processes.
+
+    Each worker loads the policy and env once. Episode ``n`` is seeded with
+    ``seed + n`` wherever it runs, so the statistics depend only on the
+    seed, not on the number of workers, and match ``run_policy`` called
+    with the same seed. TF policies are run as NumPy policies (see
+    ``spinup.utils.export_policy``), whose action noise is seeded per
+    episode too.
+
+    Args:
+        workers (int): Number of processes. Defaults to the number of CPUs.
+    """
+    import multiprocessing as mp
+    workers = workers or os.cpu_count()
+    logger = EpochLogger()
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(workers, _init_worker,
+                  (fpath, itr, deterministic, frozen, max_ep_len)) as pool:
+        results = pool.imap(_worker_episode, [seed + n for n in range(num_episodes)])
+        for n, (ep_ret, ep_len) in enumerate(results):
             logger.store(EpRet=ep_ret, EpLen=ep_len)
             print('Episode %d \t EpRet %.3f \t EpLen %d'%(n, ep_ret, ep_len))
-            o, r, d, ep_ret, ep_len = env.reset(), 0, False, 0, 0
-            n += 1
 
     logger.log_tabular('EpRet', with_min_and_max=True)
     logger.log_tabular('EpLen', average_only=True)
@@ -146,8 +323,40 @@ if __name__ == '__main__':
     parser.add_argument('--norender', '-nr', action='store_true')
     parser.add_argument('--itr', '-i', type=int, default=-1)
     parser.add_argument('--deterministic', '-d', action='store_true')
+    parser.add_argument('--frozen', '-f', action='store_true')
+    parser.add_argument('--quantize', '-q', action='store_true')
+    parser.add_argument('--record', '-r', type=str, default='')
+    parser.add_argument('--chunk_size', type=int, default=10000)
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Replace trajectories already recorded in the --record directory.')
+    parser.add_argument('--server', type=str, default='',
+                        help='Query the policy server on this socket instead of loading the policy.')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help='Run episodes in this many processes (requires --norender).')
+    parser.add_argument('--seed', '-s', type=int, default=None,
+                        help='Seed episode n with S + n. With --workers > 1, '
+                             'episodes are always seeded, from 0 if no seed is given.')
     args = parser.parse_args()
-    env, get_action = load_policy_and_env(args.fpath, 
-                                          args.itr if args.itr >=0 else 'last',
-                                          args.deterministic)
-    run_policy(env, get_action, args.len, args.episodes, not(args.norender))
\ No newline at end of file
+    if args.workers > 1:
+        assert args.norender and not (args.record or args.server or args.quantize), \
+            "Parallel evaluation does not support rendering, --record, --server or --quantize."
+        run_policy_parallel(args.fpath, args.itr if args.itr >=0 else 'last',
+                            args.deterministic, args.frozen, args.len, args.episodes,
+                            args.workers, args.seed or 0)
+    else:
+        if args.server:
+            from spinup.utils.policy_server import PolicyClient
+            env = load_env(args.fpath, args.itr if args.itr >=0 else 'last')
+            get_action = PolicyClient(args.server).act
+        else:
+            env, get_action = load_policy_and_env(args.fpath, 
+                                                  args.itr if args.itr >=0 else 'last',
+                                                  args.deterministic,
+                                                  args.frozen,
+                                                  args.quantize)
+        recorder = TrajectoryRecorder(args.record, args.chunk_size, overwrite=args.overwrite) \
+            if args.record else None
+        run_policy(env, get_action, args.len, args.episodes, not(args.norender), recorder,
+                   args.seed)
+        if recorder is not None:
+            recorder.close()
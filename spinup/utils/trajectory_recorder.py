@@ -0,0 +1,177 @@
+"""
+
+Streaming trajectory recording.
+
+Transitions are written into fixed-size chunks, and every full chunk is
+handed to a background thread which saves it as a compressed ``.npz`` file
+(path/to/output_directory/trajectories/chunk_00000.npz, ...). At most
+``max_pending`` full chunks wait for the writer at any time, so memory use
+stays bounded no matter how long the run is.
+
+"""
+import glob
+import numpy as np
+import os
+import os.path as osp
+import queue
+import threading
+
+_STOP = object()
+
+
+class TrajectoryRecorder:
+    """
+    Records transitions to disk in chunks, from a background writer thread.
+
+    Works from any loop that steps an environment. Typical use:
+
+    .. code-block:: python
+
+        recorder = TrajectoryRecorder(output_dir, chunk_size=10000)
+        ...
+        o2, r, d, _ = env.step(a)
+        recorder.store(obs=o, act=a, rew=r, next_obs=o2, done=d)
+        ...
+        recorder.close()
+
+    Every keyword given to ``store`` becomes one array in each chunk file.
+    The set of keywords, and the shape and dtype of each value, are fixed by
+    the first call to ``store``.
+    """
+
+    def __init__(self, output_dir, chunk_size=10000, max_pending=2, compress=True,
+                 overwrite=False):
+        """
+        Initialize a TrajectoryRecorder.
+
+        Args:
+            output_dir (string): Directory to write chunk files to. Chunks go
+                in a ``trajectories`` subfolder.
+
+            chunk_size (int): Number of transitions per chunk file.
+
+            max_pending (int): Number of full chunks allowed to wait for the
+                writer. When the writer falls this far behind, ``store``
+                blocks until it catches up.
+
+            compress (bool): Whether to write chunks with
+                ``np.savez_compressed`` (slower, smaller) or ``np.savez``.
+
+            overwrite (bool): Delete chunks already in the ``trajectories``
+                subfolder (from an earlier recording). Otherwise, finding
+                any is an error, since the new chunks would overwrite some
+                of them and ``load_trajectories`` would mix the two runs.
+        """
+        self.output_dir = osp.join(output_dir, 'trajectories')
+        os.makedirs(self.output_dir, exist_ok=True)
+        old_chunks = glob.glob(osp.join(self.output_dir, 'chunk_*.npz'))
+        if old_chunks and not overwrite:
+            raise ValueError('%s already holds %d recorded chunks. Record into another '
+                             'directory, or pass overwrite=True to replace them.'
+                             % (self.output_dir, len(old_chunks)))
+        for fname in old_chunks:
+            os.remove(fname)
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.keys = None
+        self.chunk = None
+        self.ptr, self.num_chunks, self.num_stored = 0, 0, 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _new_chunk(self, template):
+        return {k: np.zeros((self.chunk_size,) + v.shape, dtype=v.dtype)
+                for k, v in template.items()}
+
+    def store(self, **kwargs):
+        """
+        Append one transition. Values may be scalars or arrays.
+        """
+        self._check_writer()
+        if self.chunk is None:
+            template = {k: np.asarray(v) for k, v in kwargs.items()}
+            self.keys = sorted(template.keys())
+            self.chunk = self._new_chunk(template)
+        elif sorted(kwargs) != self.keys:
+            missing = sorted(set(self.keys) - set(kwargs))
+            unexpected = sorted(set(kwargs) - set(self.keys))
+            raise ValueError("Trying to store keys %s, but recorder was set up with keys %s "
+                             "(missing: %s, unexpected: %s)"
+                             % (sorted(kwargs), self.keys, missing, unexpected))
+        for k, v in kwargs.items():
+            self.chunk[k][self.ptr] = v
+        self.ptr += 1
+        self.num_stored += 1
+        if self.ptr == self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self.ptr == 0:
+            return
+        data = self.chunk if self.ptr == self.chunk_size else \
+            {k: v[:self.ptr] for k, v in self.chunk.items()}
+        fname = osp.join(self.output_dir, 'chunk_%05d.npz' % self.num_chunks)
+        # Blocks if the writer already has max_pending chunks to deal with.
+        self._queue.put((fname, data))
+        self.num_chunks += 1
+        # The old chunk now belongs to the writer, so start a fresh one.
+        self.chunk = self._new_chunk({k: v[0] for k, v in self.chunk.items()})
+        self.ptr = 0
+
+    def _write_loop(self):
+        save = np.savez_compressed if self.compress else np.savez
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            fname, data = item
+            try:
+                if self._error is None:
+                    save(fname, **data)
+            except Exception as e:
+                self._error = e
+
+    def _check_writer(self):
+        if self._error is not None:
+            raise RuntimeError('Trajectory writer failed.') from self._error
+
+    def close(self):
+        """
+        Write out any partial chunk and wait for the writer to finish.
+        """
+        if self._writer.is_alive():
+            if self.chunk is not None:
+                self._flush()
+            self._queue.put(_STOP)
+            self._writer.join()
+        self._check_writer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_trajectories(fpath, keys=None):
+    """
+    Iterate over the chunks written by a TrajectoryRecorder, in order.
+
+    Only one chunk is held in memory at a time.
+
+    Args:
+        fpath (string): The ``output_dir`` the recorder was given, or its
+            ``trajectories`` subfolder.
+
+        keys (list): Optional subset of arrays to load from each chunk.
+
+    Yields:
+        A dict mapping each key to an array with one row per transition.
+    """
+    if osp.isdir(osp.join(fpath, 'trajectories')):
+        fpath = osp.join(fpath, 'trajectories')
+    for fname in sorted(glob.glob(osp.join(fpath, 'chunk_*.npz'))):
+        with np.load(fname) as chunk:
+            yield {k: chunk[k] for k in (keys or chunk.files)}
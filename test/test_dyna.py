@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+import torch
+
+from spinup.algos.pytorch.sac.sac import ReplayBuffer
+from spinup.utils.dyna_pytorch import DynaModel
+
+
+OBS_DIM, ACT_DIM = 3, 2
+
+
+def filled_buffer(n=500):
+    rng = np.random.RandomState(0)
+    buf = ReplayBuffer(OBS_DIM, ACT_DIM, n)
+    for _ in range(n):
+        o = rng.randn(OBS_DIM)
+        buf.store(o, rng.rand(ACT_DIM), 1., o + 0.1, 0.)
+    return buf
+
+
+def policy(o):
+    return torch.zeros(len(o), ACT_DIM)
+
+
+class TestDynaModel(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        torch.manual_seed(0)
+
+    def test_real_ratio(self):
+        ''' Batches hold real and imagined transitions in the given ratio '''
+        buf = filled_buffer()
+        dyna = DynaModel(OBS_DIM, ACT_DIM, hidden_sizes=(16,), train_iters=5,
+                         rollout_batch_size=100)
+        # Mark imagined transitions by their reward
+        dyna.model_buffer.store_batch(np.zeros((100, OBS_DIM)), np.zeros((100, ACT_DIM)),
+                                      -np.ones(100), np.zeros((100, OBS_DIM)), np.zeros(100))
+        for real_ratio in [0.25, 0.5, 0.9, 1.0]:
+            batch = dyna.sample_batch(buf, 100, real_ratio)
+            self.assertEqual(len(batch['rew']), 100)
+            self.assertEqual(int((batch['rew'] == 1).sum()), int(round(100 * real_ratio)))
+
+    def test_empty_model_buffer(self):
+        ''' Before any rollouts, batches are all real '''
+        buf = filled_buffer()
+        dyna = DynaModel(OBS_DIM, ACT_DIM, hidden_sizes=(16,))
+        batch = dyna.sample_batch(buf, 64, 0.5)
+        self.assertTrue(bool((batch['rew'] == 1).all()))
+
+    def test_terminal_masking(self):
+        ''' Terminal flags come from termination_fn, and rollouts stop there '''
+        buf = filled_buffer()
+        term = lambda o, a, o2: o2[:, 0] > 0
+        dyna = DynaModel(OBS_DIM, ACT_DIM, hidden_sizes=(16,), train_iters=20,
+                         rollout_batch_size=200, rollout_horizon=3, termination_fn=term)
+        loss = dyna.train(buf)
+        self.assertTrue(np.isfinite(loss))
+        dyna.generate(buf, policy)
+
+        mb = dyna.model_buffer
+        n = mb.size
+        obs, obs2, done = mb.obs_buf[:n], mb.obs2_buf[:n], mb.done_buf[:n]
+        np.testing.assert_array_equal(done, term(obs, None, obs2))
+        self.assertGreater(done.sum(), 0)
+        self.assertLess(done.sum(), n)
+
+        # Each step rolls out only from the non-terminal states of the last
+        first = done[:200]
+        second = done[200:200 + int((first == 0).sum())]
+        self.assertEqual(len(second), int((first == 0).sum()))
+        np.testing.assert_array_equal(obs[200:200 + len(second)], obs2[:200][first == 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
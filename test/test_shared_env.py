@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+import gym
+import numpy as np
+
+from spinup.utils.shared_env import SharedEnvFactory
+
+
+class Noise:
+    def __init__(self):
+        self.rng = np.random.RandomState(0)
+
+
+class NoisyEnv(gym.Env):
+    observation_space = gym.spaces.Box(-1, 1, (1,), np.float32)
+    action_space = gym.spaces.Box(-1, 1, (1,), np.float32)
+
+    def __init__(self):
+        self.data = np.arange(2**18, dtype=np.float64)
+        self.rs = np.random.RandomState(0)
+        self.gen = np.random.default_rng(0)
+        self.py_rng = random.Random(0)
+        self.noise = Noise()
+
+    def draw(self):
+        return (self.rs.rand(), self.gen.random(), self.py_rng.random(), self.noise.rng.rand())
+
+
+def make_env():
+    return NoisyEnv()
+
+
+class TestSharedEnvFactory(unittest.TestCase):
+    def test_copies_draw_different_streams(self):
+        ''' Each env gets its own RNG states, but shares the dataset '''
+        np.random.seed(0)
+        env_fn = SharedEnvFactory(make_env)
+        env, test_env = env_fn(), env_fn()
+        self.assertIs(env.data, test_env.data)
+        for a, b in zip(env.draw(), test_env.draw()):
+            self.assertNotEqual(a, b)
+
+    def test_reproducible(self):
+        ''' Copies draw the same streams under the same global seed '''
+        draws = []
+        for _ in range(2):
+            np.random.seed(0)
+            env_fn = SharedEnvFactory(make_env)
+            draws.append([env_fn().draw() for _ in range(2)])
+        self.assertEqual(draws[0], draws[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
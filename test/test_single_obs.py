@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import copy
+import inspect
+import io
+import unittest
+
+import numpy as np
+import torch
+from gym.spaces import Box, Discrete
+
+from spinup.algos.pytorch.ddpg import core as ddpg_core
+from spinup.algos.pytorch.ppo import core as ppo_core
+from spinup.algos.pytorch.sac import core as sac_core
+from spinup.algos.pytorch.td3 import core as td3_core
+
+
+OBS_SPACE = Box(-1, 1, (5,), np.float32)
+
+
+def deterministic_act(ac):
+    """Batch and single-observation deterministic action functions."""
+    if isinstance(ac, sac_core.MLPActorCritic):
+        return (lambda o: ac.act(torch.as_tensor(o[None]), deterministic=True)[0],
+                lambda o: ac.act_single(o, deterministic=True))
+    if isinstance(ac, ppo_core.MLPActorCritic):
+        # step draws from the torch RNG; reseed so both draw the same action
+        def seeded(f):
+            def act(o):
+                torch.manual_seed(0)
+                return f(o)
+            return act
+        return (seeded(lambda o: ac.act(torch.as_tensor(o[None]))[0]),
+                seeded(ac.act_single))
+    return (lambda o: ac.act(torch.as_tensor(o[None]))[0], ac.act_single)
+
+
+def save_and_load(ac):
+    f = io.BytesIO()
+    torch.save(ac, f)
+    f.seek(0)
+    # Load the whole module (PyTorch >= 2.6 loads only weights by default)
+    kwargs = {}
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        kwargs['weights_only'] = False
+    return torch.load(f, **kwargs)
+
+
+class TestSingleObsCache(unittest.TestCase):
+    def models(self):
+        torch.manual_seed(0)
+        act_box = Box(-1, 1, (2,), np.float32)
+        return [ppo_core.MLPActorCritic(OBS_SPACE, act_box),
+                ppo_core.MLPActorCritic(OBS_SPACE, Discrete(3)),
+                sac_core.MLPActorCritic(OBS_SPACE, act_box),
+                td3_core.MLPActorCritic(OBS_SPACE, act_box),
+                ddpg_core.MLPActorCritic(OBS_SPACE, act_box)]
+
+    def check_copy(self, copy_fn):
+        rng = np.random.RandomState(0)
+        for ac in self.models():
+            o = rng.randn(5).astype(np.float32)
+            deterministic_act(ac)[1](o)         # build the cache
+            ac2 = copy_fn(ac)
+            act, act_single = deterministic_act(ac2)
+            for _ in range(3):
+                o = rng.randn(5).astype(np.float32)
+                np.testing.assert_allclose(act_single(o), act(o), rtol=1e-5, atol=1e-6)
+
+    def test_save_load(self):
+        ''' Fast path of a reloaded model sees new observations '''
+        self.check_copy(save_and_load)
+
+    def test_deepcopy(self):
+        ''' Fast path of a deep copy sees new observations '''
+        self.check_copy(copy.deepcopy)
+
+
+if __name__ == '__main__':
+    unittest.main()